@@ -1,12 +1,552 @@
-from flask import Flask, jsonify
+import base64
+import json
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from flask import Flask, g, jsonify, request, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
+from sqlalchemy import text as sql_text
+from sqlalchemy.exc import ProgrammingError
+from hotel_ibs import db as database
+
+load_dotenv()
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["X-Next-Cursor"])
+# Connection settings and pool tuning shared with the scripts (hotel_ibs/db.py)
+app.config["SQLALCHEMY_DATABASE_URI"] = database.database_url()
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = database.engine_options()
 db = SQLAlchemy(app)
+with app.app_context():
+    database.install_health_checks(db.engine)
+
+from backend.models import AvailabilityPrice, Chain, Hotel, Image, ImageTag, Tag  # Import all your models
+from backend.calendar_index import CalendarIndex, parse_date
+from backend.geo_index import GeoIndex
+from backend.search_cache import SearchCache
+from backend.semantic_search import SemanticSearch
+from backend.signed_urls import UrlSigner, object_key
+from backend.tag_index import TagIndex
+from backend.tag_suggest import TagSuggester
+from hotel_ibs import metrics
+from hotel_ibs.data_versions import READ_SQL as READ_DATA_VERSIONS_SQL
+from hotel_ibs.roaring import RoaringBitmap
+from hotel_ibs.snapshot import Snapshot, current_version as current_snapshot_version
+from hotel_ibs.tag_bitmaps import BooleanQuery, TagBitmaps, TAG_BITMAPS_PATH
+
+semantic_search = SemanticSearch().load()
+url_signer = UrlSigner()
+
+# Request latency per endpoint (streamed bodies included) and the time spent
+# in each phase of a search, served at /metrics with the cache, index and
+# connection pool gauges below. Gauges are only computed when scraped.
+REQUEST_SECONDS = metrics.histogram(
+    "http_request_duration_seconds", "Time to answer a request, streaming included", ["endpoint", "method", "status"])
+SEARCH_PHASE_SECONDS = metrics.histogram(
+    "search_phase_seconds", "Time spent in each phase of a search", ["endpoint", "phase"])
+INDEX_REFRESH_DURATION = metrics.histogram(
+    "index_refresh_seconds", "Time to read new tags, nights and hotels into the in-memory indexes")
+
+def search_phase(phase):
+    """Time a with block as one phase (filters, ranking, details, db, signing, serialization) of the current search."""
+    return SEARCH_PHASE_SECONDS.time(endpoint=request.endpoint, phase=phase)
+
+def pool_connections():
+    pool = db.engine.pool
+    if not hasattr(pool, "checkedout"):
+        return {}  # Pools without a fixed size (NullPool, StaticPool)
+    return {("checked_out",): pool.checkedout(), ("idle",): pool.checkedin(), ("overflow",): max(pool.overflow(), 0)}
+
+metrics.gauge("db_pool_connections", "Database connections of the pool by state", ["state"],
+              function=pool_connections)
+metrics.counter("search_cache_lookups_total", "Search cache lookups by result", ["result"],
+                function=lambda: {("hit",): search_cache.hits, ("miss",): search_cache.misses,
+                                  ("error",): search_cache.errors})
+metrics.gauge("search_cache_hit_ratio", "Share of search cache lookups that were hits",
+              function=lambda: search_cache.stats()["hit_rate"])
+metrics.gauge("search_cache_entries", "Entries in the local search cache",
+              function=lambda: search_cache.stats().get("entries", 0))
+metrics.counter("signed_url_lookups_total", "Signed URL requests by result", ["result"],
+                function=lambda: {("hit",): url_signer.hits, ("signed",): url_signer.signed})
+metrics.gauge("index_size", "Entries of the in-memory indexes", ["index"],
+              function=lambda: {("tag_images",): len(indexes.tag_index),
+                                ("calendar_hotels",): len(indexes.calendar_index),
+                                ("geo_hotels",): len(indexes.geo_index), ("suggest_tags",): len(tag_suggester)})
+
+@app.before_request
+def start_request_timer():
+    g.request_started_at = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    started_at = g.pop("request_started_at", None)
+    if started_at is not None:
+        labels = {"endpoint": request.endpoint or "unmatched", "method": request.method,
+                  "status": response.status_code}
+        # Called once the body, possibly streamed, has been sent
+        response.call_on_close(lambda: REQUEST_SECONDS.observe(time.perf_counter() - started_at, **labels))
+    return response
+
+# Tags and the price/availability calendar are served from memory. New tags
+# and nights are picked up incrementally at most every INDEX_REFRESH_SECONDS,
+# or right away via /api/index/refresh.
+INDEX_REFRESH_SECONDS = int(os.getenv("INDEX_REFRESH_SECONDS", "60"))
+# The indexes start from the newest snapshot written by
+# scripts/10_export_snapshot.py, memory-mapped, and then only read the rows
+# written after it. A newer snapshot, checked for every SNAPSHOT_CHECK_SECONDS,
+# is loaded in a background thread and swapped in once ready.
+SNAPSHOT_CHECK_SECONDS = int(os.getenv("SNAPSHOT_CHECK_SECONDS", "60"))
+
+class SearchIndexes:
+    """
+    A snapshot (or None) and the tag, calendar and geo indexes loaded from
+    it. A newer snapshot replaces the whole object with one assignment, so a
+    request that reads `indexes` once sees one consistent set throughout.
+    """
+
+    def __init__(self, snapshot=None):
+        self.snapshot = snapshot
+        self.tag_index, self.calendar_index, self.geo_index = TagIndex(), CalendarIndex(), GeoIndex()
+        if snapshot is not None:
+            for index in (self.tag_index, self.calendar_index, self.geo_index):
+                index.load_snapshot(snapshot)
+
+indexes = SearchIndexes(Snapshot.open())
+tag_suggester = TagSuggester()
+indexes_refreshed_at = 0.0
+snapshot_checked_at = time.time()
+snapshot_loader = None
+loaded_indexes = None  # SearchIndexes of a newer snapshot, ready to be swapped in
+snapshot_lock = threading.Lock()
+
+def load_snapshot_in_background():
+    global loaded_indexes, snapshot_loader
+    try:
+        loaded_indexes = SearchIndexes(Snapshot.open())
+    except Exception:
+        app.logger.exception("Could not load the snapshot")
+    finally:
+        snapshot_loader = None
+
+def swap_snapshot():
+    """Swap in a snapshot loaded in the background, or start loading a newer one. True after a swap."""
+    global indexes, loaded_indexes, snapshot_loader, snapshot_checked_at
+    with snapshot_lock:
+        if loaded_indexes is not None:
+            indexes, loaded_indexes = loaded_indexes, None
+            return True
+        if snapshot_loader is None and time.time() - snapshot_checked_at > SNAPSHOT_CHECK_SECONDS:
+            snapshot_checked_at = time.time()
+            version = current_snapshot_version()
+            if version is not None and (indexes.snapshot is None or version != indexes.snapshot.version):
+                snapshot_loader = threading.Thread(target=load_snapshot_in_background, daemon=True)
+                snapshot_loader.start()
+        return False
+
+def refresh_indexes(force=False):
+    global indexes_refreshed_at
+    swapped = swap_snapshot()
+    if swapped:
+        search_cache.invalidate()
+    current = indexes
+    if force or swapped or time.time() - indexes_refreshed_at > INDEX_REFRESH_SECONDS:
+        indexes_refreshed_at = time.time()
+        with INDEX_REFRESH_DURATION.time():
+            # Hotel locations rarely change: load them once, and again on a forced refresh
+            if (force or not len(current.geo_index)) and not swapped:
+                current.geo_index.refresh(db.session, Hotel)
+            updated_images = current.tag_index.refresh(db.session, ImageTag, Image, Tag)
+            if updated_images or swapped or not len(tag_suggester):
+                tag_suggester.update(current.tag_index.tag_counts())
+            return {
+                "updated_images": updated_images,
+                "updated_hotels": current.calendar_index.refresh(db.session, AvailabilityPrice),
+            }
+    return {"updated_images": 0, "updated_hotels": 0}
+
+# Search responses are cached on the normalized query and the version counters
+# bumped by the import scripts, polled at most every DATA_VERSION_CHECK_SECONDS.
+DATA_VERSION_CHECK_SECONDS = int(os.getenv("DATA_VERSION_CHECK_SECONDS", "5"))
+search_cache = SearchCache()
+data_versions = {}
+data_versions_checked_at = 0.0
+
+def current_data_versions():
+    """
+    {name: version} of the data behind the search results. A change
+    refreshes the indexes right away and retires the cached results.
+    """
+    global data_versions, data_versions_checked_at
+    if time.time() - data_versions_checked_at > DATA_VERSION_CHECK_SECONDS:
+        data_versions_checked_at = time.time()
+        try:
+            versions = dict(db.session.execute(sql_text(READ_DATA_VERSIONS_SQL)).fetchall())
+        except ProgrammingError:
+            db.session.rollback()  # No script has bumped a version yet
+            versions = {}
+        if versions != data_versions:
+            data_versions = versions
+            refresh_indexes(force=True)
+            search_cache.invalidate()
+    return data_versions
+
+def cached_search(endpoint, params, versions, search):
+    """
+    Serve search() from the cache, computing and storing it on a miss.
+
+    search() returns (results, headers). A list of results is sent as one
+    JSON body; an iterator of JSON text chunks is streamed as it is produced
+    and cached once the stream completes.
+    """
+    key = search_cache.key(endpoint, params, versions)
+    cached = search_cache.get(key)
+    if cached is not None:
+        body, headers = cached
+        return app.response_class(body, mimetype="application/json", headers=headers)
+    results, headers = search()
+    if isinstance(results, list):
+        with search_phase("serialization"):
+            body = app.json.dumps(results).encode("utf-8")
+        search_cache.put(key, body, headers)
+        return app.response_class(body, mimetype="application/json", headers=headers)
+
+    def stream():
+        chunks = []
+        for chunk in results:
+            chunks.append(chunk)
+            yield chunk
+        search_cache.put(key, "".join(chunks).encode("utf-8"), headers)
+    return app.response_class(stream_with_context(stream()), mimetype="application/json", headers=headers)
+
+# Pages of tag search results are addressed by an opaque cursor: the
+# (score, image_id) of the previous page's last result.
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "100"))
+SEARCH_MAX_PAGE_SIZE = int(os.getenv("SEARCH_MAX_PAGE_SIZE", "1000"))
+STREAM_CHUNK_ROWS = 200  # results serialized (and sent) per chunk
+
+def encode_cursor(score, image_id):
+    return base64.urlsafe_b64encode(json.dumps([score, image_id]).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    try:
+        score, image_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(score), int(image_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def json_array(batches):
+    """Serialize batches of results as the chunks of one JSON array."""
+    yield "["
+    first = True
+    for batch in batches:
+        if batch:
+            with search_phase("serialization"):
+                chunk = ("" if first else ",") + ",".join(app.json.dumps(result) for result in batch)
+            yield chunk
+            first = False
+    yield "]"
+
+def url_versions():
+    """Cached responses carry signed URLs: key them on the signing bucket too."""
+    return {"url_bucket": url_signer.current_bucket()} if url_signer.enabled else {}
+
+def filter_params():
+    """Normalized hotel filter parameters, part of every search cache key."""
+    check_in = parse_date(request.args.get("startDate"))
+    check_out = parse_date(request.args.get("endDate"))
+    return {
+        "minPrice": request.args.get("minPrice", type=float),
+        "maxPrice": request.args.get("maxPrice", type=float),
+        "startDate": check_in.isoformat() if check_in else None,
+        "endDate": check_out.isoformat() if check_out else None,
+        "lat": request.args.get("lat", type=float),
+        "lon": request.args.get("lon", type=float),
+        "radiusKm": request.args.get("radiusKm", type=float),
+        "bbox": request.args.get("bbox"),
+    }
+
+def bookable_hotels(calendar_index):
+    """
+    {hotel_id: average nightly price} of hotels available on every night of
+    the requested stay within the price range, or None without a date range.
+    """
+    check_in = parse_date(request.args.get("startDate"))
+    check_out = parse_date(request.args.get("endDate"))
+    if check_in is None or check_out is None:
+        return None
+    return calendar_index.filter_hotels(
+        check_in, check_out,
+        request.args.get("minPrice", type=float),
+        request.args.get("maxPrice", type=float),
+    )
+
+def nearby_hotels(geo_index):
+    """
+    Hotels matching the location filter, or None without one:
+    lat, lon and radiusKm give {hotel_id: distance_km}; bbox=south,west,north,east
+    (a map viewport) gives the hotel ids inside it. Both can be combined.
+    """
+    lat = request.args.get("lat", type=float)
+    lon = request.args.get("lon", type=float)
+    radius_km = request.args.get("radiusKm", type=float)
+    bbox = request.args.get("bbox")
+    nearby = None
+    if lat is not None and lon is not None and radius_km is not None:
+        nearby = geo_index.within_radius(lat, lon, radius_km)
+    if bbox:
+        try:
+            south, west, north, east = (float(value) for value in bbox.split(","))
+        except ValueError:
+            raise ValueError("bbox must be south,west,north,east")
+        inside = geo_index.within_bbox(south, west, north, east)
+        nearby = {hotel_id: None for hotel_id in inside} if nearby is None else \
+            {hotel_id: distance for hotel_id, distance in nearby.items() if hotel_id in inside}
+    return nearby
+
+def hotel_filters(indexes):
+    """
+    Combine the location and stay filters into (hotel_ids, prices, distances).
+
+    Location is pruned first (one grid lookup) and only the nearby hotels'
+    calendars are checked. hotel_ids is None when neither filter is given.
+    """
+    nearby = nearby_hotels(indexes.geo_index)
+    prices = bookable_hotels(indexes.calendar_index)
+    if nearby is not None and prices is not None:
+        prices = {hotel_id: prices[hotel_id] for hotel_id in nearby if hotel_id in prices}
+    hotel_ids = prices if prices is not None else nearby
+    return hotel_ids, prices, nearby
+
+def with_hotel_details(result, prices, nearby):
+    if prices is not None:
+        result["avg_price_per_night"] = prices.get(result["hotel_id"])
+    if nearby is not None and nearby.get(result["hotel_id"]) is not None:
+        result["distance_km"] = round(nearby[result["hotel_id"]], 3)
+    return result
+
+# Boolean tag queries ("pool AND ocean AND NOT kids club") run on the tag
+# bitmaps built by scripts/08_build_tag_bitmaps.py, reloaded when rebuilt.
+tag_bitmaps = None
+tag_bitmaps_mtime = None
+
+def current_tag_bitmaps():
+    global tag_bitmaps, tag_bitmaps_mtime
+    try:
+        mtime = os.path.getmtime(TAG_BITMAPS_PATH)
+    except OSError:
+        return None
+    if mtime != tag_bitmaps_mtime:
+        tag_bitmaps = TagBitmaps.load(TAG_BITMAPS_PATH)
+        tag_bitmaps_mtime = mtime
+    return tag_bitmaps
+
+IMAGE_DETAILS_SQL = """
+    SELECT images.image_id, images.image_url, hotels.hotel_id, hotels.hotel_name, hotels.latitude, hotels.longitude
+    FROM images JOIN hotels ON images.hotel_id = hotels.hotel_id
+    WHERE images.image_id = ANY(%s::int[]);
+"""
+
+def image_rows(image_ids, snapshot):
+    """
+    Fetch image and hotel details for image_ids, keyed by image_id. They are
+    read from the snapshot when there is one; only images added after it are
+    fetched from the database. With an S3 bucket configured, image_url is a
+    pre-signed URL (signed as one batch).
+
+    Details found in the snapshot are served as exported: images and hotels
+    carry no update time to catch up from, so a later change to an image URL
+    or a hotel's name or location shows once the next snapshot is swapped in.
+    """
+    image_ids = [int(image_id) for image_id in image_ids]
+    details = {}
+    if snapshot is not None:
+        with search_phase("details"):
+            images = snapshot.lookup("images", "image_id", image_ids)
+            hotels = snapshot.lookup("hotels", "hotel_id", [image["hotel_id"] for image in images.values()])
+        for image_id, image in images.items():
+            hotel = hotels.get(image["hotel_id"])
+            if hotel is not None:
+                details[image_id] = {
+                    "image_id": image_id,
+                    "image_url": image["image_url"],
+                    "hotel_id": hotel["hotel_id"],
+                    "hotel_name": hotel["hotel_name"],
+                    "latitude": hotel["latitude"],
+                    "longitude": hotel["longitude"],
+                }
+    missing = [image_id for image_id in image_ids if image_id not in details]
+    if missing:
+        with search_phase("db"):
+            # A prepared statement on the session's pooled connection: planned once per connection
+            cursor = db.session.connection().connection.cursor()
+            database.execute_prepared(cursor, "image_details", IMAGE_DETAILS_SQL, (missing,))
+            rows = cursor.fetchall()
+            cursor.close()
+        for image_id, image_url, hotel_id, hotel_name, latitude, longitude in rows:
+            details[image_id] = {
+                "image_id": image_id,
+                "image_url": image_url,
+                "hotel_id": hotel_id,
+                "hotel_name": hotel_name,
+                "latitude": latitude,
+                "longitude": longitude,
+            }
+    if url_signer.enabled and details:
+        with search_phase("signing"):
+            urls = url_signer.sign_many([object_key(detail["image_url"]) for detail in details.values()])
+        expires_at = url_signer.expires_at()
+        for detail, url in zip(details.values(), urls):
+            detail["image_url"] = url
+            detail["image_url_expires_at"] = expires_at
+    return details
+
+def parse_terms(text):
+    """Split a tag query such as "pool, ocean" into its terms."""
+    return [term.strip() for term in text.split(",") if term.strip()]
+
+# Tag search, e.g. /api/images?tag=pool,ocean&mode=and&minConfidence=0.05&limit=100
+# or, with tag bitmaps built, /api/images?tag=pool AND ocean AND NOT kids club
+# Optional minPrice, maxPrice, startDate and endDate (check-out), and lat, lon,
+# radiusKm or bbox=south,west,north,east select the hotels first; only their
+# images are scored. Results are ordered by score, then image_id, and streamed
+# as a JSON array. A full page carries an X-Next-Cursor header; pass it back
+# as cursor=... for the next page.
+@app.route("/api/images")
+def search_images():
+    text = request.args.get("tag", "")
+    terms = parse_terms(text)
+    if not terms:
+        return jsonify([])
+
+    mode = "and" if request.args.get("mode", "or").lower() == "and" else "or"
+    min_confidence = request.args.get("minConfidence", 0.0, type=float)
+    limit = request.args.get("limit", request.args.get("k", SEARCH_PAGE_SIZE, type=int), type=int)
+    limit = max(1, min(limit, SEARCH_MAX_PAGE_SIZE))
+    cursor = request.args.get("cursor")
+    # Terms are matched case-insensitively and their order does not change the scores
+    terms = sorted({term.lower() for term in terms})
+
+    bitmaps = current_tag_bitmaps()
+    boolean = bitmaps is not None and BooleanQuery.is_boolean(text)
+
+    def search():
+        refresh_indexes()
+        current = indexes  # read once: a snapshot swapped in meanwhile does not mix into this request
+        with search_phase("filters"):
+            hotels, prices, nearby = hotel_filters(current)
+        after = decode_cursor(cursor) if cursor else None
+        with search_phase("ranking"):
+            if boolean:
+                allowed = None
+                if hotels is not None:
+                    allowed = RoaringBitmap.from_array(list(current.tag_index.images_of_hotels(hotels)))
+                matches = bitmaps.query(text, k=limit, allowed=allowed, after=after)
+            else:
+                matches = current.tag_index.search(terms, mode=mode, min_confidence=min_confidence,
+                                                   k=limit, hotel_ids=hotels, after=after)
+        headers = {}
+        if len(matches) == limit:
+            headers["X-Next-Cursor"] = encode_cursor(*matches[-1][::-1])
+
+        def batches():
+            # One query and one signing batch for the whole page, sent in chunks as it is serialized
+            details = image_rows([image_id for image_id, _ in matches], current.snapshot)
+            for start in range(0, len(matches), STREAM_CHUNK_ROWS):
+                batch = []
+                for image_id, score in matches[start:start + STREAM_CHUNK_ROWS]:
+                    if image_id not in details:
+                        continue
+                    tags = [
+                        {"tag_name": tag, "confidence_score": confidence}
+                        for tag, confidence in current.tag_index.image_tags.get(image_id, {}).items()
+                    ]
+                    result = {**details[image_id], "tags": tags, "score": score}
+                    batch.append(with_hotel_details(result, prices, nearby))
+                yield batch
+        return json_array(batches()), headers
+
+    try:
+        params = {
+            **filter_params(),
+            "tag": " ".join(text.split()) if boolean else terms,
+            "mode": mode, "minConfidence": min_confidence, "limit": limit, "cursor": cursor,
+        }
+        versions = {**current_data_versions(), "bitmaps": tag_bitmaps_mtime if boolean else None}
+        return cached_search("images", params, {**versions, **url_versions()}, search)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+# Tag completions for the search box, e.g. /api/tags/suggest?q=infin&limit=10
+# Tags are ranked by the number of images carrying them; misspelled input is
+# completed with similar tags.
+@app.route("/api/tags/suggest")
+def suggest_tags():
+    refresh_indexes()
+    limit = max(1, min(request.args.get("limit", 10, type=int), TagSuggester.MAX_RESULTS))
+    return jsonify([
+        {"tag": tag, "images": images}
+        for tag, images in tag_suggester.suggest(request.args.get("q", ""), limit)
+    ])
+
+@app.route("/api/index/refresh", methods=["POST"])
+def refresh_index():
+    updated = refresh_indexes(force=True)
+    search_cache.invalidate()
+    current = indexes
+    return jsonify({**updated, "indexed_images": len(current.tag_index), "indexed_hotels": len(current.calendar_index),
+                    "snapshot": current.snapshot.version if current.snapshot is not None else None})
+
+@app.route("/api/cache/stats")
+def cache_stats():
+    return jsonify({**search_cache.stats(), "signed_urls": url_signer.stats()})
+
+# Prometheus scrape target. Metrics are kept per process: with several
+# workers, scrape each one or aggregate them in Prometheus.
+@app.route("/metrics")
+def metrics_endpoint():
+    return app.response_class(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+# Free-text image search, e.g. /api/images/semantic?q=sunset over infinity pool
+# Pass exact=1 to bypass the ANN index and scan every embedding.
+@app.route("/api/images/semantic")
+def search_images_semantic():
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify([])
+    if not semantic_search.available:
+        return jsonify({"error": "No image embeddings available"}), 503
+
+    k = max(1, min(request.args.get("k", 50, type=int), 1000))
+    exact = request.args.get("exact", "0") == "1"
+    n_probe = request.args.get("nprobe", type=int)
+
+    def search():
+        refresh_indexes()
+        current = indexes
+        with search_phase("filters"):
+            hotels, prices, nearby = hotel_filters(current)
+        # Hotel filters are applied to the nearest neighbours, so fetch extra ones.
+        candidates = k if hotels is None else min(4 * k, 4000)
+        with search_phase("ranking"):
+            matches = semantic_search.search(query, k=candidates, exact=exact, n_probe=n_probe)
+        details = image_rows([image_id for image_id, _ in matches], current.snapshot)
+        results = []
+        for image_id, score in matches:
+            result = details.get(int(image_id))  # Embedding stores keep ids as strings
+            if result is None:
+                continue
+            if hotels is not None and result["hotel_id"] not in hotels:
+                continue
+            results.append(with_hotel_details({**result, "score": score}, prices, nearby))
+        return results[:k], {}
 
-from models import Chain, Hotel  # Import all your models
+    try:
+        params = {**filter_params(), "q": " ".join(query.split()), "k": k, "exact": exact, "nprobe": n_probe}
+        return cached_search("semantic", params, {**current_data_versions(), **url_versions()}, search)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
@@ -0,0 +1,203 @@
+"""Nightly price and availability calendar for every hotel."""
+import threading
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+
+class CalendarIndex:
+    """
+    Per-hotel prefix sums over nightly prices and availability.
+
+    Row h, column d of each matrix is the running total over the nights
+    before start + d days, so for any stay the sum of prices, the number of
+    priced nights and the number of unavailable nights are each one
+    subtraction per hotel. A night is available when its availability count
+    is above zero; nights without data count as unavailable.
+    """
+
+    # Columns are added in blocks so appending new nights rarely reallocates.
+    GROW_DAYS = 64
+
+    # See TagIndex.REFRESH_OVERLAP.
+    REFRESH_OVERLAP = timedelta(minutes=5)
+
+    def __init__(self):
+        self.start = None
+        self.days = 0
+        self.hotel_ids = np.empty(0, dtype=np.int64)
+        self.rows = {}
+        self.price_sums = np.zeros((0, 1), dtype=np.float64)
+        self.priced = np.zeros((0, 1), dtype=np.int16)
+        self.unavailable = np.zeros((0, 1), dtype=np.int16)
+        self.watermark = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.hotel_ids)
+
+    def _grow(self, hotel_ids, first_day, last_day):
+        """Make room for new hotels and for nights outside the current range."""
+        new_hotels = [hotel_id for hotel_id in dict.fromkeys(hotel_ids) if hotel_id not in self.rows]
+        if new_hotels:
+            for hotel_id in new_hotels:
+                self.rows[hotel_id] = len(self.rows)
+            self.hotel_ids = np.concatenate([self.hotel_ids, np.asarray(new_hotels, dtype=np.int64)])
+            pad = ((0, len(new_hotels)), (0, 0))
+            self.price_sums = np.pad(self.price_sums, pad)
+            self.priced = np.pad(self.priced, pad)
+            self.unavailable = np.pad(self.unavailable, pad)
+            # New hotels have no data yet: every existing night is unavailable.
+            self.unavailable[-len(new_hotels):] = np.arange(self.days + 1, dtype=np.int16)
+
+        if self.start is None:
+            self.start = first_day
+        before = max(0, (self.start - first_day).days)
+        after = max(0, (last_day - self.start).days + 1 + before - self.days)
+        if before or after:
+            if before:
+                before = -(-before // self.GROW_DAYS) * self.GROW_DAYS
+            if after:
+                after = -(-after // self.GROW_DAYS) * self.GROW_DAYS
+            prices, priced, available = self._nightly(np.arange(len(self.hotel_ids)))
+            pad = ((0, 0), (before, after))
+            self.start -= timedelta(days=before)
+            self.days += before + after
+            self._store(np.arange(len(self.hotel_ids)), np.pad(prices, pad),
+                        np.pad(priced, pad), np.pad(available, pad))
+
+    def _nightly(self, rows):
+        """Recover per-night prices, priced flags and availability for some rows."""
+        prices = np.diff(self.price_sums[rows], axis=1)
+        priced = np.diff(self.priced[rows], axis=1).astype(bool)
+        available = ~np.diff(self.unavailable[rows], axis=1).astype(bool)
+        return prices, priced, available
+
+    def _store(self, rows, prices, priced, available):
+        def prefix(values, dtype):
+            out = np.zeros((len(rows), values.shape[1] + 1), dtype=dtype)
+            np.cumsum(values, axis=1, out=out[:, 1:])
+            return out
+
+        if len(rows) == len(self.hotel_ids) and prices.shape[1] != self.price_sums.shape[1] - 1:
+            self.price_sums = prefix(prices, np.float64)
+            self.priced = prefix(priced, np.int16)
+            self.unavailable = prefix(~available, np.int16)
+        else:
+            self.price_sums[rows] = prefix(prices, np.float64)
+            self.priced[rows] = prefix(priced, np.int16)
+            self.unavailable[rows] = prefix(~available, np.int16)
+
+    def update(self, nights):
+        """
+        Apply (hotel_id, date, availability, price) rows.
+
+        Only the hotels present in the rows have their prefix sums rebuilt, so
+        a nightly feed or a new batch from 05_generate_availability_and_pricing.py
+        costs O(touched hotels x days), not a full rebuild.
+        """
+        nights = list(nights)
+        if not nights:
+            return 0
+        hotel_ids = [hotel_id for hotel_id, _, _, _ in nights]
+        dates = [night_date for _, night_date, _, _ in nights]
+        with self._lock:
+            self._grow(hotel_ids, min(dates), max(dates))
+            touched = np.unique([self.rows[hotel_id] for hotel_id in hotel_ids])
+            prices, priced, available = self._nightly(touched)
+            position = {row: i for i, row in enumerate(touched)}
+            for hotel_id, night_date, availability, price in nights:
+                i = position[self.rows[hotel_id]]
+                d = (night_date - self.start).days
+                prices[i, d] = float(price) if price is not None else 0.0
+                priced[i, d] = price is not None
+                available[i, d] = (availability or 0) > 0
+            self._store(touched, prices, priced, available)
+        return len(touched)
+
+    def load_snapshot(self, snapshot):
+        """Fill an empty calendar from the nights of a snapshot (hotel_ibs/snapshot.py) in one vectorized pass."""
+        nights = snapshot.tables["nights"]
+        hotel_ids = snapshot.array("nights", "hotel_id")
+        days = nights.column("date").to_numpy().astype("datetime64[D]")
+        availability = snapshot.array("nights", "availability")
+        prices = nights.column("price").to_numpy(zero_copy_only=False)
+        with self._lock:
+            if len(hotel_ids):
+                first = days.min()
+                columns = (days - first).astype(np.int64)
+                hotels, rows = np.unique(hotel_ids, return_inverse=True)
+                self.start = first.item()
+                self.days = -(-(int(columns.max()) + 1) // self.GROW_DAYS) * self.GROW_DAYS
+                self.hotel_ids = hotels.astype(np.int64)
+                self.rows = {hotel_id: row for row, hotel_id in enumerate(self.hotel_ids.tolist())}
+                nightly_prices = np.zeros((len(hotels), self.days))
+                priced = np.zeros((len(hotels), self.days), dtype=bool)
+                available = np.zeros((len(hotels), self.days), dtype=bool)
+                has_price = ~np.isnan(prices)
+                nightly_prices[rows, columns] = np.where(has_price, prices, 0.0)
+                priced[rows, columns] = has_price
+                available[rows, columns] = availability > 0
+                self.price_sums = np.zeros((len(hotels), self.days + 1))
+                self.priced = np.zeros((len(hotels), self.days + 1), dtype=np.int16)
+                self.unavailable = np.zeros((len(hotels), self.days + 1), dtype=np.int16)
+                self._store(np.arange(len(hotels)), nightly_prices, priced, available)
+            watermark = snapshot.manifest.get("prices_watermark")
+            self.watermark = datetime.fromisoformat(watermark) if watermark else None
+        return len(self.hotel_ids)
+
+    def stay(self, check_in, check_out):
+        """
+        Average nightly price and full availability of every hotel for the
+        nights from check_in up to (not including) check_out.
+
+        Returns (hotel_ids, average_prices, available_every_night) arrays.
+        """
+        with self._lock:
+            empty = (self.hotel_ids[:0], np.empty(0), np.empty(0, dtype=bool))
+            if self.start is None or check_out <= check_in:
+                return empty
+            first = (check_in - self.start).days
+            last = (check_out - self.start).days
+            if first < 0 or last > self.days:
+                return empty
+            nights = self.priced[:, last] - self.priced[:, first]
+            totals = self.price_sums[:, last] - self.price_sums[:, first]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                averages = np.where(nights > 0, totals / np.maximum(nights, 1), np.nan)
+            available = (self.unavailable[:, last] - self.unavailable[:, first]) == 0
+            return self.hotel_ids.copy(), averages, available
+
+    def filter_hotels(self, check_in, check_out, min_price=None, max_price=None):
+        """{hotel_id: average price} for hotels bookable every night within the price range."""
+        hotel_ids, averages, available = self.stay(check_in, check_out)
+        keep = available & ~np.isnan(averages)
+        if min_price is not None:
+            keep &= averages >= min_price
+        if max_price is not None:
+            keep &= averages <= max_price
+        return dict(zip(hotel_ids[keep].tolist(), averages[keep].tolist()))
+
+    def refresh(self, session, AvailabilityPrice):
+        """Load every night written since the last refresh (everything on the first call)."""
+        query = session.query(AvailabilityPrice.hotel_id, AvailabilityPrice.date,
+                              AvailabilityPrice.availability, AvailabilityPrice.price,
+                              AvailabilityPrice.updated_at)
+        with self._lock:
+            if self.watermark is not None:
+                query = query.filter(AvailabilityPrice.updated_at > self.watermark - self.REFRESH_OVERLAP)
+            nights, latest = [], self.watermark
+            for hotel_id, night_date, availability, price, updated_at in query.yield_per(100000):
+                nights.append((hotel_id, night_date, availability, price))
+                if updated_at is not None and (latest is None or updated_at > latest):
+                    latest = updated_at
+            touched = self.update(nights)
+            self.watermark = latest
+        return touched
+
+
+def parse_date(value):
+    """Parse 'YYYY-MM-DD' or an ISO timestamp as sent by the frontend."""
+    if not value:
+        return None
+    return date.fromisoformat(value[:10])
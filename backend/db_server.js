@@ -47,17 +47,18 @@ app.get("/api/images", async (req, res) => {
           hotels.longitude, 
           COALESCE(
               json_agg(
-                  json_build_object('tag_name', image_tags.tag_name, 'confidence_score', image_tags.confidence_score)
-              ) FILTER (WHERE image_tags.tag_name IS NOT NULL),
+                  json_build_object('tag_name', tags.tag_name, 'confidence_score', image_tags.confidence_q / 32767.0)
+              ) FILTER (WHERE tags.tag_name IS NOT NULL),
               '[]'
           ) AS tags,
           AVG(availability_price.price) AS avg_price_per_night
       FROM 
           images 
       JOIN hotels ON images.hotel_id = hotels.hotel_id
-      LEFT JOIN image_tags ON images.image_id = image_tags.image_id::TEXT
+      LEFT JOIN image_tags ON images.image_id = image_tags.image_id
+      LEFT JOIN tags ON tags.tag_id = image_tags.tag_id
       LEFT JOIN availability_price ON hotels.hotel_id = availability_price.hotel_id
-      WHERE image_tags.tag_name ILIKE $1
+      WHERE image_tags.tag_id IN (SELECT tag_id FROM tags WHERE tag_name ILIKE $1)
       AND availability_price.price BETWEEN $2 AND $3
       AND availability_price.date BETWEEN $4 AND $5
       GROUP BY 
@@ -70,16 +71,11 @@ app.get("/api/images", async (req, res) => {
     // Execute the query with the tag, price range, and date range as parameters.
     const values = [`%${tag}%`, minPrice, maxPrice, startDate, endDate];
 
-    // Print the query and its parameters
-    console.log("Executing query:", queryText);
-    console.log("With values:", values);
-
     const result = await pool.query(queryText, values);
     const images = result.rows;
 
     // Generate pre-signed URLs for each image.
     const updatedImages = images.map((image) => {
-      console.log("Original image_url:", image.image_url);
       const signedUrl = s3.getSignedUrl("getObject", {
         Bucket: process.env.AWS_S3_bucket,
         Key: image.image_url.replace(/^\.\//, ""), // Remove a leading "./" if present.
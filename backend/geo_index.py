@@ -0,0 +1,120 @@
+"""Grid index over hotel coordinates for radius and bounding-box search."""
+import math
+import threading
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat, lon, latitudes, longitudes):
+    """Great-circle distance in km from one point to arrays of points."""
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class GeoIndex:
+    """
+    Hotels bucketed into a CELL_DEGREES lat/lon grid.
+
+    Hotels are sorted by cell key (row * columns + column), so the cells of
+    one grid row within a longitude range are one contiguous slice found by
+    binary search. A query collects the slices of the rows it overlaps and
+    filters those candidates exactly.
+    """
+
+    CELL_DEGREES = 0.25
+
+    def __init__(self):
+        self.hotel_ids = np.empty(0, dtype=np.int64)
+        self.latitudes = np.empty(0)
+        self.longitudes = np.empty(0)
+        self.keys = np.empty(0, dtype=np.int64)
+        self.columns = int(round(360 / self.CELL_DEGREES))
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.hotel_ids)
+
+    def _row(self, lat):
+        return np.floor((np.asarray(lat) + 90) / self.CELL_DEGREES).astype(np.int64)
+
+    def _column(self, lon):
+        return np.floor((np.asarray(lon) + 180) / self.CELL_DEGREES).astype(np.int64) % self.columns
+
+    def build(self, hotels):
+        """Index (hotel_id, latitude, longitude) rows; hotels without coordinates are left out."""
+        rows = [(hotel_id, lat, lon) for hotel_id, lat, lon in hotels if lat is not None and lon is not None]
+        hotel_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        latitudes = np.array([row[1] for row in rows], dtype=np.float64)
+        longitudes = np.array([row[2] for row in rows], dtype=np.float64)
+        keys = self._row(latitudes) * self.columns + self._column(longitudes)
+        order = np.argsort(keys, kind="stable")
+        with self._lock:
+            self.hotel_ids = hotel_ids[order]
+            self.latitudes = latitudes[order]
+            self.longitudes = longitudes[order]
+            self.keys = keys[order]
+        return self
+
+    def refresh(self, session, Hotel):
+        """Rebuild from the hotels table (tens of thousands of rows: a full reload is cheap)."""
+        return self.build(session.query(Hotel.hotel_id, Hotel.latitude, Hotel.longitude).yield_per(100000))
+
+    def load_snapshot(self, snapshot):
+        """Rebuild from the hotels table of a snapshot (hotel_ibs/snapshot.py)."""
+        return self.build(snapshot.rows("hotels", ["hotel_id", "latitude", "longitude"]))
+
+    def _candidates(self, south, north, column_ranges):
+        """Positions of the hotels in the cells of rows south..north and the column ranges."""
+        first_row = max(int(self._row(south)), 0)
+        last_row = min(int(self._row(north)), int(self._row(90.0)))
+        slices = []
+        for row in range(first_row, last_row + 1):
+            for lo, hi in column_ranges:
+                start = np.searchsorted(self.keys, row * self.columns + lo, side="left")
+                stop = np.searchsorted(self.keys, row * self.columns + hi, side="right")
+                if stop > start:
+                    slices.append(np.arange(start, stop))
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+    def _column_ranges(self, west, east):
+        """Column ranges covering the longitudes west..east, split at the antimeridian."""
+        if east - west >= 360:
+            return [(0, self.columns - 1)]
+        lo, hi = int(self._column(west)), int(self._column(east))
+        if lo <= hi:
+            return [(lo, hi)]
+        return [(lo, self.columns - 1), (0, hi)]
+
+    def within_radius(self, lat, lon, radius_km):
+        """{hotel_id: distance_km} of the hotels within radius_km of (lat, lon)."""
+        with self._lock:
+            delta_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+            south, north = lat - delta_lat, lat + delta_lat
+            if south <= -90 or north >= 90:
+                column_ranges = [(0, self.columns - 1)]  # the circle contains a pole
+            else:
+                # Widest longitude span of the circle, at its highest latitude
+                delta_lon = math.degrees(math.asin(min(1.0, math.sin(radius_km / EARTH_RADIUS_KM)
+                                                       / math.cos(math.radians(lat)))))
+                column_ranges = self._column_ranges(lon - delta_lon, lon + delta_lon)
+            positions = self._candidates(south, north, column_ranges)
+            distances = haversine_km(lat, lon, self.latitudes[positions], self.longitudes[positions])
+            keep = distances <= radius_km
+            return dict(zip(self.hotel_ids[positions][keep].tolist(), distances[keep].tolist()))
+
+    def within_bbox(self, south, west, north, east):
+        """Hotel ids inside a viewport; west > east means it crosses the antimeridian."""
+        with self._lock:
+            if west > east:
+                east += 360
+            positions = self._candidates(south, north, self._column_ranges(west, east))
+            latitudes = self.latitudes[positions]
+            longitudes = self.longitudes[positions]
+            # Shift longitudes into [west, west + 360) so a wrapped box is one interval
+            shifted = (longitudes - west) % 360 + west
+            keep = (latitudes >= south) & (latitudes <= north) & (shifted <= east)
+            return set(self.hotel_ids[positions][keep].tolist())
@@ -1,4 +1,5 @@
 from backend.app import db
+from hotel_ibs.tag_bitmaps import DB_CONFIDENCE_SCALE
 
 class Chain(db.Model):
     __tablename__ = 'chains'
@@ -19,11 +20,14 @@ class Hotel(db.Model):
     
     chain = db.relationship("Chain", back_populates="hotels")
     images = db.relationship("Image", back_populates="hotel")
+    nights = db.relationship("AvailabilityPrice", back_populates="hotel")
 
 class Image(db.Model):
     __tablename__ = 'images'
     
-    image_id = db.Column(db.Text, primary_key=True, nullable=False)
+    __table_args__ = (db.Index('idx_images_hotel_id', 'hotel_id', postgresql_include=['image_id', 'image_url']),)
+    
+    image_id = db.Column(db.Integer, primary_key=True, nullable=False)
     hotel_id = db.Column(db.Integer, db.ForeignKey('hotels.hotel_id'))
     image_url = db.Column(db.Text)
     
@@ -35,9 +39,40 @@ class Image(db.Model):
 
 class ImageTag(db.Model):
     __tablename__ = 'image_tags'
+    __table_args__ = (
+        db.Index('idx_image_tags_tag_confidence', 'tag_id', db.desc('confidence_q'), 'image_id'),
+    )
     
-    image_id = db.Column(db.Integer, db.ForeignKey('images.image_id'), primary_key=True, nullable=False)
-    tag_name = db.Column(db.Text, primary_key=True, nullable=False)
-    confidence_score = db.Column(db.Float)
+    image_id = db.Column(db.Integer, db.ForeignKey('images.image_id', ondelete='CASCADE'), primary_key=True, nullable=False)
+    tag_id = db.Column(db.SmallInteger, db.ForeignKey('tags.tag_id'), primary_key=True, nullable=False)
+    confidence_q = db.Column(db.SmallInteger, nullable=False)  # confidence * 32767, see hotel_ibs/tag_bitmaps.py
+    tagged_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), nullable=False, index=True)
+    # The same float as confidence_sql() in hotel_ibs/tag_bitmaps.py
+    confidence = db.column_property(db.cast(confidence_q, db.Float) / DB_CONFIDENCE_SCALE)
     
     image = db.relationship("Image", back_populates="tags")
+    tag = db.relationship("Tag")
+
+class Tag(db.Model):
+    __tablename__ = 'tags'
+    
+    __table_args__ = (
+        db.Index('idx_tags_tag_name_trgm', 'tag_name', postgresql_using='gin', postgresql_ops={'tag_name': 'gin_trgm_ops'}),
+    )
+    
+    tag_id = db.Column(db.SmallInteger, primary_key=True, nullable=False)
+    tag_name = db.Column(db.Text, unique=True, nullable=False)
+
+class AvailabilityPrice(db.Model):
+    __tablename__ = 'availability_price'
+    __table_args__ = (db.UniqueConstraint('hotel_id', 'date'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    hotel_id = db.Column(db.Integer, db.ForeignKey('hotels.hotel_id', ondelete='CASCADE'))
+    date = db.Column(db.Date, nullable=False)
+    availability = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Numeric(10, 2), nullable=False)
+    currency = db.Column(db.String(10), nullable=False)
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), nullable=False, index=True)
+    
+    hotel = db.relationship("Hotel", back_populates="nights")
@@ -0,0 +1,151 @@
+"""Cache of serialized search responses.
+
+Entries are keyed on the endpoint, the normalized query and the data versions
+(hotel_ibs/data_versions.py) they were computed from, so bumping a version
+retires every older entry without scanning the cache. The default backend is
+an in-process LRU bounded by entry count and total bytes, with a TTL; set
+SEARCH_CACHE_URL=redis://... to share hits between worker processes (give
+the Redis instance a maxmemory and an allkeys-lru policy to bound it).
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+SEARCH_CACHE_URL = os.getenv("SEARCH_CACHE_URL")  # unset: per-process cache
+SEARCH_CACHE_TTL_SECONDS = int(os.getenv("SEARCH_CACHE_TTL_SECONDS", "300"))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "10000"))
+SEARCH_CACHE_MAX_BYTES = int(os.getenv("SEARCH_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+class LocalBackend:
+    """Thread-safe LRU of (expires_at, body) bounded by entries and bytes."""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                self._drop(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, body, ttl_seconds):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (time.time() + ttl_seconds, body)
+            self.nbytes += len(body)
+            while len(self.entries) > self.max_entries or self.nbytes > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        self.nbytes -= len(self.entries.pop(key)[1])
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        return {"entries": len(self.entries), "bytes": self.nbytes, "evictions": self.evictions}
+
+
+class RedisBackend:
+    """Entries shared through Redis; expiry and eviction are left to the server."""
+
+    PREFIX = "hotel_ibs:search:"
+
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+
+    def get(self, key):
+        return self.client.get(self.PREFIX + key)
+
+    def put(self, key, body, ttl_seconds):
+        self.client.set(self.PREFIX + key, body, ex=ttl_seconds)
+
+    def clear(self):
+        pass  # Older versions are never read again and expire on their own
+
+    def stats(self):
+        return {"backend": "redis"}
+
+
+class SearchCache:
+    """
+    get/put of response bodies and headers by key, with hit/miss counters.
+
+    A failing shared backend counts as a miss: searches are answered from
+    the indexes rather than failing with the cache.
+    """
+
+    def __init__(self, url=SEARCH_CACHE_URL, ttl_seconds=SEARCH_CACHE_TTL_SECONDS,
+                 max_entries=SEARCH_CACHE_MAX_ENTRIES, max_bytes=SEARCH_CACHE_MAX_BYTES):
+        self.ttl_seconds = ttl_seconds
+        self.backend = RedisBackend(url) if url else LocalBackend(max_entries, max_bytes)
+        self.hits = self.misses = self.errors = self.invalidations = 0
+
+    @staticmethod
+    def key(endpoint, params, versions):
+        """Stable key for a normalized query (a dict) and the data versions it depends on."""
+        raw = json.dumps([endpoint, params, versions], sort_keys=True, separators=(",", ":"))
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """(body, headers) stored under key, or None."""
+        try:
+            entry = self.backend.get(key)
+        except Exception:
+            self.errors += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        headers, body = entry.split(b"\n", 1)
+        return body, json.loads(headers)
+
+    def put(self, key, body, headers=None):
+        # Stored as one value: a line of JSON headers, then the body
+        entry = json.dumps(headers or {}).encode("utf-8") + b"\n" + body
+        try:
+            self.backend.put(key, entry, self.ttl_seconds)
+        except Exception:
+            self.errors += 1
+
+    def invalidate(self):
+        """Drop local entries after a version change (their keys can no longer match)."""
+        self.backend.clear()
+        self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "errors": self.errors,
+            "invalidations": self.invalidations,
+            **self.backend.stats(),
+        }
@@ -0,0 +1,66 @@
+"""Free-text image search over the stored CLIP image embeddings."""
+import os
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+from hotel_ibs.ann import IVFIndex, ANN_INDEX_DIR, exact_search
+from hotel_ibs.embedding_store import EmbeddingStore, EMBEDDING_STORE_DIR
+from hotel_ibs.tagging import encode_texts
+
+CLIP_MODEL_NAME = os.getenv("CLIP_MODEL_NAME", "ViT-B/32")
+
+
+class SemanticSearch:
+    """
+    Embed a query once with CLIP's text encoder and rank images by cosine
+    similarity.
+
+    Uses the IVF index when it has been built (scripts/07_build_ann_index.py)
+    and falls back to a brute-force scan of the embedding store otherwise.
+    """
+
+    def __init__(self, index_dir=ANN_INDEX_DIR, store_dir=EMBEDDING_STORE_DIR, model_name=CLIP_MODEL_NAME):
+        self.index_dir = index_dir
+        self.store_dir = store_dir
+        self.model_name = model_name
+        self.index = None
+        self.store = None
+        self.live_mask = None
+        self._model = None
+        self._lock = threading.Lock()
+        self.embed = lru_cache(maxsize=1024)(self._embed)
+
+    def load(self):
+        """Memory-map the IVF index, or the embedding store if no index was built."""
+        if os.path.exists(os.path.join(self.index_dir, "meta.json")):
+            self.index = IVFIndex.load(self.index_dir)
+        if os.path.exists(os.path.join(self.store_dir, "meta.json")):
+            self.store = EmbeddingStore(self.store_dir)
+            self.live_mask = np.zeros(len(self.store.image_ids), dtype=bool)
+            self.live_mask[self.store.live_rows()] = True
+        return self
+
+    @property
+    def available(self):
+        return self.index is not None or self.store is not None
+
+    def _embed(self, text):
+        with self._lock:
+            if self._model is None:
+                import clip
+
+                self._model, _ = clip.load(self.model_name, device="cpu")
+                self._model.eval()
+        return encode_texts(self._model, [text], "cpu")[0]
+
+    def search(self, text, k=50, exact=False, n_probe=None):
+        """Return the top-k (image_id, score) pairs for a free-text query."""
+        query = self.embed(" ".join(text.split()))
+        if self.index is not None:
+            if exact:
+                return self.index.search_exact(query, k)
+            return self.index.search(query, k, n_probe)
+        rows, scores = exact_search(self.store.matrix(), query, k, mask=self.live_mask)
+        return [(self.store.image_ids[row], float(score)) for row, score in zip(rows, scores)]
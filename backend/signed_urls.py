@@ -0,0 +1,165 @@
+"""Pre-signed S3 URLs for image links, cached and stable within a time bucket.
+
+Time is cut into SIGNED_URL_BUCKET_SECONDS buckets. Every URL handed out in
+a bucket is signed as of the bucket's start and stays valid until
+SIGNED_URL_MIN_VALIDITY_SECONDS after the bucket ends. The URL of an object
+is therefore the same for every request, worker process and restart within a
+bucket, so browser and CDN caches hit. Each URL still has at least the
+minimum validity left when it is handed out: at the bucket boundary, every
+key is re-signed for the next bucket.
+
+Signing is AWS Signature Version 4 query signing done here rather than by
+botocore, whose presigner always signs as of the current time. The signing
+key is derived once per bucket, so signing a page of keys costs one HMAC per
+key. Credentials come from the same AWS_S3_* variables as the Node server,
+or from boto3's default credential chain.
+"""
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from urllib.parse import quote, urlsplit
+
+AWS_S3_BUCKET = os.getenv("AWS_S3_bucket")  # unset: image paths are returned unsigned
+AWS_S3_REGION = os.getenv("AWS_S3_region", "us-east-1")
+AWS_S3_ACCESS_KEY_ID = os.getenv("AWS_S3_accessKeyId")
+AWS_S3_SECRET_ACCESS_KEY = os.getenv("AWS_S3_secretAccessKey")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")  # e.g. a local S3 stand-in; uses path-style URLs
+SIGNED_URL_BUCKET_SECONDS = int(os.getenv("SIGNED_URL_BUCKET_SECONDS", "900"))
+SIGNED_URL_MIN_VALIDITY_SECONDS = int(os.getenv("SIGNED_URL_MIN_VALIDITY_SECONDS", "3600"))
+SIGNED_URL_CACHE_SIZE = int(os.getenv("SIGNED_URL_CACHE_SIZE", "100000"))
+
+MAX_EXPIRES_SECONDS = 7 * 24 * 3600  # SigV4 limit
+
+
+def object_key(image_url):
+    """S3 object key of a stored image path ("./images/1/2/3.jpg" -> "images/1/2/3.jpg")."""
+    return image_url[2:] if image_url.startswith("./") else image_url.lstrip("/")
+
+
+def _hmac(key, message):
+    return hmac.new(key, message.encode("utf-8"), hashlib.sha256).digest()
+
+
+class UrlSigner:
+    """
+    Batch SigV4 presigner with an LRU of key -> URL for the current bucket.
+
+    Entries of a previous bucket are treated as misses, which is what
+    re-signs every URL shortly (SIGNED_URL_MIN_VALIDITY_SECONDS) before it
+    expires.
+    """
+
+    def __init__(self, bucket=AWS_S3_BUCKET, region=AWS_S3_REGION, access_key=AWS_S3_ACCESS_KEY_ID,
+                 secret_key=AWS_S3_SECRET_ACCESS_KEY, session_token=None, endpoint_url=S3_ENDPOINT_URL,
+                 bucket_seconds=SIGNED_URL_BUCKET_SECONDS, min_validity_seconds=SIGNED_URL_MIN_VALIDITY_SECONDS,
+                 cache_size=SIGNED_URL_CACHE_SIZE):
+        self.bucket = bucket
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.session_token = session_token
+        self.bucket_seconds = bucket_seconds
+        self.expires = min(bucket_seconds + min_validity_seconds, MAX_EXPIRES_SECONDS)
+        if endpoint_url:
+            parts = urlsplit(endpoint_url)
+            self.base_url = f"{parts.scheme}://{parts.netloc}"
+            self.host = parts.netloc
+            self.path_prefix = f"/{bucket}/"
+        else:
+            self.host = f"{bucket}.s3.{region}.amazonaws.com"
+            self.base_url = f"https://{self.host}"
+            self.path_prefix = "/"
+        self.cache_size = cache_size
+        self.urls = OrderedDict()  # object key -> (time bucket, url)
+        self.hits = self.signed = 0
+        self._signing = None  # (time bucket, X-Amz-Date, scope, canonical and URL query without signature, signing key)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.bucket)
+
+    def current_bucket(self, now=None):
+        return int((time.time() if now is None else now) // self.bucket_seconds)
+
+    def _credentials(self):
+        if self.access_key and self.secret_key:
+            return self.access_key, self.secret_key, self.session_token
+        import boto3  # Instance roles, profiles, ...: resolved again every bucket, as they rotate
+
+        credentials = boto3.Session().get_credentials().get_frozen_credentials()
+        return credentials.access_key, credentials.secret_key, credentials.token
+
+    def _signing_context(self, time_bucket):
+        """Timestamp, scope and derived signing key for a time bucket."""
+        if self._signing is None or self._signing[0] != time_bucket:
+            signed_at = datetime.fromtimestamp(time_bucket * self.bucket_seconds, timezone.utc)
+            date, amz_date = signed_at.strftime("%Y%m%d"), signed_at.strftime("%Y%m%dT%H%M%SZ")
+            access_key, secret_key, token = self._credentials()
+            scope = f"{date}/{self.region}/s3/aws4_request"
+            key = _hmac(("AWS4" + secret_key).encode("utf-8"), date)
+            for part in (self.region, "s3", "aws4_request"):
+                key = _hmac(key, part)
+            params = {
+                "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+                "X-Amz-Credential": f"{access_key}/{scope}",
+                "X-Amz-Date": amz_date,
+                "X-Amz-Expires": str(self.expires),
+                "X-Amz-SignedHeaders": "host",
+            }
+            if token:
+                params["X-Amz-Security-Token"] = token
+
+            def encode(items):
+                return "&".join(f"{quote(name, safe='-_.~')}={quote(value, safe='-_.~')}" for name, value in items)
+            # Signed in sorted order, sent in botocore's order, so the URLs are byte for byte botocore's
+            self._signing = (time_bucket, amz_date, scope, encode(sorted(params.items())), encode(params.items()),
+                             key)
+        return self._signing
+
+    def _sign(self, key, context):
+        _, amz_date, scope, canonical_query, query, signing_key = context
+        path = self.path_prefix + quote(key, safe="/-_.~")
+        canonical_request = f"GET\n{path}\n{canonical_query}\nhost:{self.host}\n\nhost\nUNSIGNED-PAYLOAD"
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256", amz_date, scope,
+            hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+        ])
+        signature = hmac.new(signing_key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+        return f"{self.base_url}{path}?{query}&X-Amz-Signature={signature}"
+
+    def sign_many(self, keys, now=None):
+        """URLs for object keys, in order; keys without a URL for the current bucket are signed as one batch."""
+        time_bucket = self.current_bucket(now)
+        with self._lock:
+            urls = {}
+            missing = []
+            for key in keys:
+                entry = self.urls.get(key)
+                if entry is not None and entry[0] == time_bucket:
+                    self.urls.move_to_end(key)
+                    urls[key] = entry[1]
+                    self.hits += 1
+                else:
+                    missing.append(key)
+            if missing:
+                context = self._signing_context(time_bucket)
+                for key in missing:
+                    urls[key] = self._sign(key, context)
+                    self.urls[key] = (time_bucket, urls[key])
+                    self.urls.move_to_end(key)
+                self.signed += len(missing)
+                while len(self.urls) > self.cache_size:
+                    self.urls.popitem(last=False)
+            return [urls[key] for key in keys]
+
+    def expires_at(self, now=None):
+        """Epoch seconds at which URLs handed out now expire."""
+        return (self.current_bucket(now) * self.bucket_seconds) + self.expires
+
+    def stats(self):
+        return {"cached_urls": len(self.urls), "hits": self.hits, "signed": self.signed}
@@ -0,0 +1,404 @@
+"""In-memory inverted index from tags to the images carrying them."""
+import heapq
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+import numpy as np
+
+
+class Posting:
+    """
+    Images carrying one tag, ordered by confidence (highest first).
+
+    A posting loaded from a snapshot holds read-only array views of the
+    memory-mapped file; it is copied into lists on its first change.
+    """
+
+    __slots__ = ("neg_scores", "image_ids")
+
+    def __init__(self):
+        self.neg_scores = []
+        self.image_ids = []
+
+    @classmethod
+    def frozen(cls, neg_scores, image_ids):
+        posting = cls()
+        posting.neg_scores = neg_scores
+        posting.image_ids = image_ids
+        return posting
+
+    def _thaw(self):
+        if isinstance(self.image_ids, np.ndarray):
+            self.neg_scores = self.neg_scores.tolist()
+            self.image_ids = self.image_ids.tolist()
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def add(self, image_id, confidence):
+        self._thaw()
+        pos = bisect_right(self.neg_scores, -confidence)
+        self.neg_scores.insert(pos, -confidence)
+        self.image_ids.insert(pos, image_id)
+
+    def extend(self, pairs):
+        """Bulk-add (image_id, confidence) pairs with a single sort."""
+        self._thaw()
+        merged = list(zip(self.neg_scores, self.image_ids))
+        merged.extend((-confidence, image_id) for image_id, confidence in pairs)
+        merged.sort(key=lambda pair: pair[0])
+        self.neg_scores = [neg for neg, _ in merged]
+        self.image_ids = [image_id for _, image_id in merged]
+
+    def remove(self, image_id, confidence):
+        self._thaw()
+        lo = bisect_left(self.neg_scores, -confidence)
+        hi = bisect_right(self.neg_scores, -confidence)
+        pos = self.image_ids.index(image_id, lo, hi)
+        del self.neg_scores[pos]
+        del self.image_ids[pos]
+
+    def entries(self, min_confidence, max_confidence=None, chunk_size=4096):
+        """
+        (-confidence, image_id) pairs with min_confidence <= confidence <=
+        max_confidence, best first, copied chunk_size entries at a time.
+        """
+        if isinstance(self.image_ids, np.ndarray):
+            start = 0 if max_confidence is None else int(np.searchsorted(self.neg_scores, -max_confidence, side="left"))
+            end = int(np.searchsorted(self.neg_scores, -min_confidence, side="right"))
+        else:
+            start = 0 if max_confidence is None else bisect_left(self.neg_scores, -max_confidence)
+            end = bisect_right(self.neg_scores, -min_confidence)
+        for lo in range(start, end, chunk_size):
+            neg_scores = self.neg_scores[lo:min(lo + chunk_size, end)]
+            image_ids = self.image_ids[lo:min(lo + chunk_size, end)]
+            if isinstance(image_ids, np.ndarray):
+                neg_scores, image_ids = neg_scores.tolist(), image_ids.tolist()
+            yield from zip(neg_scores, image_ids)
+
+
+class SnapshotMap:
+    """
+    Mapping over the sorted keys of a snapshot column, with values built on
+    demand by value(row) and changes kept in an in-memory overlay.
+
+    get() leaves the overlay untouched. m[key] and setdefault() copy a
+    snapshot value into the overlay, so callers can change it in place.
+    """
+
+    def __init__(self, keys, value):
+        self.keys = keys
+        self.value = value
+        self.overlay = {}
+        self.removed = set()  # snapshot keys deleted since
+        self.added = 0  # overlay keys not in the snapshot
+
+    def _row(self, key):
+        """Row of key in the snapshot (even if removed since), or None."""
+        row = int(np.searchsorted(self.keys, key))
+        return row if row < len(self.keys) and self.keys[row] == key else None
+
+    def __len__(self):
+        return len(self.keys) - len(self.removed) + self.added
+
+    def __contains__(self, key):
+        return key in self.overlay or (key not in self.removed and self._row(key) is not None)
+
+    def get(self, key, default=None):
+        if key in self.overlay:
+            return self.overlay[key]
+        row = self._row(key) if key not in self.removed else None
+        return default if row is None else self.value(row)
+
+    def __getitem__(self, key):
+        if key not in self.overlay:
+            row = self._row(key) if key not in self.removed else None
+            if row is None:
+                raise KeyError(key)
+            self.overlay[key] = self.value(row)
+        return self.overlay[key]
+
+    def __setitem__(self, key, value):
+        if key not in self.overlay:
+            if key in self.removed:
+                self.removed.discard(key)
+            elif self._row(key) is None:
+                self.added += 1
+        self.overlay[key] = value
+
+    def setdefault(self, key, default):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def pop(self, key, default=None):
+        if key not in self:
+            return default
+        value = self[key]
+        del self.overlay[key]
+        if self._row(key) is None:
+            self.added -= 1
+        else:
+            self.removed.add(key)
+        return value
+
+
+class TagIndex:
+    """
+    tag -> Posting, plus image_id -> {tag: confidence} to apply updates in place
+    and image_id <-> hotel_id maps to restrict a search to some hotels.
+
+    Tags are matched case-insensitively. A query term matches every vocabulary
+    tag containing it, like the old ILIKE '%term%' filter, so "pool" also
+    finds "infinity pool".
+    """
+
+    # Rows tagged shortly before the last refresh may belong to transactions
+    # that committed after it; they are re-read on the next refresh.
+    REFRESH_OVERLAP = timedelta(minutes=5)
+    # A hotel filter is applied by scoring the hotels' images directly when
+    # the matching postings are at least this many times as many
+    DIRECT_SCORE_RATIO = 4
+
+    def __init__(self):
+        self.postings = {}
+        self.image_tags = {}
+        self.image_hotels = {}
+        self.hotel_images = {}
+        self.watermark = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.image_tags)
+
+    def _set_hotel(self, image_id, hotel_id):
+        old = self.image_hotels.pop(image_id, None)
+        if old is not None:
+            self.hotel_images[old].discard(image_id)
+        if hotel_id is not None:
+            self.image_hotels[image_id] = hotel_id
+            self.hotel_images.setdefault(hotel_id, set()).add(image_id)
+
+    def set_image_tags(self, image_id, tags, hotel_id=None):
+        """Replace the tags of one image with a {tag: confidence} dict."""
+        with self._lock:
+            self._set_hotel(image_id, hotel_id)
+            for tag, confidence in self.image_tags.pop(image_id, {}).items():
+                posting = self.postings[tag]
+                posting.remove(image_id, confidence)
+                if not posting:
+                    del self.postings[tag]
+            if tags:
+                tags = {tag.lower(): confidence for tag, confidence in tags.items()}
+                for tag, confidence in tags.items():
+                    self.postings.setdefault(tag, Posting()).add(image_id, confidence)
+                self.image_tags[image_id] = tags
+
+    def _bulk_load(self, by_image):
+        """Build every posting with one sort per tag instead of one insert per row."""
+        pairs = {}
+        for image_id, (hotel_id, tags) in by_image.items():
+            self._set_hotel(image_id, hotel_id)
+            tags = {tag.lower(): confidence for tag, confidence in tags.items()}
+            self.image_tags[image_id] = tags
+            for tag, confidence in tags.items():
+                pairs.setdefault(tag, []).append((image_id, confidence))
+        for tag, tag_pairs in pairs.items():
+            self.postings.setdefault(tag, Posting()).extend(tag_pairs)
+
+    def load_rows(self, rows):
+        """Apply (image_id, tag_name, confidence, tagged_at, hotel_id) rows, grouped per image."""
+        by_image = {}
+        latest = self.watermark
+        for image_id, tag_name, confidence, tagged_at, hotel_id in rows:
+            by_image.setdefault(image_id, (hotel_id, {}))[1][tag_name] = confidence or 0.0
+            if tagged_at is not None and (latest is None or tagged_at > latest):
+                latest = tagged_at
+        with self._lock:
+            if self.image_tags:
+                for image_id, (hotel_id, tags) in by_image.items():
+                    self.set_image_tags(image_id, tags, hotel_id)
+            else:
+                self._bulk_load(by_image)
+            self.watermark = latest
+        return len(by_image)
+
+    def refresh(self, session, ImageTag, Image, Tag):
+        """
+        Load the tags of every image tagged since the last refresh.
+
+        The first call loads everything. Later calls only re-read images with
+        rows newer than the watermark, so imports never need a full rebuild.
+        """
+        columns = (ImageTag.image_id, Tag.tag_name, ImageTag.confidence, ImageTag.tagged_at, Image.hotel_id)
+        with self._lock:
+            query = (session.query(*columns).join(Tag, Tag.tag_id == ImageTag.tag_id)
+                     .outerjoin(Image, Image.image_id == ImageTag.image_id))
+            if self.watermark is not None:
+                since = self.watermark - self.REFRESH_OVERLAP
+                changed = session.query(ImageTag.image_id).filter(ImageTag.tagged_at > since).distinct()
+                query = query.filter(ImageTag.image_id.in_(changed))
+            return self.load_rows(query.order_by(ImageTag.image_id).yield_per(50000))
+
+    def load_snapshot(self, snapshot):
+        """
+        Serve the tags of a snapshot (hotel_ibs/snapshot.py) instead of a first
+        full load from SQL; refresh() then reads only rows newer than it.
+
+        Postings and the per-image tags stay in the memory-mapped file; only
+        the tagged images of each hotel are grouped here.
+        """
+        tag_names = snapshot.tables["tags"].column("tag_name").to_pylist()
+        posting_offsets = snapshot.array("tags", "posting_offset")
+        tag_ids = snapshot.array("image_tags", "tag_id")
+        tagged_images = snapshot.array("image_tags", "image_id")
+        neg_scores = snapshot.array("image_tags", "neg_confidence")
+        by_image = snapshot.array("image_tags", "by_image")
+        image_ids = snapshot.array("images", "image_id")
+        hotel_ids = snapshot.array("images", "hotel_id")
+        tag_offsets = snapshot.array("images", "tag_offset")
+
+        posting_ends = np.append(posting_offsets[1:], len(tag_ids))
+        tag_ends = np.append(tag_offsets[1:], len(by_image))
+        # Like a load from SQL, only images with tags are indexed
+        tagged = np.flatnonzero(tag_ends > tag_offsets)
+        tagged_ids, tagged_hotels = image_ids[tagged], hotel_ids[tagged]
+
+        def image_tags(row):
+            rows = by_image[tag_offsets[tagged[row]]:tag_ends[tagged[row]]]
+            return dict(zip((tag_names[tag_id] for tag_id in tag_ids[rows].tolist()), (-neg_scores[rows]).tolist()))
+
+        def image_hotel(row):
+            hotel_id = int(tagged_hotels[row])
+            return hotel_id if hotel_id >= 0 else None
+
+        by_hotel = np.argsort(tagged_hotels, kind="stable")
+        hotels, hotel_starts = np.unique(tagged_hotels[by_hotel], return_index=True)
+        hotel_ends = np.append(hotel_starts[1:], len(by_hotel))
+        with_hotel = hotels >= 0
+
+        def hotel_images(row, starts=hotel_starts[with_hotel], ends=hotel_ends[with_hotel]):
+            return set(tagged_ids[by_hotel[starts[row]:ends[row]]].tolist())
+
+        with self._lock:
+            self.postings = {
+                tag: Posting.frozen(neg_scores[start:end], tagged_images[start:end])
+                for tag, start, end in zip(tag_names, posting_offsets.tolist(), posting_ends.tolist())
+                if end > start
+            }
+            self.image_tags = SnapshotMap(tagged_ids, image_tags)
+            self.image_hotels = SnapshotMap(tagged_ids, image_hotel)
+            self.hotel_images = SnapshotMap(hotels[with_hotel], hotel_images)
+            watermark = snapshot.manifest.get("tags_watermark")
+            self.watermark = datetime.fromisoformat(watermark) if watermark else None
+        return len(self.image_tags)
+
+    def tag_counts(self):
+        """{tag: number of images carrying it}."""
+        with self._lock:
+            return {tag: len(posting) for tag, posting in self.postings.items()}
+
+    def expand(self, term):
+        """Vocabulary tags matching a query term."""
+        term = term.strip().lower()
+        return [tag for tag in self.postings if term in tag]
+
+    def images_of_hotels(self, hotel_ids):
+        """Every indexed image of the given hotels."""
+        images = set()
+        for hotel_id in hotel_ids:
+            images.update(self.hotel_images.get(hotel_id, ()))
+        return images
+
+    def image_score(self, image_id, terms, mode, min_confidence):
+        """Sum over terms of the image's best matching confidence; None if it matches no term (any, with "and")."""
+        tags = self.image_tags.get(image_id) or {}
+        total, matched = 0.0, False
+        for term in terms:
+            best = max((confidence for tag, confidence in tags.items()
+                        if term in tag and confidence >= min_confidence), default=None)
+            if best is None:
+                if mode == "and":
+                    return None
+                continue
+            total += best
+            matched = True
+        return total if matched else None
+
+    @staticmethod
+    def _keep(top, k, score, image_id, after):
+        """Push (score, image_id) onto the heap of the best k if it ranks after the cursor."""
+        if after is not None and (score > after[0] or (score == after[0] and image_id <= after[1])):
+            return
+        if len(top) < k:
+            heapq.heappush(top, (score, -image_id))
+        elif (score, -image_id) > top[0]:
+            heapq.heapreplace(top, (score, -image_id))
+
+    def search(self, terms, mode="or", min_confidence=0.0, k=100, hotel_ids=None, after=None):
+        """
+        Rank images for several query terms.
+
+        mode="and" keeps images matching every term, mode="or" any of them.
+        An image's score is the sum of its best confidence per matched term.
+        With hotel_ids, only images of those hotels are considered.
+        Returns the top-k (image_id, score) pairs, ordered by score descending
+        then image_id; with after=(score, image_id) the ranking continues
+        after that pair (keyset pagination).
+
+        Each term's postings are read best first and merged, starting at the
+        cursor's score: an image ranked before the cursor has no confidence
+        below it. Every image met is scored exactly from its tags and kept
+        in a heap of the best k. The walk stops once the sum of the terms'
+        next confidences, the most any unseen image can score, falls below
+        the k-th score, so a page reads about as many postings as it needs.
+
+        When the hotels' images are few next to the matching postings (a
+        small radius or viewport with a broad tag), the walk would skip most
+        of what it reads; those images are scored directly instead.
+        """
+        terms = [term.strip().lower() for term in terms if term.strip()]
+        if not terms or k <= 0:
+            return []
+        after_score = after[0] if after is not None else None
+        top = []  # (score, -image_id): the worst kept pair is top[0]
+        with self._lock:
+            allowed = self.images_of_hotels(hotel_ids) if hotel_ids is not None else None
+            if allowed is not None and not allowed:
+                return []
+            tags = [self.expand(term) for term in terms]
+            postings = sum(len(self.postings[tag]) for term_tags in tags for tag in term_tags)
+            if allowed is not None and len(allowed) * self.DIRECT_SCORE_RATIO <= postings:
+                for image_id in allowed:
+                    score = self.image_score(image_id, terms, mode, min_confidence)
+                    if score is not None:
+                        self._keep(top, k, score, image_id, after)
+                return [(-neg_id, score) for score, neg_id in sorted(top, reverse=True)]
+
+            streams = [heapq.merge(*(self.postings[tag].entries(min_confidence, after_score) for tag in term_tags))
+                       for term_tags in tags]
+            heads = [next(stream, None) for stream in streams]
+            seen = set()
+            while True:
+                live = [i for i, head in enumerate(heads) if head is not None]
+                if not live or (mode == "and" and len(live) < len(heads)):
+                    break  # With "and", an unseen image would also have to be in the exhausted term
+                bound = 0.0
+                for i in live:
+                    bound += -heads[i][0]
+                if len(top) == k and bound < top[0][0]:
+                    break
+                i = min(live, key=lambda i: heads[i][0])
+                image_id = heads[i][1]
+                heads[i] = next(streams[i], None)
+                if image_id in seen:
+                    continue
+                seen.add(image_id)
+                if allowed is not None and image_id not in allowed:
+                    continue
+                score = self.image_score(image_id, terms, mode, min_confidence)
+                if score is not None:
+                    self._keep(top, k, score, image_id, after)
+        return [(-neg_id, score) for score, neg_id in sorted(top, reverse=True)]
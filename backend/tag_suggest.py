@@ -0,0 +1,160 @@
+"""Tag completions for the search box, ranked by how many images carry each tag."""
+import math
+import threading
+
+
+def trigrams(text):
+    """Trigrams of a padded string, like pg_trgm: "pool" -> {"  p", " po", "poo", "ool", "ol "}."""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _Node:
+    __slots__ = ("children", "tags", "best")
+
+    def __init__(self):
+        self.children = {}
+        self.tags = set()  # tags with a key ending at this node
+        self.best = []  # top MAX_RESULTS tags of the subtree, most images first
+
+
+class TagSuggester:
+    """
+    Prefix trie plus trigram index over the tag vocabulary.
+
+    Every word of a tag starts a key ("infinity pool" is found from "inf" and
+    from "poo"). Each trie node keeps the MAX_RESULTS heaviest tags below it,
+    so a prefix lookup is one walk down the trie. Queries with too few prefix
+    matches (typos, fragments) are completed from the trigram index by
+    similarity. update() applies a new {tag: image count} map and only
+    re-inserts the tags whose count changed.
+    """
+
+    MAX_RESULTS = 20
+    MIN_SIMILARITY = 0.3
+
+    def __init__(self):
+        self.counts = {}
+        self.root = _Node()
+        self.trigram_tags = {}  # trigram -> tags containing it
+        self.trigram_counts = {}  # tag -> number of distinct trigrams
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.counts)
+
+    @staticmethod
+    def _keys(tag):
+        words = tag.split()
+        return {" ".join(words[i:]) for i in range(len(words))}
+
+    def _rank(self, tags):
+        # Subtrees not yet re-indexed during an update may still list removed tags
+        tags = [tag for tag in tags if tag in self.counts]
+        return sorted(tags, key=lambda tag: (-self.counts[tag], tag))[:self.MAX_RESULTS]
+
+    def _reindex_key(self, key, tag, present):
+        """Add or remove tag under key, then refresh the top tags along the path."""
+        path = [self.root]
+        for char in key:
+            path.append(path[-1].children.setdefault(char, _Node()))
+        if present:
+            path[-1].tags.add(tag)
+        else:
+            path[-1].tags.discard(tag)
+        for depth in range(len(path) - 1, -1, -1):
+            node = path[depth]
+            candidates = set(node.tags)
+            for child in node.children.values():
+                candidates.update(child.best)
+            node.best = self._rank(candidates)
+            if depth and not node.best:
+                del path[depth - 1].children[key[depth - 1]]
+
+    def _build(self):
+        """Index every tag at once, filling the top tags in one bottom-up pass."""
+        self.root = _Node()
+        for tag in self.counts:
+            for key in self._keys(tag):
+                node = self.root
+                for char in key:
+                    node = node.children.setdefault(char, _Node())
+                node.tags.add(tag)
+        stack = [(self.root, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if children_done:
+                candidates = set(node.tags)
+                for child in node.children.values():
+                    candidates.update(child.best)
+                node.best = self._rank(candidates)
+            else:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children.values())
+
+    def _index_trigrams(self, tag, present):
+        tag_trigrams = trigrams(tag)
+        if present:
+            self.trigram_counts[tag] = len(tag_trigrams)
+        else:
+            self.trigram_counts.pop(tag, None)
+        for trigram in tag_trigrams:
+            tags = self.trigram_tags.setdefault(trigram, set())
+            if present:
+                tags.add(tag)
+            else:
+                tags.discard(tag)
+                if not tags:
+                    del self.trigram_tags[trigram]
+
+    def update(self, counts):
+        """Apply {tag: image count}; tags missing from counts are removed. Returns the number of changed tags."""
+        counts = {tag: count for tag, count in counts.items() if count > 0}
+        with self._lock:
+            changed = {tag for tag in counts.keys() | self.counts.keys()
+                       if counts.get(tag) != self.counts.get(tag)}
+            first_load = not self.counts
+            self.counts = counts
+            if first_load:
+                self._build()
+            for tag in changed:
+                present = tag in counts
+                if not first_load:
+                    for key in self._keys(tag):
+                        self._reindex_key(key, tag, present)
+                self._index_trigrams(tag, present)
+            return len(changed)
+
+    def suggest(self, text, limit=10):
+        """[(tag, image count)] completing text: prefix matches first, then similar tags."""
+        text = " ".join(text.lower().split())
+        limit = min(limit, self.MAX_RESULTS)
+        if not text:
+            return []
+        with self._lock:
+            node = self.root
+            for char in text:
+                node = node.children.get(char)
+                if node is None:
+                    break
+            results = list(node.best[:limit]) if node is not None else []
+            if len(results) < limit and len(text) >= 3:
+                results += self._similar(text, limit - len(results), exclude=set(results))
+            return [(tag, self.counts[tag]) for tag in results]
+
+    def _similar(self, text, limit, exclude):
+        """Tags by trigram similarity (shared / union), weighted by log image count."""
+        query = trigrams(text)
+        shared = {}
+        for trigram in query:
+            for tag in self.trigram_tags.get(trigram, ()):
+                shared[tag] = shared.get(tag, 0) + 1
+        scored = []
+        for tag, common in shared.items():
+            if tag in exclude:
+                continue
+            similarity = common / (len(query) + self.trigram_counts[tag] - common)
+            if similarity >= self.MIN_SIMILARITY:
+                scored.append((similarity * math.log1p(self.counts[tag]), tag))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [tag for _, tag in scored[:limit]]
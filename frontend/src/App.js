@@ -15,6 +15,7 @@ function App() {
   const [loadingMessage, setLoadingMessage] = useState("");
   const [hotels, setHotels] = useState([]);
   const [selectedHotels, setSelectedHotels] = useState([]);
+  const [tagSuggestions, setTagSuggestions] = useState([]);
 
   // Use useRef for the image cache to persist it across renders
   const imageCacheRef = useRef(new Map());
@@ -43,16 +44,19 @@ function App() {
     }
   }, []);
 
-  // Check if a pre-signed URL is expired.
-  const isUrlExpired = (url) => {
+  // Check if a pre-signed URL is expired. The Python backend sends the
+  // expiry as image_url_expires_at (epoch seconds); otherwise parse the URL.
+  const isUrlExpired = (url, expiresAt) => {
     if (!url) return true;
+    if (expiresAt) return Date.now() > expiresAt * 1000;
 
-    const match = url.match(/X-Amz-Expires=(\d+)&X-Amz-Date=(\d+)T(\d+)Z/);
-    if (!match) return true;
+    const expiresMatch = url.match(/[?&]X-Amz-Expires=(\d+)/);
+    const dateMatch = url.match(/[?&]X-Amz-Date=(\d+)T(\d+)Z/);
+    if (!expiresMatch || !dateMatch) return true;
 
-    const expiresInSeconds = parseInt(match[1], 10);
-    const dateStr = match[2];
-    const timeStr = match[3];
+    const expiresInSeconds = parseInt(expiresMatch[1], 10);
+    const dateStr = dateMatch[1];
+    const timeStr = dateMatch[2];
 
     // Format: YYYYMMDDTHHMMSSZ
     const year = dateStr.slice(0, 4);
@@ -74,7 +78,7 @@ function App() {
   };
 
   // Download an image and convert it into an object URL.
-  const downloadImageUrl = async (url) => {
+  const downloadImageUrl = async (url, expiresAt) => {
     try {
       console.log(
         `CACHING: Checking cache for URL: ${url.substring(0, 50)}...`
@@ -85,7 +89,7 @@ function App() {
       console.log("CACHING: Checking cache for URL:", url);
       if (imageCacheRef.current.has(url)) {
         // Check if the URL has expired
-        if (isUrlExpired(url)) {
+        if (isUrlExpired(url, expiresAt)) {
           console.log(
             "CACHING: Cache HIT but URL EXPIRED. Downloading from S3..."
           );
@@ -160,7 +164,10 @@ function App() {
       console.log(
         `DOWNLOADING: Processing image ${index + 1}/${images.length}`
       );
-      let downloaded_url = await downloadImageUrl(cacheKey);
+      let downloaded_url = await downloadImageUrl(
+        cacheKey,
+        image.image_url_expires_at
+      );
 
       updatedImages.push(downloaded_url ? { ...image, downloaded_url } : image);
       updateLoadingBar(10 + ((index + 1) / images.length) * 90); // Update loading bar based on progress
@@ -231,6 +238,41 @@ function App() {
     });
   };
 
+  // Suggest tags for the last comma-separated term, once typing pauses.
+  useEffect(() => {
+    const cut = query.lastIndexOf(",") + 1;
+    const head = query.slice(0, cut);
+    const term = query.slice(cut).trim();
+    if (!term) {
+      setTagSuggestions([]);
+      return;
+    }
+    const controller = new AbortController();
+    const timer = setTimeout(async () => {
+      try {
+        const response = await fetch(
+          `http://localhost:5000/api/tags/suggest?q=${encodeURIComponent(
+            term
+          )}&limit=10`,
+          { signal: controller.signal }
+        );
+        if (response.ok) {
+          const suggestions = await response.json();
+          // Options hold the whole input value, so earlier terms are kept
+          setTagSuggestions(suggestions.map((s) => head + s.tag));
+        }
+      } catch (error) {
+        if (error.name !== "AbortError") {
+          console.error("Error fetching tag suggestions:", error);
+        }
+      }
+    }, 150);
+    return () => {
+      clearTimeout(timer);
+      controller.abort();
+    };
+  }, [query]);
+
   // Make the debug function available globally
   useEffect(() => {
     window.debugImageCache = debugCache;
@@ -282,7 +324,13 @@ function App() {
         onKeyDown={(e) => e.key === "Enter" && handleSearch()}
         placeholder="Enter image tag"
         className="input"
+        list="tagSuggestions"
       />
+      <datalist id="tagSuggestions">
+        {tagSuggestions.map((suggestion) => (
+          <option key={suggestion} value={suggestion} />
+        ))}
+      </datalist>
       <input
         type="number"
         value={minPrice}
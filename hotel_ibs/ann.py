@@ -0,0 +1,165 @@
+"""Inverted-file (IVF) approximate nearest-neighbour index over image embeddings.
+
+Embeddings are clustered with spherical k-means. Each vector is stored once,
+grouped by its closest centroid, so a query scores the centroids, picks the
+n_probe best lists and only scans the vectors in those lists. All arrays are
+saved as .npy files and memory-mapped on load, so several processes share
+the same pages and startup does not read the whole index.
+
+exact_search() is the brute-force baseline used as a fallback and to measure
+the recall of the IVF index.
+"""
+import json
+import os
+
+import numpy as np
+
+ANN_INDEX_DIR = os.getenv("ANN_INDEX_DIR", "./cache/ann_index")
+
+
+def top_k_indices(scores, k):
+    """Indices of the k highest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def exact_search(matrix, query, k, chunk_size=262144, mask=None):
+    """
+    Brute-force top-k by inner product over every row of matrix.
+
+    Rows are scored chunk by chunk, so a memory-mapped float16 matrix is never
+    fully loaded. Rows where mask is False are skipped. Returns (rows, scores).
+    """
+    query = np.asarray(query, dtype=np.float32)
+    best_rows = np.empty(0, dtype=np.int64)
+    best_scores = np.empty(0, dtype=np.float32)
+    for start in range(0, len(matrix), chunk_size):
+        scores = np.asarray(matrix[start:start + chunk_size], dtype=np.float32) @ query
+        if mask is not None:
+            scores[~mask[start:start + chunk_size]] = -np.inf
+        top = top_k_indices(scores, k)
+        best_rows = np.concatenate([best_rows, top + start])
+        best_scores = np.concatenate([best_scores, scores[top]])
+        keep = top_k_indices(best_scores, k)
+        best_rows, best_scores = best_rows[keep], best_scores[keep]
+    found = np.isfinite(best_scores)
+    return best_rows[found], best_scores[found]
+
+
+def spherical_kmeans(vectors, n_clusters, n_iter=20, seed=0, chunk_size=65536):
+    """Cluster normalized vectors by cosine similarity; returns normalized centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].astype(np.float32)
+    for _ in range(n_iter):
+        sums = np.zeros_like(centroids)
+        counts = np.zeros(n_clusters, dtype=np.int64)
+        for start in range(0, len(vectors), chunk_size):
+            chunk = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+            labels = np.argmax(chunk @ centroids.T, axis=1)
+            np.add.at(sums, labels, chunk)
+            counts += np.bincount(labels, minlength=n_clusters)
+
+        # Re-seed empty clusters with random vectors instead of dropping them.
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = sums / norms
+    return centroids
+
+
+class IVFIndex:
+    def __init__(self, centroids, offsets, vectors, image_ids, n_probe=16):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.vectors = vectors
+        self.image_ids = image_ids
+        self.n_probe = n_probe
+
+    @classmethod
+    def build(cls, embeddings, image_ids, n_lists=None, train_size=131072, n_iter=20,
+              n_probe=16, seed=0, chunk_size=65536):
+        """
+        Build an index from normalized embeddings (any array-like, e.g. a memmap).
+
+        By default n_lists is about 4 * sqrt(N), which keeps both the centroid
+        scan and the per-list scans small at 1M images.
+        """
+        count = len(image_ids)
+        if n_lists is None:
+            n_lists = max(1, int(4 * np.sqrt(count)))
+        n_lists = min(n_lists, count)
+
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(count, min(count, max(train_size, n_lists)), replace=False))
+        centroids = spherical_kmeans(np.asarray(embeddings[sample], dtype=np.float32),
+                                     n_lists, n_iter=n_iter, seed=seed)
+
+        labels = np.empty(count, dtype=np.int32)
+        for start in range(0, count, chunk_size):
+            chunk = np.asarray(embeddings[start:start + chunk_size], dtype=np.float32)
+            labels[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+
+        order = np.argsort(labels, kind="stable")
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(labels, minlength=n_lists))
+        vectors = np.empty((count, embeddings.shape[1]), dtype=np.float16)
+        for start in range(0, count, chunk_size):
+            vectors[start:start + chunk_size] = embeddings[order[start:start + chunk_size]]
+        return cls(centroids.astype(np.float32), offsets, vectors,
+                   np.asarray(image_ids)[order], n_probe=n_probe)
+
+    def save(self, path=ANN_INDEX_DIR):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "centroids.npy"), self.centroids)
+        np.save(os.path.join(path, "offsets.npy"), self.offsets)
+        np.save(os.path.join(path, "vectors.npy"), self.vectors)
+        np.save(os.path.join(path, "image_ids.npy"), self.image_ids)
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"n_probe": self.n_probe, "count": len(self.image_ids),
+                       "n_lists": len(self.centroids)}, f)
+
+    @classmethod
+    def load(cls, path=ANN_INDEX_DIR, mmap=True):
+        mode = "r" if mmap else None
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        return cls(
+            np.load(os.path.join(path, "centroids.npy")),
+            np.load(os.path.join(path, "offsets.npy")),
+            np.load(os.path.join(path, "vectors.npy"), mmap_mode=mode),
+            np.load(os.path.join(path, "image_ids.npy"), mmap_mode=mode),
+            n_probe=meta["n_probe"],
+        )
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def search(self, query, k=50, n_probe=None):
+        """Approximate top-k as a list of (image_id, score), best first."""
+        query = np.asarray(query, dtype=np.float32)
+        n_probe = max(1, min(n_probe or self.n_probe, len(self.centroids)))
+        lists = top_k_indices(self.centroids @ query, n_probe)
+
+        rows = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists])
+        scores = np.asarray(self.vectors[rows], dtype=np.float32) @ query
+        top = top_k_indices(scores, k)
+        return [(self.image_ids[row].item(), float(score)) for row, score in zip(rows[top], scores[top])]
+
+    def search_exact(self, query, k=50):
+        """Brute-force top-k over every vector in the index, as (image_id, score)."""
+        rows, scores = exact_search(self.vectors, query, k)
+        return [(self.image_ids[row].item(), float(score)) for row, score in zip(rows, scores)]
+
+    def recall(self, queries, k=50, n_probe=None):
+        """Mean recall@k of search() against search_exact() over a batch of queries."""
+        hits = 0
+        for query in queries:
+            exact = {image_id for image_id, _ in self.search_exact(query, k)}
+            approx = {image_id for image_id, _ in self.search(query, k, n_probe)}
+            hits += len(exact & approx) / max(1, len(exact))
+        return hits / max(1, len(queries))
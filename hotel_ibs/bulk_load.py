@@ -0,0 +1,106 @@
+"""Bulk loading into Postgres with COPY and a staging table.
+
+Rows are streamed chunk by chunk with COPY ... FROM STDIN into a temporary
+staging table shaped like the target, then merged with one set-based
+INSERT ... ON CONFLICT per chunk. This replaces one INSERT round-trip per row.
+"""
+import csv
+import io
+import time
+
+from psycopg2 import sql
+
+from hotel_ibs.metrics import record_batch
+
+
+def copy_rows(cursor, table, columns, rows):
+    """COPY an iterable of tuples (or a DataFrame) into table as CSV."""
+    buffer = io.StringIO()
+    if hasattr(rows, "to_csv"):
+        rows.to_csv(buffer, columns=columns, header=False, index=False)
+    else:
+        csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(
+        sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+            sql.Identifier(table), sql.SQL(", ").join(map(sql.Identifier, columns))
+        ),
+        buffer,
+    )
+
+
+def create_staging_table(cursor, table, columns):
+    """
+    Create an empty temporary table with the given columns of table for this
+    session; returns its name. Only the loaded columns are copied, so serial
+    defaults (and their sequences) are left to the final INSERT.
+    """
+    staging = f"staging_{table}"
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}; CREATE TEMP TABLE {} AS SELECT {} FROM {} WITH NO DATA;").format(
+        sql.Identifier(staging), sql.Identifier(staging),
+        sql.SQL(", ").join(map(sql.Identifier, columns)), sql.Identifier(table)
+    ))
+    return staging
+
+
+def merge_staging(cursor, staging, table, columns, key_columns, update=True):
+    """
+    Insert the staged rows into table and empty the staging table.
+
+    Rows whose key already exists are updated (update=True) or skipped.
+    Duplicate keys inside the staged chunk keep a single row.
+    """
+    column_list = sql.SQL(", ").join(map(sql.Identifier, columns))
+    key_list = sql.SQL(", ").join(map(sql.Identifier, key_columns))
+    updates = [column for column in columns if column not in key_columns]
+    if update and updates:
+        conflict = sql.SQL("DO UPDATE SET {}").format(sql.SQL(", ").join(
+            sql.SQL("{} = EXCLUDED.{}").format(sql.Identifier(column), sql.Identifier(column))
+            for column in updates
+        ))
+    else:
+        conflict = sql.SQL("DO NOTHING")
+    cursor.execute(sql.SQL("""
+        INSERT INTO {table} ({columns})
+        SELECT DISTINCT ON ({keys}) {columns} FROM {staging}
+        ON CONFLICT ({keys}) {conflict};
+    """).format(table=sql.Identifier(table), columns=column_list, keys=key_list,
+                staging=sql.Identifier(staging), conflict=conflict))
+    merged = cursor.rowcount
+    cursor.execute(sql.SQL("TRUNCATE {};").format(sql.Identifier(staging)))
+    return merged
+
+
+def bulk_upsert(conn, table, columns, key_columns, chunks, update=True, total=None):
+    """
+    Load an iterable of chunks (DataFrames or lists of tuples) into table.
+
+    Each chunk is COPYed into a staging table, merged and committed, so a
+    failure only loses the current chunk. Progress and throughput are printed
+    per chunk and recorded as the pipeline stage load_<table>; returns
+    (rows_copied, rows_merged, seconds).
+    """
+    cursor = conn.cursor()
+    staging = create_staging_table(cursor, table, columns)
+    start_time = time.time()
+    copied = merged = 0
+    for chunk in chunks:
+        chunk_start = time.perf_counter()
+        copy_rows(cursor, staging, columns, chunk)
+        merged += merge_staging(cursor, staging, table, columns, key_columns, update)
+        conn.commit()
+        copied += len(chunk)
+        record_batch(f"load_{table}", len(chunk), time.perf_counter() - chunk_start)
+        elapsed = time.time() - start_time
+        progress = f"{copied}/{total}" if total else f"{copied}"
+        print(f"{table}: {progress} rows loaded, {copied / max(elapsed, 1e-9):,.0f} rows/s")
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {};").format(sql.Identifier(staging)))
+    conn.commit()
+    cursor.close()
+    return copied, merged, time.time() - start_time
+
+
+def dataframe_chunks(df, chunk_rows):
+    """Split a DataFrame into consecutive chunks of chunk_rows rows."""
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
@@ -0,0 +1,30 @@
+"""Version counters of the data behind the search API.
+
+Scripts that change tags or prices bump a counter in the `data_versions`
+table in the same transaction as the change. The table is created with the
+rest of the schema by 01_create_database.py, or by migration 7 of
+09_migrate_schema.py on older databases. The backend polls the counters:
+a new version refreshes its in-memory indexes and retires cached search
+results, which are keyed on the versions they were computed from.
+"""
+
+TAGS = "tags"
+PRICES = "prices"
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS data_versions (
+        name TEXT PRIMARY KEY,
+        version BIGINT NOT NULL,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+"""
+
+READ_SQL = "SELECT name, version FROM data_versions;"
+
+
+def bump_version(cursor, name):
+    """Increment the counter `name`, creating it if needed; commit is left to the caller."""
+    cursor.execute("""
+        INSERT INTO data_versions (name, version, updated_at) VALUES (%s, 1, now())
+        ON CONFLICT (name) DO UPDATE SET version = data_versions.version + 1, updated_at = now();
+    """, (name,))
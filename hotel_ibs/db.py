@@ -0,0 +1,360 @@
+"""Shared Postgres access for the backend and the pipeline scripts.
+
+Connection settings come from the DB_* environment variables (or .env),
+read here instead of in every script. Scripts borrow connections from a
+process-wide pool (connection()), so the several steps of a script reuse
+one session instead of opening a connection each; the backend's SQLAlchemy
+engine gets the same settings and pool tuning from engine_options().
+
+Pooled connections are checked when they are handed out: a connection that
+is closed, older than DB_POOL_RECYCLE_SECONDS, or fails a ping after being
+idle for DB_PING_AFTER_SECONDS is replaced, so a restarted server or a
+dropped idle connection costs a reconnect instead of a failed query. A
+connection used within the last DB_PING_AFTER_SECONDS is not pinged.
+
+Helpers:
+- execute_prepared(): server-side prepared statements for queries run many
+  times per session (parsed and planned once per connection)
+- stream(): server-side cursor for large reads, fetched in batches
+- insert_values(): multi-row writes, one round-trip per page of rows
+"""
+import atexit
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+
+from hotel_ibs import metrics
+
+load_dotenv()
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))  # idle connections kept open
+DB_POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", "10"))  # extra connections under load, closed on return
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds to wait for a free connection
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+DB_PING_AFTER_SECONDS = float(os.getenv("DB_PING_AFTER_SECONDS", "60"))
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+DB_APPLICATION_NAME = os.getenv("DB_APPLICATION_NAME", "hotel_ibs")
+
+FETCH_ROWS = int(os.getenv("DB_FETCH_ROWS", "100000"))  # rows per server-side cursor round-trip
+WRITE_PAGE_ROWS = int(os.getenv("DB_WRITE_PAGE_ROWS", "10000"))  # rows per multi-row INSERT/UPDATE
+
+CONNECTIONS_OPENED = metrics.counter("db_connections_opened_total", "Database connections opened")
+CONNECTIONS_REPLACED = metrics.counter(
+    "db_connections_replaced_total", "Pooled connections closed by a health check", ["reason"])
+
+
+class Connection(psycopg2.extensions.connection):
+    """psycopg2 connection that knows its age and its prepared statements."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.created_at = time.monotonic()
+        self.used_at = self.created_at
+        self.prepared = {}  # statement name -> query
+        CONNECTIONS_OPENED.inc()
+
+
+def connect_kwargs(dbname=None):
+    """psycopg2.connect() arguments for the current environment (dbname overrides DB_NAME)."""
+    return {
+        "dbname": dbname or os.getenv("DB_NAME"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "host": os.getenv("DB_HOST"),
+        "port": os.getenv("DB_PORT"),
+        "connect_timeout": DB_CONNECT_TIMEOUT,
+        "application_name": DB_APPLICATION_NAME,
+        # Notice a dead server on idle connections instead of hanging on the next query
+        "keepalives": 1,
+        "keepalives_idle": 60,
+    }
+
+
+def connect(dbname=None):
+    """A new, unpooled connection; for sessions that must not be shared (DROP DATABASE, LISTEN)."""
+    return psycopg2.connect(connection_factory=Connection, **connect_kwargs(dbname))
+
+
+def database_url(dbname=None):
+    """SQLAlchemy URL of the database (psycopg2 driver)."""
+    from sqlalchemy.engine import URL
+
+    settings = connect_kwargs(dbname)
+    return URL.create(
+        "postgresql+psycopg2",
+        username=settings["user"],
+        password=settings["password"],
+        host=settings["host"],
+        port=settings["port"] or "5432",
+        database=settings["dbname"],
+    )
+
+
+def engine_options():
+    """
+    create_engine() options with the pool settings above. Health checks are
+    added by install_health_checks(): pool_pre_ping would cost a round-trip
+    on every checkout.
+    """
+    settings = connect_kwargs()
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_POOL_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE_SECONDS,
+        # The most recently used connection first: the extras go idle and are recycled
+        "pool_use_lifo": True,
+        # executemany() as multi-row INSERTs, and UPDATEs sent in batches: one round-trip per page
+        "executemany_mode": "values_plus_batch",
+        "insertmanyvalues_page_size": WRITE_PAGE_ROWS,
+        "connect_args": {
+            "connection_factory": Connection,
+            **{key: settings[key] for key in ("connect_timeout", "application_name", "keepalives", "keepalives_idle")},
+        },
+    }
+
+
+def install_health_checks(engine):
+    """Ping an engine's connections on checkout only when they were idle for DB_PING_AFTER_SECONDS."""
+    from sqlalchemy import event, exc
+
+    @event.listens_for(engine, "checkin")
+    def checkin(dbapi_connection, connection_record):
+        if dbapi_connection is not None:
+            dbapi_connection.used_at = time.monotonic()
+
+    @event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        reason = _unhealthy(dbapi_connection, recycle=False)
+        if reason:
+            CONNECTIONS_REPLACED.inc(reason=reason)
+            # The pool closes this connection and retries with a new one
+            raise exc.DisconnectionError(reason)
+
+
+def _ping(conn):
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1;")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _unhealthy(conn, recycle=True):
+    """Why conn must not be handed out, or None."""
+    now = time.monotonic()
+    if conn.closed:
+        return "closed"
+    if recycle and now - conn.created_at > DB_POOL_RECYCLE_SECONDS:
+        return "recycled"
+    if now - getattr(conn, "used_at", now) > DB_PING_AFTER_SECONDS and not _ping(conn):
+        return "ping_failed"
+    return None
+
+
+class Pool:
+    """
+    Thread-safe pool of connections to one database: up to size idle
+    connections are kept, max_overflow more are opened under load, and a
+    borrower waits up to timeout seconds for a free one.
+    """
+
+    def __init__(self, dbname=None, size=DB_POOL_SIZE, max_overflow=DB_POOL_MAX_OVERFLOW, timeout=DB_POOL_TIMEOUT):
+        self.dbname = dbname
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self._idle = []
+        self._open = 0
+        self._condition = threading.Condition()
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._condition:
+                while not self._idle and self._open >= self.size + self.max_overflow:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise psycopg2.pool.PoolError(
+                            f"No free connection after {self.timeout} seconds ({self._open} open)")
+                    self._condition.wait(remaining)
+                conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    self._open += 1
+            if conn is None:
+                try:
+                    return connect(self.dbname)
+                except Exception:
+                    self._release_slot()
+                    raise
+            # Checked outside the lock: a ping is a round-trip
+            reason = _unhealthy(conn)
+            if reason is None:
+                return conn
+            CONNECTIONS_REPLACED.inc(reason=reason)
+            conn.close()
+            self._release_slot()
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            status = conn.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        if not discard and not conn.closed and (conn.autocommit or conn.readonly or conn.isolation_level is not None):
+            # Undo set_session() of the borrower (e.g. a read-only export)
+            conn.set_session(isolation_level="DEFAULT", readonly="DEFAULT", deferrable="DEFAULT", autocommit=False)
+        with self._condition:
+            if not discard and not conn.closed and len(self._idle) < self.size:
+                conn.used_at = time.monotonic()
+                self._idle.append(conn)
+                self._condition.notify()
+                return
+        conn.close()
+        self._release_slot()
+
+    def _release_slot(self):
+        with self._condition:
+            self._open -= 1
+            self._condition.notify()
+
+    def closeall(self):
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn in idle:
+            conn.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(dbname=None):
+    """The process-wide pool of the current connection settings."""
+    key = tuple(sorted(connect_kwargs(dbname).items()))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = Pool(dbname)
+        return pool
+
+
+@contextmanager
+def connection(dbname=None):
+    """
+    Borrow a pooled connection for the with block. The transaction is
+    committed when the block ends and rolled back if it raises; a broken
+    connection is closed instead of returned to the pool.
+    """
+    pool = get_pool(dbname)
+    conn = pool.getconn()
+    try:
+        yield conn
+        if not conn.closed and not conn.autocommit:
+            conn.commit()
+    except BaseException:
+        discard = conn.closed
+        if not discard:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        pool.putconn(conn, discard=discard)
+        raise
+    else:
+        pool.putconn(conn)
+
+
+@atexit.register
+def close_pools():
+    """Close the idle pooled connections, so the server sees clean disconnects."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.closeall()
+
+
+_PLACEHOLDER = re.compile(r"%(s|%)")
+
+
+def _numbered(query):
+    """The query with psycopg2's %s placeholders as $1, $2, ... and the count of them."""
+    count = 0
+
+    def replace(match):
+        nonlocal count
+        if match.group(1) == "%":
+            return "%"
+        count += 1
+        return f"${count}"
+
+    return _PLACEHOLDER.sub(replace, query.strip().rstrip(";")), count
+
+
+def execute_prepared(cursor, name, query, params=()):
+    """
+    Run query (with %s placeholders) as the prepared statement name.
+
+    The statement is prepared on first use on each connection; later calls
+    only send EXECUTE with the parameters, so the server skips parsing and
+    planning. Parameter types are inferred from the query, so write casts
+    where the context does not fix them (e.g. %s::int[] in unnest()). On a
+    connection that is not a Connection the query is executed directly.
+    """
+    conn = cursor.connection
+    prepared = getattr(conn, "prepared", None)
+    if prepared is None:
+        cursor.execute(query, params)
+        return
+    statement, count = _numbered(query)
+    if prepared.get(name) != statement:
+        if name in prepared:
+            cursor.execute(f"DEALLOCATE {name};")
+            del prepared[name]
+        # PREPARE is not undone by a rollback, so it is only recorded once it succeeded
+        cursor.execute(f"PREPARE {name} AS {statement};")
+        prepared[name] = statement
+    if count:
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * count)});", params)
+    else:
+        cursor.execute(f"EXECUTE {name};")
+
+
+def stream(conn, query, params=None, name="stream", rows=FETCH_ROWS):
+    """
+    Yield lists of up to rows rows from a server-side (named) cursor, so a
+    large result is never held in memory at once. Runs in conn's transaction.
+    """
+    with conn.cursor(name=name) as cursor:
+        cursor.itersize = rows
+        cursor.execute(query, params)
+        while True:
+            batch = cursor.fetchmany(rows)
+            if not batch:
+                break
+            yield batch
+
+
+def insert_values(cursor, query, rows, template=None, page_size=WRITE_PAGE_ROWS):
+    """
+    Run an INSERT/UPDATE whose `VALUES %s` takes rows, page_size rows per
+    statement. Returns the number of rows the statements affected.
+    """
+    affected = 0
+    rows = list(rows)
+    for start in range(0, len(rows), page_size):
+        execute_values(cursor, query, rows[start:start + page_size], template=template, page_size=page_size)
+        affected += max(cursor.rowcount, 0)
+    return affected
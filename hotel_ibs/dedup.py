@@ -0,0 +1,262 @@
+"""Near-duplicate image detection with perceptual hashes.
+
+Every image gets a 64-bit pHash (low frequencies of a 32x32 DCT) and a 64-bit
+dHash (horizontal gradients of a 9x8 thumbnail). Two images are
+near-duplicates when both hashes are within a Hamming radius.
+
+Candidate pairs come from a multi-index hash: the pHash is cut into
+radius + 1 segments, and by the pigeonhole principle any two hashes within
+the radius agree exactly on at least one segment. Each segment is handled
+with one sort, so there is no all-pairs comparison. The first image of each
+group (in input order) is the canonical one, and its duplicates reuse its
+tags and embedding.
+"""
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+DEDUP_CACHE_PATH = os.getenv("DEDUP_CACHE_PATH", "./cache/perceptual_hashes.sqlite")
+DEDUP_RADIUS = int(os.getenv("DEDUP_RADIUS", "4"))  # max differing pHash bits (0 disables dedup)
+DEDUP_DHASH_RADIUS = int(os.getenv("DEDUP_DHASH_RADIUS", "8"))  # max differing dHash bits
+
+HASH_SIZE = 8
+PHASH_SIZE = 32
+
+
+def _dct_matrix(n):
+    """Orthonormal DCT-II matrix, so the 2-D DCT of x is D @ x @ D.T."""
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+DCT = _dct_matrix(PHASH_SIZE)
+
+
+def _pack(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def image_hashes(image_path):
+    """(phash, dhash) of one image as unsigned 64-bit ints, or None if it cannot be read."""
+    from PIL import Image
+
+    try:
+        with Image.open(image_path) as image:
+            # Let the JPEG decoder downscale by up to 8x while decoding.
+            image.draft("L", (PHASH_SIZE * 2, PHASH_SIZE * 2))
+            gray = image.convert("L")
+            small = np.asarray(gray.resize((PHASH_SIZE, PHASH_SIZE), Image.BILINEAR), dtype=np.float64)
+            thumb = np.asarray(gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR), dtype=np.int16)
+    except Exception:
+        return None
+    low = (DCT @ small @ DCT.T)[:HASH_SIZE, :HASH_SIZE]
+    phash = _pack(low > np.median(low))
+    dhash = _pack(thumb[:, 1:] > thumb[:, :-1])
+    return phash, dhash
+
+
+def hamming(a, b):
+    """Bitwise Hamming distance between two uint64 arrays."""
+    x = np.bitwise_xor(a, b)
+    if hasattr(np, "bitwise_count"):  # NumPy >= 2.0
+        return np.bitwise_count(x).astype(np.int64)
+    return np.unpackbits(x.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class HashCache:
+    """SQLite cache of perceptual hashes keyed by path, size and mtime."""
+
+    def __init__(self, path=DEDUP_CACHE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                phash INTEGER,
+                dhash INTEGER
+            )
+        """)
+
+    def get(self, paths):
+        """{path: (phash, dhash)} for paths whose file is unchanged since it was hashed."""
+        cached = {}
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT path, size, mtime_ns, phash, dhash FROM hashes WHERE path IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            for path, size, mtime_ns, phash, dhash in rows:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if (stat.st_size, stat.st_mtime_ns) == (size, mtime_ns) and phash is not None:
+                    # SQLite integers are signed: store the bits, read them back unsigned.
+                    cached[path] = (phash & 0xFFFFFFFFFFFFFFFF, dhash & 0xFFFFFFFFFFFFFFFF)
+        return cached
+
+    def put(self, items):
+        """Store (path, phash, dhash) rows."""
+        rows = []
+        for path, phash, dhash in items:
+            stat = os.stat(path)
+            rows.append((path, stat.st_size, stat.st_mtime_ns,
+                         int(np.uint64(phash).view(np.int64)), int(np.uint64(dhash).view(np.int64))))
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)", rows)
+
+    def close(self):
+        self.conn.close()
+
+
+def compute_hashes(paths, workers=None, cache=None):
+    """
+    pHash and dHash arrays (uint64) for paths, plus a mask of readable images.
+
+    Cached hashes are reused; the rest are computed by a process pool.
+    """
+    paths = list(paths)
+    cached = cache.get(paths) if cache is not None else {}
+    todo = [path for path in paths if path not in cached]
+    if todo:
+        computed = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for path, hashes in zip(todo, pool.map(image_hashes, todo, chunksize=256)):
+                if hashes is not None:
+                    cached[path] = hashes
+                    computed.append((path, *hashes))
+        if cache is not None:
+            cache.put(computed)
+
+    phash = np.zeros(len(paths), dtype=np.uint64)
+    dhash = np.zeros(len(paths), dtype=np.uint64)
+    readable = np.zeros(len(paths), dtype=bool)
+    for i, path in enumerate(paths):
+        if path in cached:
+            phash[i], dhash[i] = cached[path]
+            readable[i] = True
+    return phash, dhash, readable
+
+
+def candidate_pairs(hashes, radius):
+    """
+    All (i, j), i < j, whose hashes differ in at most radius bits.
+
+    Multi-index hashing: with radius + 1 segments, close hashes share a
+    segment value, so only rows with an equal segment are compared.
+    """
+    n_segments = radius + 1
+    bounds = np.linspace(0, 64, n_segments + 1).astype(int)
+    found = []
+    for low, high in zip(bounds[:-1], bounds[1:]):
+        mask = np.uint64((1 << (high - low)) - 1)
+        segment = (hashes >> np.uint64(low)) & mask
+        order = np.argsort(segment, kind="stable")
+        sorted_segment = segment[order]
+        # Compare every row with the rows d places after it in the same bucket.
+        d = 1
+        while True:
+            same = sorted_segment[d:] == sorted_segment[:-d]
+            if not same.any():
+                break
+            left, right = order[:-d][same], order[d:][same]
+            close = hamming(hashes[left], hashes[right]) <= radius
+            found.append(np.stack([np.minimum(left, right)[close], np.maximum(left, right)[close]], axis=1))
+            d += 1
+    if not found:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.unique(np.concatenate(found), axis=0)
+
+
+def group_duplicates(phash, dhash, radius=DEDUP_RADIUS, dhash_radius=DEDUP_DHASH_RADIUS):
+    """
+    canonical[i] = index of the image that i duplicates (i itself if canonical).
+
+    Identical hashes are collapsed first so large groups of the same picture
+    do not blow up the pair search. An image only joins a canonical image it
+    is itself close to, so groups never chain across distant images.
+    """
+    keys = np.stack([phash, dhash], axis=1)
+    # The earliest input row of each distinct (phash, dhash) stands for it.
+    unique, representative, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+
+    pairs = candidate_pairs(unique[:, 0], radius)
+    if len(pairs):
+        close = hamming(unique[pairs[:, 0], 1], unique[pairs[:, 1], 1]) <= dhash_radius
+        pairs = pairs[close]
+
+    # Walk the distinct hashes in input order; each joins the earliest close canonical one.
+    rank = np.argsort(representative, kind="stable")
+    position = np.empty_like(rank)
+    position[rank] = np.arange(len(rank))
+    neighbours = {}
+    for a, b in pairs.tolist():
+        if position[a] > position[b]:
+            a, b = b, a
+        neighbours.setdefault(b, []).append(a)
+    canonical_of = np.arange(len(unique))
+    for u in rank.tolist():
+        for v in sorted(neighbours.get(u, ()), key=lambda v: position[v]):
+            if canonical_of[v] == v:
+                canonical_of[u] = v
+                break
+
+    return representative[canonical_of[inverse]]
+
+
+def find_near_duplicates(items, radius=DEDUP_RADIUS, dhash_radius=DEDUP_DHASH_RADIUS,
+                         workers=None, cache_path=DEDUP_CACHE_PATH):
+    """
+    Split (image_id, image_path) pairs into canonical images and duplicates.
+
+    Returns (canonical_items, duplicates, stats) where duplicates maps each
+    canonical image_id to the image_ids that reuse its tags and embedding.
+    Unreadable images stay canonical so the tagger reports them as before.
+    """
+    items = list(items)
+    start_time = time.time()
+    cache = HashCache(cache_path) if cache_path else None
+    phash, dhash, readable = compute_hashes([path for _, path in items], workers, cache)
+    if cache is not None:
+        cache.close()
+    hashed_seconds = time.time() - start_time
+
+    index = np.flatnonzero(readable)
+    canonical = np.arange(len(items))
+    if radius > 0 and len(index):
+        canonical[index] = index[group_duplicates(phash[index], dhash[index], radius, dhash_radius)]
+
+    canonical_items, duplicates = [], {}
+    for i, (image_id, image_path) in enumerate(items):
+        if canonical[i] == i:
+            canonical_items.append((image_id, image_path))
+        else:
+            duplicates.setdefault(items[canonical[i]][0], []).append(image_id)
+
+    stats = {
+        "images": len(items),
+        "unreadable": int(len(items) - readable.sum()),
+        "duplicates": len(items) - len(canonical_items),
+        "hash_seconds": hashed_seconds,
+        "seconds": time.time() - start_time,
+    }
+    return canonical_items, duplicates, stats
+
+
+def saved_work_summary(stats, encoded, tagging_seconds):
+    """One-line report of the CLIP work skipped thanks to the duplicates."""
+    per_image = tagging_seconds / max(encoded, 1)
+    return (f"Near-duplicates: {stats['duplicates']} of {stats['images']} images "
+            f"({100 * stats['duplicates'] / max(stats['images'], 1):.1f}%) reused a canonical image's tags, "
+            f"saving ~{stats['duplicates'] * per_image:.0f} s of tagging "
+            f"(hashing took {stats['hash_seconds']:.0f} s)")
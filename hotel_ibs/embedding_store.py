@@ -0,0 +1,130 @@
+"""Append-only, memory-mapped store of CLIP image embeddings.
+
+A store is a directory holding:
+- embeddings.f16: raw float16 matrix, one row per appended embedding
+- image_ids.txt: sidecar with the image_id of every row, one per line
+- meta.json: embedding dimension
+
+Rows are never rewritten. Appending an image_id again adds a new row, and the
+index points to the latest one. If a crash leaves the matrix and sidecar with
+different lengths, the extra tail is dropped the next time the store is opened.
+"""
+import json
+import os
+
+import numpy as np
+
+EMBEDDING_STORE_DIR = os.getenv("EMBEDDING_STORE_DIR", "./cache/image_embeddings")
+
+DTYPE = np.float16
+
+
+class EmbeddingStore:
+    # Row type and matrix file name; PreprocessedImageCache stores uint8 pixels instead.
+    DTYPE = DTYPE
+    MATRIX_FILE = "embeddings.f16"
+
+    def __init__(self, path=EMBEDDING_STORE_DIR, dim=None):
+        self.path = path
+        self.matrix_path = os.path.join(path, self.MATRIX_FILE)
+        self.ids_path = os.path.join(path, "image_ids.txt")
+        self.meta_path = os.path.join(path, "meta.json")
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.dim = json.load(f)["dim"]
+            if dim is not None and dim != self.dim:
+                raise ValueError(f"Store at {path} holds {self.dim}-d embeddings, not {dim}-d")
+        elif dim is not None:
+            os.makedirs(path, exist_ok=True)
+            self.dim = dim
+            with open(self.meta_path, "w") as f:
+                json.dump({"dim": dim, "dtype": np.dtype(self.DTYPE).name}, f)
+            open(self.matrix_path, "ab").close()
+            open(self.ids_path, "a").close()
+        else:
+            raise FileNotFoundError(f"No embedding store at {path}; pass dim to create one")
+
+        self.image_ids = []
+        self.rows = {}
+        self._load()
+
+    def _load(self):
+        with open(self.ids_path, encoding="utf-8") as f:
+            image_ids = f.read().splitlines()
+        row_bytes = self.dim * np.dtype(self.DTYPE).itemsize
+        count = min(len(image_ids), os.path.getsize(self.matrix_path) // row_bytes)
+
+        # Repair a torn append: keep only rows present in both files.
+        if os.path.getsize(self.matrix_path) != count * row_bytes:
+            with open(self.matrix_path, "r+b") as f:
+                f.truncate(count * row_bytes)
+        if len(image_ids) != count:
+            image_ids = image_ids[:count]
+            with open(self.ids_path, "w", encoding="utf-8") as f:
+                f.writelines(f"{image_id}\n" for image_id in image_ids)
+
+        self.image_ids = image_ids
+        self.rows = {image_id: row for row, image_id in enumerate(image_ids)}
+        self._matrix = None
+
+    def __len__(self):
+        """Number of distinct image_ids in the store."""
+        return len(self.rows)
+
+    def __contains__(self, image_id):
+        return str(image_id) in self.rows
+
+    def append(self, image_ids, embeddings):
+        """Append one embedding row per image_id."""
+        embeddings = np.ascontiguousarray(embeddings, dtype=self.DTYPE)
+        if embeddings.ndim != 2 or embeddings.shape != (len(image_ids), self.dim):
+            raise ValueError(f"Expected a ({len(image_ids)}, {self.dim}) matrix, got {embeddings.shape}")
+
+        # Matrix first, ids second: a crash in between leaves orphan rows,
+        # which _load() drops, never ids pointing past the end of the matrix.
+        with open(self.matrix_path, "ab") as f:
+            f.write(embeddings.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.ids_path, "a", encoding="utf-8") as f:
+            for image_id in image_ids:
+                image_id = str(image_id)
+                self.rows[image_id] = len(self.image_ids)
+                self.image_ids.append(image_id)
+                f.write(f"{image_id}\n")
+        self._matrix = None
+
+    def matrix(self):
+        """Read-only memmap over every row, including superseded ones."""
+        if self._matrix is None:
+            if not self.image_ids:
+                return np.empty((0, self.dim), dtype=self.DTYPE)
+            self._matrix = np.memmap(self.matrix_path, dtype=self.DTYPE, mode="r",
+                                     shape=(len(self.image_ids), self.dim))
+        return self._matrix
+
+    def get(self, image_ids):
+        """Return the latest embeddings of the given image_ids as float32."""
+        rows = [self.rows[str(image_id)] for image_id in image_ids]
+        return np.asarray(self.matrix()[rows], dtype=np.float32)
+
+    def live_rows(self):
+        """Sorted row numbers holding the latest embedding of each image_id."""
+        return np.fromiter(sorted(self.rows.values()), dtype=np.int64, count=len(self.rows))
+
+    def iter_chunks(self, chunk_size=65536):
+        """Yield (image_ids, float32 embeddings) for every image, chunk_size rows at a time."""
+        matrix = self.matrix()
+        rows = self.live_rows()
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            yield [self.image_ids[row] for row in chunk], np.asarray(matrix[chunk], dtype=np.float32)
+
+    def extend(self, other, chunk_size=65536):
+        """Append the latest row of every image_id in another store (e.g. a worker's shard)."""
+        appended = 0
+        for image_ids, rows in other.iter_chunks(chunk_size):
+            self.append(image_ids, rows)
+            appended += len(image_ids)
+        return appended
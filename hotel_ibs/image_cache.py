@@ -0,0 +1,119 @@
+"""Cache of decoded, preprocessed images for repeated tagging runs.
+
+On CPU nodes, JPEG decoding and resizing cost as much as encoding. The cache
+keeps CLIP's resized and center-cropped 224x224 RGB input as uint8, in the
+same append-only memmap layout as the embedding store. Each image is decoded
+once; later runs (another model with the same input size, a new vocabulary)
+read pixels at disk bandwidth. Normalization is done per batch on the tensor.
+"""
+import os
+
+import numpy as np
+
+from hotel_ibs.embedding_store import EmbeddingStore
+
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "./cache/preprocessed_images")
+IMAGE_SIZE = 224
+
+
+class PreprocessedImageCache(EmbeddingStore):
+    """EmbeddingStore whose rows are flattened (size, size, 3) uint8 images."""
+
+    DTYPE = np.uint8
+    MATRIX_FILE = "images.u8"
+
+    def __init__(self, path=IMAGE_CACHE_DIR, size=IMAGE_SIZE):
+        super().__init__(path, dim=size * size * 3)
+        self.size = size
+
+    def append(self, image_ids, images):
+        super().append(image_ids, np.asarray(images, dtype=np.uint8).reshape(len(image_ids), -1))
+
+    def get(self, image_ids):
+        """Return the cached images of the given image_ids as a (n, size, size, 3) uint8 array."""
+        rows = [self.rows[str(image_id)] for image_id in image_ids]
+        return np.asarray(self.matrix()[rows]).reshape(-1, self.size, self.size, 3)
+
+
+class ShardedImageCache(PreprocessedImageCache):
+    """
+    The cache at path for reads, with new images appended to a shard instead,
+    so several processes can share one cache; the shard is folded back into
+    the cache with extend() once its writer is done.
+    """
+
+    def __init__(self, path, shard_path, size=IMAGE_SIZE):
+        super().__init__(path, size)
+        self.shard = PreprocessedImageCache(shard_path, size)
+
+    def append(self, image_ids, images):
+        self.shard.append(image_ids, images)
+
+
+class ImageDataset:
+    """
+    Map-style dataset over (image_id, image_path) pairs.
+
+    Item i is (i, uint8 image or None, from_cache). Images already in the
+    cache are read from its memmap and the rest are decoded with decode(path).
+    The memmap is opened lazily, so each loader worker maps the file itself
+    instead of receiving a copy.
+    """
+
+    def __init__(self, items, decode, cache=None):
+        self.items = list(items)
+        self.decode = decode
+        self.rows, self.shape, self.matrix_path = {}, None, None
+        if cache is not None and len(cache):
+            self.rows = {i: cache.rows[str(image_id)] for i, (image_id, _) in enumerate(self.items)
+                         if str(image_id) in cache.rows}
+            self.shape = (len(cache.image_ids), cache.size, cache.size, 3)
+            self.matrix_path = cache.matrix_path
+        self._matrix = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, i):
+        row = self.rows.get(i)
+        if row is not None:
+            if self._matrix is None:
+                self._matrix = np.memmap(self.matrix_path, dtype=np.uint8, mode="r", shape=self.shape)
+            return i, np.array(self._matrix[row]), True
+        return i, self.decode(self.items[i][1]), False
+
+
+def iter_image_batches(items, decode, batch_size, cache=None, num_workers=0):
+    """
+    Yield (image_ids, uint8 images of shape (n, 224, 224, 3)) batches in order.
+
+    With num_workers > 0 a torch DataLoader decodes or reads images in worker
+    processes while the caller encodes the previous batch. Newly decoded
+    images are appended to the cache (from this process only). Images that
+    cannot be decoded are skipped.
+    """
+    dataset = ImageDataset(items, decode, cache)
+    if num_workers > 0:
+        from torch.utils.data import DataLoader
+
+        batches = DataLoader(dataset, batch_size=batch_size, num_workers=num_workers,
+                             collate_fn=list, prefetch_factor=4)
+    else:
+        batches = ([dataset[i] for i in range(start, min(start + batch_size, len(dataset)))]
+                   for start in range(0, len(dataset), batch_size))
+
+    for batch in batches:
+        ids, images, new_ids, new_images = [], [], [], []
+        for i, image, from_cache in batch:
+            if image is None:
+                continue
+            image_id = dataset.items[i][0]
+            ids.append(image_id)
+            images.append(image)
+            if not from_cache:
+                new_ids.append(image_id)
+                new_images.append(image)
+        if cache is not None and new_ids:
+            cache.append(new_ids, np.stack(new_images))
+        if ids:
+            yield ids, np.stack(images)
@@ -0,0 +1,190 @@
+"""Persistent manifest of the image tree (images/<chain_id>/<hotel_id>/<image_id>.jpg).
+
+The manifest is a SQLite file with one row per image file: path, size, mtime,
+width, height and a content hash. A scan lists the tree with os.scandir and
+only opens files that are new or whose size or mtime changed; those are read
+by a process pool that takes the dimensions from the image header instead of
+decoding it. Loaders and checks can query the manifest instead of walking the
+tree again.
+"""
+import hashlib
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+IMAGE_MANIFEST_PATH = os.getenv("IMAGE_MANIFEST_PATH", "./cache/image_manifest.sqlite")
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# Start-of-frame markers carry the dimensions (DHT, JPG and DAC share the range).
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# Files are hashed in chunks; the start of the file is kept for the dimensions,
+# which follow the EXIF and ICC segments and so are rarely past the first 256 KiB.
+HASH_CHUNK_BYTES = 1024 * 1024
+HEADER_BYTES = 256 * 1024
+
+
+def jpeg_size(data):
+    """(width, height) from the first start-of-frame segment of a JPEG, or None."""
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:  # markers without a length
+            i += 2
+            continue
+        if marker in SOF_MARKERS:
+            height = int.from_bytes(data[i + 5:i + 7], "big")
+            width = int.from_bytes(data[i + 7:i + 9], "big")
+            return width, height
+        i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+    return None
+
+
+def examine(path):
+    """Read one file: (path, width, height, content_hash, error)."""
+    try:
+        digest = hashlib.blake2b(digest_size=16)
+        header = b""
+        with open(path, "rb") as f:
+            while chunk := f.read(HASH_CHUNK_BYTES):
+                digest.update(chunk)
+                if len(header) < HEADER_BYTES:
+                    header += chunk[:HEADER_BYTES - len(header)]
+        size = jpeg_size(header)
+        if size is None:
+            # Not a JPEG, or a very long JPEG header: PIL still only parses the header here.
+            from PIL import Image
+
+            with Image.open(path) as img:
+                size = img.size
+        return path, size[0], size[1], digest.hexdigest(), None
+    except Exception as e:
+        return path, None, None, None, repr(e)
+
+
+def scan_tree(root):
+    """Yield (path, size, mtime_ns) for every image file below root."""
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    stat = entry.stat()
+                    yield entry.path, stat.st_size, stat.st_mtime_ns
+
+
+def path_keys(root, path):
+    """(chain_key, hotel_key, image_key) for images/<chain>/<hotel>/<image>.jpg, else Nones."""
+    parts = os.path.relpath(path, root).split(os.sep)
+    if len(parts) != 3:
+        return None, None, None
+    return parts[0], parts[1], os.path.splitext(parts[2])[0]
+
+
+class ImageManifest:
+    def __init__(self, path=IMAGE_MANIFEST_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS images (
+                path TEXT PRIMARY KEY,
+                chain_key TEXT,
+                hotel_key TEXT,
+                image_key TEXT,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                width INTEGER,
+                height INTEGER,
+                content_hash TEXT,
+                error TEXT,
+                scanned_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_images_keys ON images (chain_key, hotel_key, image_key);
+            CREATE INDEX IF NOT EXISTS idx_images_hash ON images (content_hash);
+        """)
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def update(self, root, workers=None, batch_size=1000):
+        """
+        Bring the manifest in line with the files under root.
+
+        Files whose size and mtime match their row are not opened. New or
+        modified files are examined by `workers` processes and written in
+        batches of batch_size, so an interrupted scan keeps its progress.
+        Rows of files that disappeared are removed. Returns counts of
+        unchanged, examined, removed and failed files.
+        """
+        start_time = time.time()
+        known = {path: (size, mtime_ns) for path, size, mtime_ns in
+                 self.conn.execute("SELECT path, size, mtime_ns FROM images")}
+        seen, changed = set(), {}
+        for path, size, mtime_ns in scan_tree(root):
+            seen.add(path)
+            if known.get(path) != (size, mtime_ns):
+                changed[path] = (size, mtime_ns)
+
+        removed = [path for path in known if path not in seen]
+        with self.conn:
+            self.conn.executemany("DELETE FROM images WHERE path = ?", [(path,) for path in removed])
+
+        failed = 0
+        batch = []
+        if changed:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for path, width, height, content_hash, error in pool.map(examine, changed, chunksize=64):
+                    failed += error is not None
+                    batch.append((path, *path_keys(root, path), *changed[path],
+                                  width, height, content_hash, error, time.time()))
+                    if len(batch) >= batch_size:
+                        self._write(batch)
+                        batch = []
+            self._write(batch)
+
+        return {
+            "unchanged": len(seen) - len(changed),
+            "examined": len(changed),
+            "removed": len(removed),
+            "failed": failed,
+            "seconds": time.time() - start_time,
+        }
+
+    def _write(self, rows):
+        if not rows:
+            return
+        with self.conn:
+            self.conn.executemany("""
+                INSERT OR REPLACE INTO images (path, chain_key, hotel_key, image_key, size, mtime_ns,
+                                               width, height, content_hash, error, scanned_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+
+    def query(self, sql, params=()):
+        """Run a SELECT against the manifest and return a DataFrame."""
+        return pd.read_sql_query(sql, self.conn, params=params)
+
+    def image_files(self):
+        """(chain_key, hotel_key, image_key, image_url) of every readable image in the tree layout."""
+        return self.query("""
+            SELECT chain_key, hotel_key, image_key, path AS image_url FROM images
+            WHERE image_key IS NOT NULL AND error IS NULL
+        """)
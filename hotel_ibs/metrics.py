@@ -0,0 +1,305 @@
+"""In-process metrics: counters, gauges and latency histograms.
+
+Shared by the backend, which serves them at /metrics in the Prometheus text
+format, and the pipeline scripts, which write a JSON summary when they exit
+(report_at_exit). Recording a value is a dict lookup and an addition under
+a lock, so it can be done on every request; loops over single rows record
+once per batch instead. Gauges that mirror existing state (cache sizes,
+pool usage) take a function that is only called when the metrics are read.
+
+Histograms have fixed buckets, so the quantiles of a summary are estimates
+interpolated within a bucket.
+"""
+import atexit
+import bisect
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_SUMMARY_DIR = os.getenv("METRICS_SUMMARY_DIR", "./cache/metrics")
+
+# Seconds, from sub-millisecond index lookups to minute-long batches
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    TYPE = None
+
+    def __init__(self, name, help, labels=(), function=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.function = function  # called on read: a number, or {label values tuple: number}
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def items(self):
+        """[(label values, value)] sorted by labels."""
+        if self.function is not None:
+            values = self.function()
+            values = values if isinstance(values, dict) else {(): values}
+            return sorted((tuple(str(value) for value in key), value) for key, value in values.items())
+        with self._lock:
+            return sorted((key, self._copy(value)) for key, value in self.values.items())
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    def _label_text(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{label}="{_escape(value)}"' for label, value in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}"]
+        for key, value in self.items():
+            lines.append(f"{self.name}{self._label_text(key)} {_format_value(value)}")
+        return lines
+
+    def summary(self):
+        return [{"labels": dict(zip(self.labels, key)), "value": value} for key, value in self.items()]
+
+
+class Counter(_Metric):
+    TYPE = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    TYPE = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram(_Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.values.get(key)
+            if series is None:
+                # Counts per bucket (the last one is +Inf), sum, count, max
+                series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0, 0.0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+            series[3] = max(series[3], value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with block."""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, **labels)
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), *value[1:]]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}"]
+        for key, (counts, total, count, _) in self.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{self._label_text(key, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._label_text(key)} {count}")
+        return lines
+
+    def quantile(self, counts, count, maximum, q):
+        """Estimate the q-quantile from bucket counts, interpolating linearly within the bucket."""
+        rank = q * count
+        cumulative = 0
+        for i, bucket_count in enumerate(counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else maximum
+                return min(lower + (upper - lower) * (rank - cumulative) / bucket_count, maximum)
+            cumulative += bucket_count
+        return maximum
+
+    def summary(self):
+        results = []
+        for key, (counts, total, count, maximum) in self.items():
+            results.append({
+                "labels": dict(zip(self.labels, key)),
+                "count": count,
+                "sum": round(total, 6),
+                "mean": round(total / count, 6) if count else None,
+                "p50": round(self.quantile(counts, count, maximum, 0.5), 6),
+                "p95": round(self.quantile(counts, count, maximum, 0.95), 6),
+                "p99": round(self.quantile(counts, count, maximum, 0.99), 6),
+                "max": round(maximum, 6),
+            })
+        return results
+
+
+class Registry:
+    """Metrics by name; asking for an existing name returns the registered metric."""
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.TYPE}")
+            return metric
+
+    def counter(self, name, help, labels=(), function=None):
+        return self._get(Counter, name, help, labels, function=function)
+
+    def gauge(self, name, help, labels=(), function=None):
+        return self._get(Gauge, name, help, labels, function=function)
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for name in sorted(self.metrics):
+            try:
+                lines.extend(self.metrics[name].render())
+            except Exception as e:
+                # A failing gauge function must not break the whole scrape
+                lines.append(f"# {name} unavailable: {_escape(repr(e))}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """{name: {"type", "help", "values"}} of every metric, JSON-serializable."""
+        summary = {}
+        for name in sorted(self.metrics):
+            metric = self.metrics[name]
+            try:
+                values = metric.summary()
+            except Exception as e:
+                values = {"error": repr(e)}
+            summary[name] = {"type": metric.TYPE, "help": metric.help, "values": values}
+        return summary
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+# Pipeline stages (download, tagging, import, ...) record one entry per batch
+STAGE_ITEMS = counter("pipeline_items_total", "Items processed by a pipeline stage", ["stage"])
+STAGE_ERRORS = counter("pipeline_errors_total", "Items a pipeline stage failed to process", ["stage"])
+STAGE_BATCH_SECONDS = histogram("pipeline_batch_seconds", "Time spent on one batch of a pipeline stage", ["stage"])
+
+
+def record_batch(stage, items, seconds, errors=0):
+    """Record one batch of a pipeline stage: items done, time spent and failed items."""
+    STAGE_ITEMS.inc(items, stage=stage)
+    STAGE_BATCH_SECONDS.observe(seconds, stage=stage)
+    if errors:
+        STAGE_ERRORS.inc(errors, stage=stage)
+
+
+@contextmanager
+def timed_batch(stage, items=0):
+    """
+    Record the with block as one batch of stage; the yielded dict's "items"
+    and "errors" can be set inside. If the block raises, none of its items
+    count as done and all of them (at least one) as failed.
+    """
+    batch = {"items": items, "errors": 0}
+    start_time = time.perf_counter()
+    try:
+        yield batch
+    except Exception:
+        record_batch(stage, 0, time.perf_counter() - start_time, max(batch["items"], batch["errors"], 1))
+        raise
+    record_batch(stage, batch["items"], time.perf_counter() - start_time, batch["errors"])
+
+
+def stage_summary():
+    """{stage: items, batches, busy seconds, items per busy second, errors}."""
+    items = {entry["labels"]["stage"]: entry["value"] for entry in STAGE_ITEMS.summary()}
+    errors = {entry["labels"]["stage"]: entry["value"] for entry in STAGE_ERRORS.summary()}
+    stages = {}
+    for entry in STAGE_BATCH_SECONDS.summary():
+        stage = entry["labels"]["stage"]
+        stages[stage] = {
+            "items": items.get(stage, 0),
+            "batches": entry["count"],
+            "seconds": round(entry["sum"], 3),
+            "items_per_second": round(items.get(stage, 0) / entry["sum"], 1) if entry["sum"] else None,
+            "batch_seconds_p50": entry["p50"],
+            "batch_seconds_p95": entry["p95"],
+            "errors": errors.get(stage, 0),
+        }
+    return stages
+
+
+def report_at_exit(script):
+    """
+    When the process exits, print the pipeline stage summary as one line of
+    JSON and write it, with every metric, to METRICS_SUMMARY_DIR.
+    """
+    started_at = time.time()
+
+    def report():
+        summary = {
+            "script": script,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(started_at)),
+            "seconds": round(time.time() - started_at, 3),
+            "stages": stage_summary(),
+            "metrics": REGISTRY.summary(),
+        }
+        print("Metrics summary: " + json.dumps({key: summary[key] for key in ("script", "seconds", "stages")}))
+        try:
+            os.makedirs(METRICS_SUMMARY_DIR, exist_ok=True)
+            path = os.path.join(METRICS_SUMMARY_DIR,
+                                f"{script}_{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(started_at))}.json")
+            with open(path, "w") as f:
+                json.dump(summary, f, indent=2)
+        except OSError as e:
+            print(f"Could not write the metrics summary: {e!r}")
+
+    atexit.register(report)
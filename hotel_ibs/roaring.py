@@ -0,0 +1,181 @@
+"""Roaring-style compressed bitmaps of 32-bit image ids, on top of NumPy.
+
+Ids are split into a 16-bit key (high bits) and a container holding the low
+16 bits of every id sharing that key. Sparse containers are sorted uint16
+arrays, dense ones (more than ARRAY_MAX ids) are 65536-bit bitmaps stored as
+1024 uint64 words. Set operations work container by container, so AND/OR/
+ANDNOT over a million ids touch at most 16 containers.
+"""
+import numpy as np
+
+ARRAY_MAX = 4096
+BITMAP_WORDS = 1024
+
+
+def _to_bitmap(values):
+    words = np.zeros(BITMAP_WORDS, dtype=np.uint64)
+    values = values.astype(np.uint64)
+    np.bitwise_or.at(words, values >> np.uint64(6), np.uint64(1) << (values & np.uint64(63)))
+    return words
+
+
+def _bitmap_values(words):
+    bits = np.unpackbits(words.view(np.uint8), bitorder="little")
+    return np.flatnonzero(bits).astype(np.uint16)
+
+
+def _bitmap_contains(words, values):
+    values = values.astype(np.uint64)
+    return (words[values >> np.uint64(6)] >> (values & np.uint64(63))) & np.uint64(1) == 1
+
+
+def _cardinality(container):
+    if container.dtype == np.uint64:
+        if hasattr(np, "bitwise_count"):  # NumPy >= 2.0
+            return int(np.bitwise_count(container).sum())
+        return int(np.unpackbits(container.view(np.uint8)).sum())
+    return len(container)
+
+
+def _shrink(words):
+    """Convert a bitmap container back to an array container once it is sparse."""
+    if _cardinality(words) <= ARRAY_MAX:
+        return _bitmap_values(words)
+    return words
+
+
+def _and(a, b):
+    if a.dtype == np.uint64 and b.dtype == np.uint64:
+        return _shrink(a & b)
+    if a.dtype == np.uint64:
+        a, b = b, a
+    if b.dtype == np.uint64:
+        return a[_bitmap_contains(b, a)]
+    return np.intersect1d(a, b, assume_unique=True)
+
+
+def _or(a, b):
+    if a.dtype == np.uint64 or b.dtype == np.uint64 or len(a) + len(b) > ARRAY_MAX:
+        words_a = a if a.dtype == np.uint64 else _to_bitmap(a)
+        words_b = b if b.dtype == np.uint64 else _to_bitmap(b)
+        return _shrink(words_a | words_b)
+    return np.union1d(a, b).astype(np.uint16)
+
+
+def _andnot(a, b):
+    if a.dtype == np.uint64:
+        words_b = b if b.dtype == np.uint64 else _to_bitmap(b)
+        return _shrink(a & ~words_b)
+    if b.dtype == np.uint64:
+        return a[~_bitmap_contains(b, a)]
+    return np.setdiff1d(a, b, assume_unique=True).astype(np.uint16)
+
+
+class RoaringBitmap:
+    __slots__ = ("keys", "containers")
+
+    def __init__(self, keys=None, containers=None):
+        self.keys = keys or []
+        self.containers = containers or []
+
+    @classmethod
+    def from_array(cls, values):
+        """Build a bitmap from any iterable of non-negative ids below 2**32."""
+        values = np.unique(np.asarray(values, dtype=np.uint32))
+        if not len(values):
+            return cls()
+        high = values >> 16
+        keys, starts = np.unique(high, return_index=True)
+        bounds = list(starts[1:]) + [len(values)]
+        containers = []
+        for start, end in zip(starts, bounds):
+            low = (values[start:end] & 0xFFFF).astype(np.uint16)
+            containers.append(_to_bitmap(low) if len(low) > ARRAY_MAX else low)
+        return cls([int(key) for key in keys], containers)
+
+    def to_array(self):
+        """Sorted uint32 array of every id in the bitmap."""
+        if not self.keys:
+            return np.empty(0, dtype=np.uint32)
+        return np.concatenate(list(self.chunks()))
+
+    def chunks(self):
+        """Sorted uint32 arrays of the ids of each container in turn (at most 65536 ids each)."""
+        for key, container in zip(self.keys, self.containers):
+            low = _bitmap_values(container) if container.dtype == np.uint64 else container
+            yield (np.uint32(key) << np.uint32(16)) | low.astype(np.uint32)
+
+    def rank(self, values):
+        """
+        (found, positions) for sorted ids: whether each is in the bitmap and,
+        where it is, its index in to_array(); only the containers of the
+        values' keys are unpacked.
+        """
+        values = np.asarray(values, dtype=np.uint32)
+        found = np.zeros(len(values), dtype=bool)
+        positions = np.zeros(len(values), dtype=np.int64)
+        high = values >> np.uint32(16)
+        offset = 0
+        for key, container in zip(self.keys, self.containers):
+            start, end = np.searchsorted(high, [key, key + 1])
+            if end > start:
+                members = _bitmap_values(container) if container.dtype == np.uint64 else container
+                low = (values[start:end] & 0xFFFF).astype(np.uint16)
+                pos = np.minimum(np.searchsorted(members, low), len(members) - 1)
+                found[start:end] = members[pos] == low
+                positions[start:end] = offset + pos
+            offset += _cardinality(container)
+        return found, positions
+
+    def __len__(self):
+        return sum(_cardinality(container) for container in self.containers)
+
+    def __bool__(self):
+        return bool(self.keys)
+
+    def __contains__(self, value):
+        key, low = value >> 16, np.array([value & 0xFFFF], dtype=np.uint16)
+        if key not in self.keys:
+            return False
+        container = self.containers[self.keys.index(key)]
+        if container.dtype == np.uint64:
+            return bool(_bitmap_contains(container, low)[0])
+        pos = np.searchsorted(container, low[0])
+        return pos < len(container) and container[pos] == low[0]
+
+    def _combine(self, other, op, keep_left, keep_right):
+        keys, containers = [], []
+        i = j = 0
+        while i < len(self.keys) or j < len(other.keys):
+            left = self.keys[i] if i < len(self.keys) else None
+            right = other.keys[j] if j < len(other.keys) else None
+            if right is None or (left is not None and left < right):
+                if keep_left:
+                    keys.append(left)
+                    containers.append(self.containers[i])
+                i += 1
+            elif left is None or right < left:
+                if keep_right:
+                    keys.append(right)
+                    containers.append(other.containers[j])
+                j += 1
+            else:
+                container = op(self.containers[i], other.containers[j])
+                if _cardinality(container):
+                    keys.append(left)
+                    containers.append(container)
+                i += 1
+                j += 1
+        return RoaringBitmap(keys, containers)
+
+    def __and__(self, other):
+        return self._combine(other, _and, keep_left=False, keep_right=False)
+
+    def __or__(self, other):
+        return self._combine(other, _or, keep_left=True, keep_right=True)
+
+    def __sub__(self, other):
+        return self._combine(other, _andnot, keep_left=True, keep_right=False)
+
+    def nbytes(self):
+        return 2 * len(self.keys) + sum(container.nbytes for container in self.containers)
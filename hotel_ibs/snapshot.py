@@ -0,0 +1,133 @@
+"""Versioned columnar snapshots of the data behind the search API.
+
+A snapshot is a directory SNAPSHOT_DIR/<version> holding one uncompressed
+Arrow IPC file per table plus manifest.json. SNAPSHOT_DIR/CURRENT names the
+newest complete version and is replaced atomically, so readers never see a
+half-written snapshot. Readers memory-map the files: numeric columns are
+used in place (no copy, no parse), and every process serving the same
+version shares the same pages of the page cache.
+
+Tables, numeric keys sorted so rows are found by binary search:
+- chains: chain_id, chain_name
+- hotels: hotel_id, hotel_name, chain_id, latitude, longitude
+- images: image_id, hotel_id (-1: none), image_url, tag_offset
+- tags: tag_name (tag id = row number), posting_offset
+- image_tags: tag_id, image_id, neg_confidence, by_image
+- nights: hotel_id, date, availability, price
+
+image_tags rows are the postings of the tag index: grouped by tag, then by
+confidence (highest first, stored negated so it sorts ascending), then
+image_id; tags.posting_offset is the first row of each tag. by_image lists
+the same rows in image_id order and images.tag_offset is the first entry of
+each image there.
+"""
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "./cache/snapshots")
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "2"))  # versions kept on disk, including the current one
+
+FORMAT = 1
+TABLES = ["chains", "hotels", "images", "tags", "image_tags", "nights"]
+
+
+def current_version(root=SNAPSHOT_DIR):
+    """Name of the newest published snapshot, or None."""
+    try:
+        with open(os.path.join(root, "CURRENT")) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_snapshot(tables, manifest, root=SNAPSHOT_DIR):
+    """
+    Write {name: pyarrow.Table} as a new version, publish it and drop the
+    versions beyond SNAPSHOT_KEEP. Returns the version name.
+    """
+    import pyarrow as pa
+
+    version = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    suffix = 1
+    while os.path.exists(os.path.join(root, version)):
+        version = f"{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}-{suffix}"
+        suffix += 1
+    tmp_path = os.path.join(root, f".{version}.tmp")
+    os.makedirs(tmp_path)
+    for name in TABLES:
+        # One record batch per table, so every column is one contiguous buffer
+        table = tables[name].combine_chunks()
+        with pa.OSFile(os.path.join(tmp_path, f"{name}.arrow"), "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table, max_chunksize=max(table.num_rows, 1))
+    manifest = {
+        **manifest,
+        "format": FORMAT,
+        "version": version,
+        "rows": {name: tables[name].num_rows for name in TABLES},
+    }
+    with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(root, version))
+
+    with open(os.path.join(root, "CURRENT.tmp"), "w") as f:
+        f.write(version)
+    os.replace(os.path.join(root, "CURRENT.tmp"), os.path.join(root, "CURRENT"))
+
+    # Processes still serving an older version keep their mapped pages after the unlink
+    versions = sorted(name for name in os.listdir(root)
+                      if not name.startswith(".") and os.path.isdir(os.path.join(root, name)))
+    for name in versions[:-SNAPSHOT_KEEP]:
+        if name != version:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    return version
+
+
+class Snapshot:
+    """One snapshot version, memory-mapped read-only."""
+
+    def __init__(self, path):
+        import pyarrow as pa
+
+        self.path = path
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != FORMAT:
+            raise ValueError(f"Snapshot at {path} has format {self.manifest.get('format')}, expected {FORMAT}")
+        self.version = self.manifest["version"]
+        self.tables = {
+            name: pa.ipc.open_file(pa.memory_map(os.path.join(path, f"{name}.arrow"))).read_all()
+            for name in TABLES
+        }
+
+    @classmethod
+    def open(cls, root=SNAPSHOT_DIR):
+        """The current snapshot, or None if none was exported yet."""
+        version = current_version(root)
+        return cls(os.path.join(root, version)) if version else None
+
+    def array(self, table, column):
+        """A numeric column as a numpy array over the mapped file (read-only, no copy)."""
+        chunks = self.tables[table].column(column).chunks
+        if len(chunks) == 1:
+            return chunks[0].to_numpy()
+        return self.tables[table].column(column).to_numpy()
+
+    def rows(self, table, columns):
+        """Rows of some columns as tuples of Python values."""
+        return zip(*(self.tables[table].column(column).to_pylist() for column in columns))
+
+    def lookup(self, table, key, values):
+        """{key value: row dict} for the values present in the table's sorted key column."""
+        keys = self.array(table, key)
+        values = np.asarray(sorted(set(values)), dtype=keys.dtype)
+        if not len(keys) or not len(values):
+            return {}
+        positions = np.minimum(np.searchsorted(keys, values), len(keys) - 1)
+        positions = positions[keys[positions] == values]
+        rows = self.tables[table].take(positions).to_pylist()
+        return {row[key]: row for row in rows}
@@ -0,0 +1,166 @@
+"""Synthetic Hotels-50K-shaped dataset for benchmarks.
+
+Scale factor 1 is the size of Hotels-50K: 92 chains, 50,000 hotels and
+1,000,000 images, each tagged with the top 10 tags of the vocabulary. The
+distributions are skewed like the real data: hotels cluster around cities,
+a few hotels have many images, and a few tags are on most images.
+
+The output is the set of input files the loader scripts read, so a
+benchmark loads it through the same code as the real dataset:
+- dataset/chain_info.csv, dataset/hotel_info.csv and dataset/train_set.csv,
+  read by 01_create_database.py (and, as scripts/, by 02_populate_database)
+- an image manifest listing images/<chain_id>/<hotel_id>/<image_id>.jpg, so
+  02_populate_database needs no image files
+- tagged_images.csv (image_id, tags), read by 04_import_tags_to_database.py
+Calendars are generated by 05_generate_availability_and_pricing.py itself.
+"""
+import csv
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from hotel_ibs.image_manifest import ImageManifest
+from hotel_ibs.vocabulary import GENERATED_TEXTS
+
+CHAINS = 92
+HOTELS = 50000
+IMAGES = 1000000
+TAGS_PER_IMAGE = 10
+CHUNK_ROWS = 50000
+
+
+def zipf_weights(n, exponent=1.0, rng=None):
+    """Normalized weights 1/rank^exponent, in a random order of ranks when rng is given."""
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    if rng is not None:
+        rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def sizes(scale):
+    """Row counts of the tables at a scale factor."""
+    return {
+        "chains": max(2, int(round(CHAINS * min(scale, 1.0) ** 0.5))),
+        "hotels": max(10, int(round(HOTELS * scale))),
+        "images": max(100, int(round(IMAGES * scale))),
+    }
+
+
+def generate_hotels(scale, rng):
+    counts = sizes(scale)
+    chains = pd.DataFrame({
+        "chain_id": np.arange(1, counts["chains"] + 1),
+        "chain_name": [f"Chain {i}" for i in range(1, counts["chains"] + 1)],
+    })
+    n_hotels = counts["hotels"]
+    # Hotels cluster around cities; a few cities hold most of them
+    n_cities = max(5, n_hotels // 100)
+    city_lat = rng.uniform(-45, 60, n_cities)
+    city_lon = rng.uniform(-180, 180, n_cities)
+    city = rng.choice(n_cities, n_hotels, p=zipf_weights(n_cities, 0.8))
+    hotels = pd.DataFrame({
+        "hotel_id": np.arange(1, n_hotels + 1),
+        "hotel_name": [f"Hotel {i}" for i in range(1, n_hotels + 1)],
+        "chain_id": rng.choice(chains["chain_id"].to_numpy(), n_hotels, p=zipf_weights(len(chains), 1.1)),
+        "latitude": np.clip(city_lat[city] + rng.normal(0, 0.05, n_hotels), -89.9, 89.9).round(6),
+        "longitude": ((city_lon[city] + rng.normal(0, 0.05, n_hotels) + 180) % 360 - 180).round(6),
+    })
+    return chains, hotels
+
+
+def generate_images(hotels, scale, rng):
+    """(image_id, hotel_id) rows; images per hotel are log-normally distributed."""
+    n_images = sizes(scale)["images"]
+    weights = rng.lognormal(0, 1, len(hotels))
+    per_hotel = rng.multinomial(n_images, weights / weights.sum())
+    hotel_ids = np.repeat(hotels["hotel_id"].to_numpy(), per_hotel)
+    rng.shuffle(hotel_ids)
+    return pd.DataFrame({"image_id": np.arange(1, n_images + 1), "hotel_id": hotel_ids})
+
+
+def generate_tags(image_ids, rng, texts=GENERATED_TEXTS, top_k=TAGS_PER_IMAGE):
+    """
+    Yield (image_id, {tag: confidence}) like the tagger's top-k output.
+
+    Tags are drawn without replacement with Zipf popularity (Gumbel top-k);
+    confidences decrease with rank and sum to less than 1, like a softmax
+    over the whole vocabulary.
+    """
+    texts = list(dict.fromkeys(texts))
+    log_weights = np.log(zipf_weights(len(texts), 1.0, rng))
+    for start in range(0, len(image_ids), CHUNK_ROWS):
+        ids = image_ids[start:start + CHUNK_ROWS]
+        keys = log_weights + rng.gumbel(size=(len(ids), len(texts)))
+        top = np.argpartition(-keys, top_k - 1, axis=1)[:, :top_k]
+        top_keys = np.take_along_axis(keys, top, axis=1)
+        order = np.argsort(-top_keys, axis=1)
+        top, top_keys = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_keys, order, axis=1)
+        scores = np.exp(top_keys - top_keys[:, :1])
+        scores *= rng.uniform(0.4, 0.95, (len(ids), 1)) / scores.sum(axis=1, keepdims=True)
+        for image_id, tag_indices, confidences in zip(ids.tolist(), top.tolist(), scores.round(4).tolist()):
+            yield image_id, {texts[i]: confidence for i, confidence in zip(tag_indices, confidences)}
+
+
+def write_manifest(path, images, hotels):
+    """List every image as present in the tree, so the loader takes its paths from the manifest."""
+    if os.path.exists(path):
+        os.remove(path)
+    chain_of = dict(zip(hotels["hotel_id"].tolist(), hotels["chain_id"].tolist()))
+    manifest = ImageManifest(path)
+    now = time.time()
+    for start in range(0, len(images), CHUNK_ROWS):
+        chunk = images.iloc[start:start + CHUNK_ROWS]
+        manifest._write([
+            (f"./images/{chain_of[hotel_id]}/{hotel_id}/{image_id}.jpg", str(chain_of[hotel_id]), str(hotel_id),
+             str(image_id), 50000, 0, 640, 480, f"{image_id:032x}", None, now)
+            for image_id, hotel_id in zip(chunk["image_id"].tolist(), chunk["hotel_id"].tolist())
+        ])
+    manifest.close()
+
+
+def generate(path, scale=0.01, seed=0):
+    """
+    Write the dataset for (scale, seed) under path and return its summary.
+    A dataset already generated there with the same parameters is reused.
+    """
+    summary_path = os.path.join(path, "dataset.json")
+    if os.path.exists(summary_path):
+        with open(summary_path) as f:
+            summary = json.load(f)
+        if summary["scale"] == scale and summary["seed"] == seed:
+            return summary
+
+    start_time = time.time()
+    rng = np.random.default_rng(seed)
+    dataset_dir = os.path.join(path, "dataset")
+    os.makedirs(dataset_dir, exist_ok=True)
+    chains, hotels = generate_hotels(scale, rng)
+    images = generate_images(hotels, scale, rng)
+    chains.to_csv(os.path.join(dataset_dir, "chain_info.csv"), index=False)
+    hotels.to_csv(os.path.join(dataset_dir, "hotel_info.csv"), index=False)
+    images.to_csv(os.path.join(dataset_dir, "train_set.csv"), index=False)
+    write_manifest(os.path.join(path, "image_manifest.sqlite"), images, hotels)
+
+    image_tags = 0
+    with open(os.path.join(path, "tagged_images.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["image_id", "tags"])
+        for image_id, tags in generate_tags(images["image_id"].to_numpy(), rng):
+            writer.writerow([image_id, json.dumps(tags, ensure_ascii=False)])
+            image_tags += len(tags)
+
+    summary = {
+        "scale": scale,
+        "seed": seed,
+        "chains": len(chains),
+        "hotels": len(hotels),
+        "images": len(images),
+        "image_tags": image_tags,
+        "seconds": round(time.time() - start_time, 3),
+    }
+    with open(summary_path, "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
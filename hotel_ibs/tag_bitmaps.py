@@ -0,0 +1,289 @@
+"""Per-tag compressed bitmaps of image ids with quantized confidences.
+
+Every tag in the `tags` dictionary table gets a RoaringBitmap of the images
+carrying it plus a uint16 confidence per image, in image_id order. The whole
+set is saved as one .npz file next to the database, so boolean tag queries
+such as "pool AND ocean AND NOT kids club" run as bitmap operations without
+touching Postgres.
+"""
+import os
+import re
+
+import numpy as np
+
+from hotel_ibs.roaring import RoaringBitmap
+
+TAG_BITMAPS_PATH = os.getenv("TAG_BITMAPS_PATH", "./cache/tag_bitmaps.npz")
+
+CONFIDENCE_SCALE = 65535
+
+# image_tags.confidence_q holds the same quantization in a signed SMALLINT
+DB_CONFIDENCE_SCALE = 32767
+
+CREATE_TAGS_SQL = """
+    CREATE TABLE IF NOT EXISTS tags (
+        tag_id SMALLSERIAL PRIMARY KEY,
+        tag_name TEXT NOT NULL UNIQUE
+    );
+"""
+
+
+def quantized_confidence_sql(column):
+    """SQL expression computing image_tags.confidence_q from a confidence column."""
+    return f"round(least(greatest({column}, 0), 1) * {DB_CONFIDENCE_SCALE})::smallint"
+
+
+def confidence_sql(column):
+    """SQL expression computing the confidence (float8) from an image_tags.confidence_q column."""
+    return f"({column}::float8 / {DB_CONFIDENCE_SCALE})"
+
+
+def quantize(confidences):
+    """Map confidences in [0, 1] to uint16."""
+    return np.round(np.clip(np.asarray(confidences, dtype=np.float64), 0.0, 1.0) * CONFIDENCE_SCALE).astype(np.uint16)
+
+
+def dequantize(quantized):
+    return np.asarray(quantized, dtype=np.float32) / CONFIDENCE_SCALE
+
+
+class TagBitmaps:
+    def __init__(self, tag_names, bitmaps, confidences):
+        self.tag_names = tag_names          # tag_id -> tag_name
+        self.bitmaps = bitmaps              # tag_id -> RoaringBitmap
+        self.confidences = confidences      # tag_id -> uint16 array in image_id order
+        self.tag_ids = {name.lower(): tag_id for tag_id, name in tag_names.items()}
+        self._universe = None
+
+    @classmethod
+    def build(cls, tag_names, rows):
+        """
+        Build from (tag_id, image_id, confidence) rows sorted by tag_id, image_id.
+
+        Rows are consumed as a stream, one tag at a time.
+        """
+        bitmaps, confidences = {}, {}
+        current, ids, scores = None, [], []
+
+        def flush():
+            if current is not None:
+                bitmaps[current] = RoaringBitmap.from_array(ids)
+                confidences[current] = quantize(scores)
+
+        for tag_id, image_id, confidence in rows:
+            if tag_id != current:
+                flush()
+                current, ids, scores = tag_id, [], []
+            ids.append(image_id)
+            scores.append(confidence or 0.0)
+        flush()
+        return cls(dict(tag_names), bitmaps, confidences)
+
+    def save(self, path=TAG_BITMAPS_PATH):
+        """Write every bitmap into flat arrays of one .npz file, atomically."""
+        tag_ids = sorted(self.bitmaps)
+        keys, kinds, data, data_offsets, container_offsets, conf_offsets = [], [], [], [0], [0], [0]
+        for tag_id in tag_ids:
+            bitmap = self.bitmaps[tag_id]
+            for key, container in zip(bitmap.keys, bitmap.containers):
+                keys.append(key)
+                kinds.append(1 if container.dtype == np.uint64 else 0)
+                data.append(container.view(np.uint16))
+                data_offsets.append(data_offsets[-1] + len(data[-1]))
+            container_offsets.append(len(keys))
+            conf_offsets.append(conf_offsets[-1] + len(self.confidences[tag_id]))
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            tag_ids=np.asarray(tag_ids, dtype=np.int32),
+            tag_names=np.asarray([self.tag_names[tag_id] for tag_id in tag_ids], dtype=str),
+            container_offsets=np.asarray(container_offsets, dtype=np.int64),
+            keys=np.asarray(keys, dtype=np.uint16),
+            kinds=np.asarray(kinds, dtype=np.uint8),
+            data_offsets=np.asarray(data_offsets, dtype=np.int64),
+            data=np.concatenate(data) if data else np.empty(0, dtype=np.uint16),
+            conf_offsets=np.asarray(conf_offsets, dtype=np.int64),
+            confidences=(np.concatenate([self.confidences[tag_id] for tag_id in tag_ids])
+                         if tag_ids else np.empty(0, dtype=np.uint16)),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=TAG_BITMAPS_PATH):
+        with np.load(path) as f:
+            arrays = {name: f[name] for name in f.files}
+        tag_names, bitmaps, confidences = {}, {}, {}
+        for i, tag_id in enumerate(arrays["tag_ids"].tolist()):
+            tag_names[tag_id] = str(arrays["tag_names"][i])
+            keys, containers = [], []
+            for c in range(arrays["container_offsets"][i], arrays["container_offsets"][i + 1]):
+                words = arrays["data"][arrays["data_offsets"][c]:arrays["data_offsets"][c + 1]]
+                keys.append(int(arrays["keys"][c]))
+                containers.append(words.view(np.uint64) if arrays["kinds"][c] else words)
+            bitmaps[tag_id] = RoaringBitmap(keys, containers)
+            confidences[tag_id] = arrays["confidences"][arrays["conf_offsets"][i]:arrays["conf_offsets"][i + 1]]
+        return cls(tag_names, bitmaps, confidences)
+
+    def nbytes(self):
+        return sum(bitmap.nbytes() for bitmap in self.bitmaps.values()) + \
+            sum(conf.nbytes for conf in self.confidences.values())
+
+    def universe(self):
+        """Every tagged image, used as the left side of a leading NOT."""
+        if self._universe is None:
+            universe = RoaringBitmap()
+            for bitmap in self.bitmaps.values():
+                universe = universe | bitmap
+            self._universe = universe
+        return self._universe
+
+    def expand(self, term):
+        """tag_ids of every tag containing term, like ILIKE '%term%'."""
+        term = term.strip().lower()
+        return [tag_id for name, tag_id in self.tag_ids.items() if term in name]
+
+    def term_bitmap(self, term):
+        bitmap = RoaringBitmap()
+        for tag_id in self.expand(term):
+            bitmap = bitmap | self.bitmaps[tag_id]
+        return bitmap
+
+    def confidence(self, tag_id, image_ids):
+        """Confidences of tag_id for sorted image_ids (0 where the tag is absent)."""
+        found, pos = self.bitmaps[tag_id].rank(image_ids)
+        scores = np.zeros(len(image_ids), dtype=np.float32)
+        scores[found] = dequantize(self.confidences[tag_id][pos[found]])
+        return scores
+
+    def query(self, expression, k=100, allowed=None, after=None):
+        """
+        Evaluate a boolean tag expression and rank the matching images.
+
+        Images are scored by the sum, over every positive term, of their best
+        confidence among the tags matching that term. An `allowed` bitmap
+        restricts the result, e.g. to images of hotels passing other filters.
+        Returns the top-k (image_id, score) pairs, ordered by score descending
+        then image_id; with after=(score, image_id) the ranking continues
+        after that pair (keyset pagination).
+
+        Matches are scored one bitmap container (at most 65536 ids) at a
+        time and only the best k so far are kept, so memory does not grow
+        with the number of matches.
+        """
+        parser = BooleanQuery(expression)
+        matched = parser.evaluate(self)
+        if allowed is not None:
+            matched = matched & allowed
+        term_tags = [self.expand(term) for term in parser.positive_terms]
+
+        top_ids, top_scores = np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.float32)
+        for image_ids in matched.chunks():
+            scores = np.zeros(len(image_ids), dtype=np.float32)
+            for tag_ids in term_tags:
+                best = np.zeros(len(image_ids), dtype=np.float32)
+                for tag_id in tag_ids:
+                    np.maximum(best, self.confidence(tag_id, image_ids), out=best)
+                scores += best
+            if after is not None:
+                after_score, after_id = np.float32(after[0]), after[1]
+                keep = (scores < after_score) | ((scores == after_score) & (image_ids > after_id))
+                image_ids, scores = image_ids[keep], scores[keep]
+            image_ids = np.concatenate([top_ids, image_ids])
+            scores = np.concatenate([top_scores, scores])
+            top = ranked(scores, image_ids, k)
+            top_ids, top_scores = image_ids[top], scores[top]
+        return [(int(image_id), float(score)) for image_id, score in zip(top_ids, top_scores)]
+
+
+def ranked(scores, image_ids, k):
+    """
+    Indices of the k best (score descending, image_id ascending) entries.
+
+    Quantized confidences tie often, so ties at the k-th score are broken by
+    image_id rather than left to argpartition; pages stay stable.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    kth = np.partition(-scores, k - 1)[k - 1]
+    top = np.flatnonzero(-scores <= kth)
+    return top[np.lexsort((image_ids[top], -scores[top]))][:k]
+
+
+class BooleanQuery:
+    """
+    Parser for tag expressions with AND, OR, NOT and parentheses.
+
+    Operators are upper-case keywords, NOT binds tightest and AND binds
+    tighter than OR. Anything between operators is a (multi-word) tag term:
+    "pool AND ocean AND NOT kids club".
+    """
+
+    TOKEN = re.compile(r"\(|\)|\bAND\b|\bOR\b|\bNOT\b|[^()]+?(?=\s*(?:\(|\)|\bAND\b|\bOR\b|\bNOT\b|$))")
+    OPERATORS = {"AND", "OR", "NOT", "(", ")"}
+
+    def __init__(self, expression):
+        self.tokens = [token.strip() for token in self.TOKEN.findall(expression) if token.strip()]
+        self.positive_terms = []
+        self.pos = 0
+        self.tree = self._parse_or(negated=False)
+        if self.pos != len(self.tokens):
+            raise ValueError(f"Unexpected '{self.tokens[self.pos]}' in tag query")
+
+    @classmethod
+    def is_boolean(cls, expression):
+        return bool(re.search(r"\bAND\b|\bOR\b|\bNOT\b", expression))
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _parse_or(self, negated):
+        node = self._parse_and(negated)
+        while self._peek() == "OR":
+            self.pos += 1
+            node = ("or", node, self._parse_and(negated))
+        return node
+
+    def _parse_and(self, negated):
+        node = self._parse_not(negated)
+        while self._peek() == "AND":
+            self.pos += 1
+            node = ("and", node, self._parse_not(negated))
+        return node
+
+    def _parse_not(self, negated):
+        if self._peek() == "NOT":
+            self.pos += 1
+            return ("not", self._parse_not(not negated))
+        return self._parse_atom(negated)
+
+    def _parse_atom(self, negated):
+        token = self._peek()
+        if token is None or token in self.OPERATORS - {"("}:
+            raise ValueError("Expected a tag in tag query")
+        self.pos += 1
+        if token == "(":
+            node = self._parse_or(negated)
+            if self._peek() != ")":
+                raise ValueError("Missing ')' in tag query")
+            self.pos += 1
+            return node
+        if not negated:
+            self.positive_terms.append(token)
+        return ("term", token)
+
+    def evaluate(self, bitmaps, node=None):
+        node = node or self.tree
+        if node[0] == "term":
+            return bitmaps.term_bitmap(node[1])
+        if node[0] == "not":
+            return bitmaps.universe() - self.evaluate(bitmaps, node[1])
+        left, right = node[1], node[2]
+        if node[0] == "and":
+            # a AND NOT b is a plain difference; no need to build the complement.
+            if right[0] == "not":
+                return self.evaluate(bitmaps, left) - self.evaluate(bitmaps, right[1])
+            return self.evaluate(bitmaps, left) & self.evaluate(bitmaps, right)
+        return self.evaluate(bitmaps, left) | self.evaluate(bitmaps, right)
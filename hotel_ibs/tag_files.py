@@ -0,0 +1,182 @@
+"""Tagging output files (image_id, tags): the tagged CSV and JSONL shards.
+
+Shards are written by TagShardWriter: every shard_size results become one
+immutable part-NNNNN.jsonl file, and checkpoint.json lists the completed
+shards. Both are written to a temporary name and renamed, so an interrupted
+run loses at most the current shard and a restart skips every image_id
+already in a listed shard.
+"""
+import ast
+import csv
+import io
+import json
+import os
+import re
+
+# One "'tag': score" pair of a dict written with Python's repr (or JSON).
+# Keys use whichever quote they do not contain, e.g. "chef's table".
+TAG_PAIR = re.compile(r"""(?:'((?:[^'\\]|\\.)*)'|"((?:[^"\\]|\\.)*)")\s*:\s*([-+0-9.eE]+|nan|NaN)""")
+
+
+def parse_tags(text):
+    """
+    Parse a {tag: score} dict as written by the tagger into the CSV.
+
+    Handles Python repr and JSON quoting, so tags such as "à la carte" or
+    "chef's table" survive. Uses a regex scan instead of ast.literal_eval
+    for speed, and only falls back to it for keys with escape sequences.
+    """
+    tags = {}
+    for single, double, score in TAG_PAIR.findall(text):
+        key = single or double
+        if "\\" in key:
+            quote = "'" if single else '"'
+            key = ast.literal_eval(f"{quote}{key}{quote}")
+        tags[key] = float(score)
+    if not tags and text.strip() not in ("", "{}"):
+        tags = {str(k): float(v) for k, v in json.loads(text).items()}
+    return tags
+
+
+def iter_csv_chunks(path, start_offset=0, chunk_rows=50000):
+    """
+    Stream a tagged-images CSV (header: image_id,tags) in chunks.
+
+    Yields (rows, end_offset) where rows are (image_id, tags dict) pairs and
+    end_offset is the byte offset just after the chunk, so a reader can
+    resume exactly there. Memory is bounded by chunk_rows.
+    """
+    with open(path, "rb") as f:
+        header = next(csv.reader([f.readline().decode("utf-8")]))
+        id_col, tags_col = header.index("image_id"), header.index("tags")
+        if start_offset:
+            f.seek(start_offset)
+
+        rows = []
+        record = b""
+        while True:
+            line = f.readline()
+            if line:
+                record += line
+                # A quoted field may contain newlines: wait for balanced quotes.
+                if record.count(b'"') % 2:
+                    continue
+                if record.strip():
+                    fields = next(csv.reader(io.StringIO(record.decode("utf-8"))))
+                    rows.append((int(fields[id_col]), parse_tags(fields[tags_col])))
+                record = b""
+            if rows and (len(rows) >= chunk_rows or not line):
+                yield rows, f.tell()
+                rows = []
+            if not line:
+                break
+
+
+def iter_jsonl_chunks(path, start_offset=0, chunk_rows=50000):
+    """
+    Same as iter_csv_chunks for a JSONL shard of {"image_id": ..., "tags": {...}} lines.
+
+    An unterminated last line that is not valid JSON (a torn write) is skipped.
+    """
+    with open(path, "rb") as f:
+        f.seek(start_offset)
+        rows = []
+        for line in iter(f.readline, b""):
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    if line.endswith(b"\n"):
+                        raise
+                    break
+                rows.append((int(record["image_id"]), record["tags"]))
+            if len(rows) >= chunk_rows:
+                yield rows, f.tell()
+                rows = []
+        if rows:
+            yield rows, f.tell()
+
+
+def _replace_atomically(path, write):
+    partial = f"{path}.tmp"
+    with open(partial, "w", encoding="utf-8") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(partial, path)
+
+
+def read_checkpoint(directory):
+    """Completed shard names and image count of a shard directory."""
+    path = os.path.join(directory, "checkpoint.json")
+    if not os.path.exists(path):
+        return {"shards": [], "images": 0}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def shard_paths(directory):
+    """Paths of the completed shards, in write order."""
+    return [os.path.join(directory, name) for name in read_checkpoint(directory)["shards"]]
+
+
+class TagShardWriter:
+    """
+    Stream tagging results to JSONL shards with an atomic checkpoint.
+
+    Memory holds one shard of results plus the set of image_ids already
+    written (for skipping on restart), whatever the dataset size.
+    """
+
+    def __init__(self, directory, shard_size=10000):
+        self.directory = directory
+        self.shard_size = shard_size
+        os.makedirs(directory, exist_ok=True)
+        checkpoint = read_checkpoint(directory)
+        self.shards = checkpoint["shards"]
+        self.images = checkpoint["images"]
+        self.done = set()
+        for path in shard_paths(directory):
+            for rows, _ in iter_jsonl_chunks(path):
+                self.done.update(str(image_id) for image_id, _ in rows)
+        self.buffer = []
+
+    def __contains__(self, image_id):
+        return str(image_id) in self.done
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    def write(self, image_id, tags):
+        self.buffer.append({"image_id": int(image_id), "tags": {tag: float(score) for tag, score in tags.items()}})
+        self.done.add(str(image_id))
+        if len(self.buffer) >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered results as a new shard and record it in the checkpoint."""
+        if not self.buffer:
+            return
+        name = f"part-{len(self.shards):05d}.jsonl"
+        _replace_atomically(os.path.join(self.directory, name), lambda f: f.writelines(
+            json.dumps(record, ensure_ascii=False) + "\n" for record in self.buffer
+        ))
+        self.shards.append(name)
+        self.images += len(self.buffer)
+        self.buffer = []
+        _replace_atomically(os.path.join(self.directory, "checkpoint.json"), lambda f: json.dump(
+            {"shards": self.shards, "images": self.images}, f
+        ))
+
+
+def shards_to_csv(directory, csv_path):
+    """Write the tagged CSV (image_id,tags) from the shards, one shard in memory at a time."""
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["image_id", "tags"])
+        for path in shard_paths(directory):
+            for rows, _ in iter_jsonl_chunks(path):
+                writer.writerows((image_id, repr(tags)) for image_id, tags in rows)
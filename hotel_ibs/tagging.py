@@ -0,0 +1,216 @@
+"""Batched CLIP tagging engine.
+
+The text side of CLIP only depends on the vocabulary, so it is encoded once,
+L2-normalized and cached on disk under a hash of (model name, vocabulary).
+Images are encoded in batches and scored against the cached matrix with a
+single matrix multiply per batch.
+"""
+import functools
+import hashlib
+import logging
+import os
+
+import numpy as np
+from PIL import Image
+
+from hotel_ibs.image_cache import iter_image_batches
+
+TEXT_EMBEDDING_CACHE_DIR = os.getenv("TEXT_EMBEDDING_CACHE_DIR", "./cache/text_embeddings")
+
+# CLIP was trained with a fixed temperature of 100 on cosine similarities.
+DEFAULT_LOGIT_SCALE = 100.0
+
+
+def vocabulary_hash(model_name, texts):
+    """Return a short, stable hash identifying a model + vocabulary pair."""
+    digest = hashlib.sha1(model_name.encode("utf-8"))
+    for text in texts:
+        digest.update(b"\0")
+        digest.update(text.encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def normalize_rows(matrix):
+    """L2-normalize every row of a 2D float array."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_tags(image_features, text_features, texts, top_k=10, logit_scale=DEFAULT_LOGIT_SCALE):
+    """
+    Score a batch of normalized image embeddings against the vocabulary.
+
+    Returns one {tag: confidence} dict per image holding the top_k tags of the
+    softmax over the whole vocabulary, highest confidence first.
+    """
+    logits = logit_scale * (np.asarray(image_features, dtype=np.float32) @ text_features.T)
+    logits -= logits.max(axis=1, keepdims=True)
+    probs = np.exp(logits)
+    probs /= probs.sum(axis=1, keepdims=True)
+
+    top_k = min(top_k, probs.shape[1])
+    top_indices = np.argpartition(-probs, top_k - 1, axis=1)[:, :top_k]
+    results = []
+    for row, indices in zip(probs, top_indices):
+        indices = indices[np.argsort(-row[indices])]
+        results.append({texts[i]: float(row[i]) for i in indices})
+    return results
+
+
+def encode_texts(model, texts, device):
+    """Encode texts with a CLIP model and return normalized float32 embeddings."""
+    import clip
+    import torch
+
+    chunks = []
+    with torch.no_grad():
+        for batch in iter_batches(texts, 256):
+            tokens = clip.tokenize(batch).to(device)
+            chunks.append(model.encode_text(tokens).float().cpu().numpy())
+    return normalize_rows(np.concatenate(chunks))
+
+
+def load_text_features(model_name, texts, cache_dir=TEXT_EMBEDDING_CACHE_DIR, model=None, device=None):
+    """
+    Return the normalized text embedding matrix for a vocabulary.
+
+    The matrix is read from cache_dir when present. Only on a cache miss is
+    CLIP needed; a loaded model can be passed in to avoid loading it twice.
+    """
+    cache_path = os.path.join(cache_dir, f"{vocabulary_hash(model_name, texts)}.npy")
+    if os.path.exists(cache_path):
+        logging.info(f"Loaded cached text embeddings from {cache_path}")
+        return np.load(cache_path)
+
+    if model is None:
+        import clip
+        import torch
+
+        device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        model, _ = clip.load(model_name, device=device)
+    features = encode_texts(model, texts, device)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.tmp.npy"
+    np.save(tmp_path, features)
+    os.replace(tmp_path, cache_path)
+    logging.info(f"Encoded {len(texts)} texts and cached them at {cache_path}")
+    return features
+
+
+def iter_batches(items, batch_size):
+    """Yield lists of up to batch_size items from any iterable."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def decode_image(image_path, transform):
+    """Decode one image and apply transform (CLIP's PIL steps) into a uint8 array, or None."""
+    try:
+        with Image.open(image_path) as image:
+            return np.asarray(transform(image), dtype=np.uint8)
+    except Exception as e:
+        logging.info(f"Error tagging image {image_path}: {e}")
+        return None
+
+
+class ClipTagger:
+    """Tag images with the closest words of a fixed vocabulary using CLIP."""
+
+    def __init__(self, texts, model_name="ViT-B/32", device=None, batch_size=64,
+                 top_k=10, cache_dir=TEXT_EMBEDDING_CACHE_DIR, embedding_store=None,
+                 image_cache=None, num_workers=0):
+        import clip
+        import torch
+
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.model, self.preprocess = clip.load(model_name, device=self.device)
+        self.model.eval()
+        self.model_name = model_name
+        self.texts = list(texts)
+        self.batch_size = batch_size
+        self.top_k = top_k
+        self.embedding_store = embedding_store
+        self.image_cache = image_cache
+        self.num_workers = num_workers
+        self.logit_scale = float(self.model.logit_scale.exp().item())
+        self.text_features = load_text_features(model_name, self.texts, cache_dir,
+                                                model=self.model, device=self.device)
+
+        # CLIP's preprocess is resize, center crop, RGB, ToTensor, Normalize. The
+        # PIL steps produce the uint8 pixels kept by the image cache; the last two
+        # are applied to whole batches in to_tensor().
+        transforms = self.preprocess.transforms
+        normalize = transforms[-1]
+        self.pixel_transform = type(self.preprocess)(transforms[:-2])
+        self.mean = torch.tensor(normalize.mean).view(1, 3, 1, 1)
+        self.std = torch.tensor(normalize.std).view(1, 3, 1, 1)
+
+    def decode_image(self, image_path):
+        """Decode, resize and crop one image to uint8 (224, 224, 3), or return None if it cannot be read."""
+        return decode_image(image_path, self.pixel_transform)
+
+    def to_tensor(self, images):
+        """Turn a (n, 224, 224, 3) uint8 batch into CLIP's normalized input tensor."""
+        import torch
+
+        batch = torch.from_numpy(np.ascontiguousarray(images)).permute(0, 3, 1, 2).float().div_(255)
+        return (batch - self.mean) / self.std
+
+    def encode_images(self, images):
+        """Encode a uint8 image batch and return normalized float32 embeddings."""
+        import torch
+
+        with torch.no_grad():
+            batch = self.to_tensor(images).to(self.device)
+            features = self.model.encode_image(batch).float().cpu().numpy()
+        return normalize_rows(features)
+
+    def score(self, image_features):
+        """Return the top-k tag dicts for a batch of normalized image embeddings."""
+        return top_k_tags(image_features, self.text_features, self.texts, self.top_k, self.logit_scale)
+
+    def tag_images(self, items, duplicates=None):
+        """
+        Tag (image_id, image_path) pairs in batches.
+
+        Yields (image_id, tags) for every image that could be decoded; failures
+        are logged and skipped. With an embedding_store, each batch's image
+        embeddings are appended to it so the images never need re-encoding.
+        duplicates maps an image_id to near-duplicate image_ids (see
+        hotel_ibs.dedup) that are yielded with the same tags and embedding
+        without being encoded themselves. With an image_cache, decoded pixels
+        are read from / added to it; num_workers > 0 decodes in a DataLoader.
+        """
+        # A plain function, so DataLoader workers never need a copy of the model
+        decode = functools.partial(decode_image, transform=self.pixel_transform)
+        batches = iter_image_batches(items, decode, self.batch_size,
+                                     cache=self.image_cache, num_workers=self.num_workers)
+        for ids, images in batches:
+            yield from self.tag_batch(ids, images, duplicates)
+
+    def tag_batch(self, ids, images, duplicates=None):
+        """Encode, store and score one decoded batch; returns (image_id, tags) pairs, duplicates included."""
+        duplicates = duplicates or {}
+        features = self.encode_images(images)
+        rows = [(image_id, i) for i, canonical_id in enumerate(ids)
+                for image_id in [canonical_id, *duplicates.get(canonical_id, ())]]
+        if self.embedding_store is not None:
+            self.embedding_store.append([image_id for image_id, _ in rows], features[[i for _, i in rows]])
+        tags = self.score(features)
+        return [(image_id, tags[i]) for image_id, i in rows]
+
+    def tag_image(self, image_path):
+        """Tag a single image; returns {} if it cannot be read."""
+        image = self.decode_image(image_path)
+        if image is None:
+            return {}
+        return self.score(self.encode_images(image[None]))[0]
@@ -0,0 +1,108 @@
+"""Tag vocabulary scored by CLIP for every image.
+
+Each tag appears once: duplicates would be scored twice and split the softmax
+between identical texts.
+"""
+
+GENERATED_TEXTS = [
+    # Rooms & Room Types
+    "room", "view", "bathroom", "bedroom", "suite", "king", "queen", "twin", 
+    "single", "double", "bed", "couch", "sofa", "studio", "penthouse",
+    
+    # Room Features & Furniture
+    "balcony", "patio", "terrace", "desk", "chair", "lamp", "nightstand", 
+    "closet", "wardrobe", "safe", "television", "TV", "minibar", "refrigerator", 
+    "microwave", "coffee", "tea", "curtains", "window", "door", "mirror",
+    
+    # Bathroom Features
+    "shower", "bathtub", "jacuzzi", "toilet", "sink", "hairdryer", "toiletries", 
+    "amenities", "towels", "steam", "sauna",
+    
+    # Bedding & Comfort
+    "linens", "pillow", "blanket", "duvet", "comforter", "mattress", "memory foam", 
+    "pillow-top", "firm", "soft", "plush",
+    
+    # Hotel Areas
+    "lobby", "reception", "concierge", "entrance", "corridor", "hallway", "elevator", 
+    "stairs", "lounge", "courtyard", "rooftop",
+    
+    # Dining & Food
+    "restaurant", "bar", "breakfast", "lunch", "dinner", "brunch", "buffet", 
+    "à la carte", "menu", "chef", "cuisine", "meal", "room service", "dining", 
+    "table", "seating",
+    
+    # Specialty Diets
+    "vegetarian", "vegan", "gluten-free", "organic", "allergen-friendly",
+    
+    # Beverages
+    "alcohol", "wine", "beer", "cocktail", "water", "beverage", "ice",
+    
+    # Amenities & Facilities
+    "pool", "gym", "spa", "fitness", "business center", "conference", "meeting", 
+    "banquet", "event", "wedding", "WiFi", "internet", "laundry", "dry cleaning", 
+    "parking", "valet",
+    
+    # Pool Types
+    "indoor pool", "outdoor pool", "infinity pool", "heated pool", "lap pool", 
+    "kiddie pool",
+    
+    # Wellness & Recreation
+    "hot tub", "steam room", "massage", "treatment", "facial", "manicure", 
+    "pedicure", "weights", "treadmill", "elliptical", "bike", "yoga",
+    
+    # Technology & Electronics
+    "USB", "outlet", "charging", "HDMI", "streaming", "cable", "satellite", 
+    "premium channels", "Netflix", "smart room", "digital key", "app-controlled", 
+    "Bluetooth", "speaker", "sound system",
+    
+    # Climate Control
+    "air-conditioning", "heating", "fan", "blackout",
+    
+    # Views & Locations
+    "ocean", "mountain", "city", "beach", "garden", "waterfront", "lakeside", 
+    "riverside", "downtown", "suburban", "rural", "urban", "central", "panoramic", 
+    "scenic", "picturesque",
+    
+    # Transportation & Access
+    "airport shuttle", "transportation", "rental", "car", "bicycle", "walking distance", 
+    "subway", "metro", "bus", "train", "station", "airport", "taxi", "uber", "lyft",
+    
+    # Design & Style
+    "decor", "modern", "classic", "luxury", "budget", "historic", "contemporary", 
+    "minimalist", "rustic", "industrial", "tropical", "Mediterranean", "alpine", 
+    "colonial", "Victorian", "Art Deco",
+    
+    # Hotel Types
+    "boutique", "chain", "independent", "resort", "motel", "inn", "lodge",
+    
+    # Special Features
+    "family-friendly", "adults-only", "pet-friendly", "accessible", "handicap", 
+    "wheelchair", "non-smoking", "smoking", "child-friendly", "kids club",
+    
+    # Service
+    "service", "staff", "turndown", "housekeeping", "wake-up call", 
+    "towel service",
+    
+    # Activities & Entertainment
+    "playground", "games", "activities", "entertainment", "live music", "DJs", 
+    "shows", "performances", "nightlife", "clubbing", "dancing", "casino", 
+    "gambling", "library", "reading area",
+    
+    # Water Activities
+    "private beach", "cabana", "lounger", "umbrella", "sunbed", "sunscreen", 
+    "poolside", "diving board", "waterslide", "water sports", "sailing", "surfing", 
+    "paddleboarding", "kayaking", "jet skiing", "fishing",
+    
+    # Sports & Recreation
+    "golf", "tennis", "basketball", "volleyball", "billiards", "ping pong", 
+    "foosball", "arcade", "board games",
+    
+    # Special Occasions
+    "honeymoon", "anniversary", "birthday", "celebration",
+    
+    # Atmosphere & Quality
+    "privacy", "quiet", "noisy", "busy", "secluded", "isolated", "connected", 
+    "convenience", "cozy", "spacious", "compact", "intimate", "expansive", 
+    "clean", "fresh", "spotless", "immaculate", "well-maintained", "renovated", 
+    "updated", "new", "breathtaking", "stunning", "sunset", "sunrise", "fireplace"
+]
@@ -1,9 +1,18 @@
 import os
-import requests
+import sys
+import time
+import random
+import asyncio
+import sqlite3
 import logging
+import aiohttp
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hotel_ibs import metrics
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -14,129 +23,342 @@ logging.basicConfig(filename='hotel_images.log', level=logging.INFO,
 # Google API Key from environment variable
 PLACES_API_KEY = os.getenv("GOOGLE_PLACES_API_KEY")
 
-# Google API URLs
-PLACES_API_URL = "https://maps.googleapis.com/maps/api/place/findplacefromtext/json"
-PLACE_DETAILS_URL = "https://maps.googleapis.com/maps/api/place/details/json"
-PHOTO_API_URL = "https://maps.googleapis.com/maps/api/place/photo"
+# Google API URLs (PLACES_API_BASE_URL can point to a local stand-in server)
+PLACES_API_BASE_URL = os.getenv("PLACES_API_BASE_URL", "https://maps.googleapis.com/maps/api/place")
+PLACES_API_URL = f"{PLACES_API_BASE_URL}/findplacefromtext/json"
+PLACE_DETAILS_URL = f"{PLACES_API_BASE_URL}/details/json"
+PHOTO_API_URL = f"{PLACES_API_BASE_URL}/photo"
 
 # Base output directory for images
 BASE_OUTPUT_DIR = "images"
 
-# Global image counter to create unique image_ids
-image_counter = 1
-
-def get_place_id(hotel_name, latitude, longitude):
-    """Retrieve the Google Place ID using the Find Place API."""
-    params = {
-        "input": f"{hotel_name}",
-        "inputtype": "textquery",
-        "locationbias": f"point:{latitude},{longitude}",
-        "fields": "place_id",
-        "key": PLACES_API_KEY
-    }
-    response = requests.get(PLACES_API_URL, params=params)
-    data = response.json()
-    
-    if "candidates" in data and len(data["candidates"]) > 0:
-        return data["candidates"][0].get("place_id")
-    else:
+# Download settings
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", "8"))  # requests in flight
+DOWNLOAD_RATE = float(os.getenv("DOWNLOAD_RATE", "10"))  # requests per second, all endpoints together
+DOWNLOAD_BURST = int(os.getenv("DOWNLOAD_BURST", "20"))  # token bucket capacity
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "4"))
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+# Job ledger: which hotels are finished and which image_id belongs to which photo,
+# so a rerun skips completed hotels and keeps every image_id it already handed out
+DOWNLOAD_LEDGER_PATH = os.getenv("DOWNLOAD_LEDGER_PATH", "download_ledger.sqlite")
+
+# Hotel states that need no further requests
+FINISHED = ("done", "not_found", "no_photos")
+
+DOWNLOAD_BYTES = metrics.counter("download_bytes_total", "Bytes of photos written to disk")
+PLACES_REQUESTS = metrics.counter("places_api_requests_total", "Google Places requests by result", ["result"])
+
+
+class RetryableResponse(Exception):
+    """Rate limited (429) or server error: worth trying again later."""
+
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+class TokenBucket:
+    """Allow `rate` acquisitions per second on average, with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class DownloadLedger:
+    """
+    SQLite record of hotel jobs and image ids; every change is committed immediately.
+    Coroutines go through call(), which runs the method on the ledger's own thread.
+    """
+
+    def __init__(self, path):
+        # Used from the single executor thread while downloading, from the caller's thread otherwise
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="download-ledger")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS hotels (
+                hotel_id INTEGER PRIMARY KEY,
+                status TEXT NOT NULL,
+                place_id TEXT,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS images (
+                image_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                hotel_id INTEGER NOT NULL,
+                photo_index INTEGER NOT NULL,
+                photo_reference TEXT NOT NULL,
+                image_url TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                UNIQUE (hotel_id, photo_index)
+            );
+        """)
+
+    async def call(self, method, *args):
+        """Run one ledger method off the event loop; a single thread keeps the calls in order."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, method, *args)
+
+    def finished_hotels(self):
+        placeholders = ", ".join("?" * len(FINISHED))
+        rows = self.conn.execute(f"SELECT hotel_id FROM hotels WHERE status IN ({placeholders})", FINISHED)
+        return {hotel_id for hotel_id, in rows}
+
+    def place_id(self, hotel_id):
+        row = self.conn.execute("SELECT place_id FROM hotels WHERE hotel_id = ?", (hotel_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_hotel(self, hotel_id, status, place_id=None):
+        with self.conn:
+            self.conn.execute("""
+                INSERT INTO hotels (hotel_id, status, place_id, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (hotel_id) DO UPDATE SET
+                    status = excluded.status,
+                    place_id = COALESCE(excluded.place_id, hotels.place_id),
+                    updated_at = excluded.updated_at
+            """, (hotel_id, status, place_id, time.time()))
+
+    def reserve_images(self, hotel_id, photo_references):
+        """
+        Give each photo position of the hotel an image_id (reused on reruns) and
+        return (image_id, photo_index, photo_reference, status) rows. Photo
+        references expire, so pending photos take the newest one.
+        """
+        with self.conn:
+            self.conn.executemany("""
+                INSERT INTO images (hotel_id, photo_index, photo_reference) VALUES (?, ?, ?)
+                ON CONFLICT (hotel_id, photo_index) DO UPDATE SET photo_reference = excluded.photo_reference
+                WHERE images.status != 'done'
+            """, [(hotel_id, i, reference) for i, reference in enumerate(photo_references)])
+        return self.conn.execute("""
+            SELECT image_id, photo_index, photo_reference, status FROM images
+            WHERE hotel_id = ? AND photo_index < ? ORDER BY photo_index
+        """, (hotel_id, len(photo_references))).fetchall()
+
+    def image_done(self, image_id, image_url):
+        with self.conn:
+            self.conn.execute("UPDATE images SET status = 'done', image_url = ? WHERE image_id = ?",
+                              (image_url, image_id))
+
+    def records(self):
+        return pd.read_sql_query(
+            "SELECT image_id, hotel_id, image_url FROM images WHERE status = 'done' ORDER BY image_id", self.conn
+        )
+
+
+class PlacesClient:
+    """Google Places calls on one pooled session, paced by a shared token bucket."""
+
+    def __init__(self, session, bucket):
+        self.session = session
+        self.bucket = bucket
+
+    async def request(self, url, params, handle):
+        """
+        GET url and return `await handle(response)`, retrying 429/5xx and network
+        errors. Other 4xx answers are permanent: handle sees them (or raises
+        ClientResponseError from raise_for_status) without a retry.
+        """
+        params = {key: value for key, value in params.items() if value is not None}  # as requests does
+        for attempt in range(DOWNLOAD_RETRIES):
+            await self.bucket.acquire()
+            try:
+                async with self.session.get(url, params=params) as response:
+                    if response.status == 429 or response.status >= 500:
+                        raise RetryableResponse(response.status)
+                    result = await handle(response)
+                    PLACES_REQUESTS.inc(result="ok" if response.status < 400 else "error")
+                    return result
+            except (RetryableResponse, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = getattr(e, "status", None)
+                PLACES_REQUESTS.inc(result="rate_limited" if status == 429 else "error")
+                permanent = isinstance(e, aiohttp.ClientResponseError) and status != 429 and status < 500
+                if permanent or attempt == DOWNLOAD_RETRIES - 1:
+                    raise
+                logging.warning(f"Retrying {url} after {e!r}")
+                await asyncio.sleep(2 ** attempt + random.random())
+
+    async def get_json(self, url, params):
+        async def handle(response):
+            response.raise_for_status()
+            return await response.json(content_type=None)
+        return await self.request(url, params, handle)
+
+    async def get_place_id(self, hotel_name, latitude, longitude):
+        """Retrieve the Google Place ID using the Find Place API."""
+        data = await self.get_json(PLACES_API_URL, {
+            "input": f"{hotel_name}",
+            "inputtype": "textquery",
+            "locationbias": f"point:{latitude},{longitude}",
+            "fields": "place_id",
+            "key": PLACES_API_KEY
+        })
+        if "candidates" in data and len(data["candidates"]) > 0:
+            return data["candidates"][0].get("place_id")
         logging.info(f"Hotel not found: {hotel_name}")
         return None
 
-def get_hotel_photos(place_id):
-    """Retrieve photo references for a hotel using the Place Details API."""
-    params = {
-        "place_id": place_id,
-        "fields": "photos",
-        "key": PLACES_API_KEY
-    }
-    response = requests.get(PLACE_DETAILS_URL, params=params)
-    data = response.json()
-    
-    if "result" in data and "photos" in data["result"]:
-        return [photo["photo_reference"] for photo in data["result"]["photos"]]
-    else:
+    async def get_hotel_photos(self, place_id):
+        """Retrieve photo references for a hotel using the Place Details API."""
+        data = await self.get_json(PLACE_DETAILS_URL, {
+            "place_id": place_id,
+            "fields": "photos",
+            "key": PLACES_API_KEY
+        })
+        if "result" in data and "photos" in data["result"]:
+            return [photo["photo_reference"] for photo in data["result"]["photos"]]
         logging.info(f"No photos found for place_id: {place_id}")
         return []
 
-def download_hotel_photos(hotel_id, hotel_name, chain_id, latitude, longitude, max_photos=20):
+    async def download_photo(self, photo_reference, filename):
+        """Stream one photo to filename in chunks; returns False if the API refused it."""
+        async def handle(response):
+            if response.status != 200:
+                return False
+            # File calls run on the default executor so a slow disk does not stall the other downloads
+            loop = asyncio.get_running_loop()
+            partial = f"{filename}.part"
+            size = 0
+            file = await loop.run_in_executor(None, open, partial, "wb")
+            try:
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_BYTES):
+                    await loop.run_in_executor(None, file.write, chunk)
+                    size += len(chunk)
+            finally:
+                await loop.run_in_executor(None, file.close)
+            DOWNLOAD_BYTES.inc(size)
+            await loop.run_in_executor(None, os.replace, partial, filename)  # Never leave a truncated .jpg behind
+            return True
+
+        return await self.request(PHOTO_API_URL, {
+            "maxwidth": 1280,
+            "photo_reference": photo_reference,
+            "key": PLACES_API_KEY
+        }, handle)
+
+
+async def download_hotel_photos(client, ledger, hotel_id, hotel_name, chain_key, latitude, longitude, max_photos=20):
     """
     Download up to max_photos for a hotel and save them in the directory structure:
     images/<chain_id>/<hotel_id>/<image_id>.jpg
-    
-    Returns a list of records for each image with keys:
-    image_id, hotel_id, image_url.
+
+    Progress is recorded in the ledger; photos saved by an earlier run are skipped.
     """
-    global image_counter
-    records = []
-    place_id = get_place_id(hotel_name, latitude, longitude)
+    place_id = await ledger.call(ledger.place_id, hotel_id)
+    place_id = place_id or await client.get_place_id(hotel_name, latitude, longitude)
     if not place_id:
-        return records
-    
-    photo_references = get_hotel_photos(place_id)
+        await ledger.call(ledger.set_hotel, hotel_id, "not_found")
+        return 0
+
+    photo_references = await client.get_hotel_photos(place_id)
     if not photo_references:
         logging.info(f"No photos available for: {hotel_name}")
-        return records
-    
-    num_photos = min(len(photo_references), max_photos)
-    for i in range(num_photos):
-        photo_params = {
-            "maxwidth": 1280,
-            "photo_reference": photo_references[i],
-            "key": PLACES_API_KEY
-        }
-        photo_response = requests.get(PHOTO_API_URL, params=photo_params, stream=True)
-        
-        if photo_response.status_code == 200:
-            # Construct the file path: images/<chain_id>/<hotel_id>/<image_id>.jpg
-            current_image_id = image_counter
-            image_counter += 1
-            output_path = os.path.join(BASE_OUTPUT_DIR, str(chain_id), str(hotel_id))
-            os.makedirs(output_path, exist_ok=True)
-            filename = os.path.join(output_path, f"{current_image_id}.jpg")
-            
-            with open(filename, "wb") as file:
-                file.write(photo_response.content)
+        await ledger.call(ledger.set_hotel, hotel_id, "no_photos", place_id)
+        return 0
+
+    output_path = os.path.join(BASE_OUTPUT_DIR, chain_key, str(hotel_id))
+    await asyncio.get_running_loop().run_in_executor(None, lambda: os.makedirs(output_path, exist_ok=True))
+    saved, failed = 0, False
+    reserved = await ledger.call(ledger.reserve_images, hotel_id, photo_references[:max_photos])
+    for image_id, i, photo_reference, status in reserved:
+        if status == "done":
+            continue
+        filename = os.path.join(output_path, f"{image_id}.jpg")
+        photo_start = time.perf_counter()
+        if await client.download_photo(photo_reference, filename):
+            await ledger.call(ledger.image_done, image_id, filename)
             logging.info(f"Saved photo {i+1} for: {hotel_name} at {filename}")
-            
-            records.append({
-                "image_id": current_image_id,
-                "hotel_id": hotel_id,
-                "image_url": filename
-            })
+            metrics.record_batch("download", 1, time.perf_counter() - photo_start)
+            saved += 1
         else:
             logging.error(f"Failed to download photo {i+1} for: {hotel_name}")
-    
-    return records
+            metrics.record_batch("download", 0, time.perf_counter() - photo_start, errors=1)
+            failed = True
+
+    await ledger.call(ledger.set_hotel, hotel_id, "failed" if failed else "done", place_id)
+    return saved
+
+
+async def download_all(hotels, ledger):
+    """Run DOWNLOAD_CONCURRENCY workers over the hotels, sharing one session and rate limit."""
+    queue = asyncio.Queue()
+    for hotel in hotels:
+        queue.put_nowait(hotel)
+
+    bucket = TokenBucket(DOWNLOAD_RATE, DOWNLOAD_BURST)
+    connector = aiohttp.TCPConnector(limit=DOWNLOAD_CONCURRENCY)
+    timeout = aiohttp.ClientTimeout(total=120)
+    stats = {"hotels": 0, "photos": 0, "errors": 0}
+    start_time = time.time()
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        client = PlacesClient(session, bucket)
+
+        async def worker():
+            while not queue.empty():
+                hotel = queue.get_nowait()
+                try:
+                    saved = await download_hotel_photos(client, ledger, *hotel, max_photos=20)
+                    stats["photos"] += saved
+                except Exception as e:
+                    # The hotel stays unfinished in the ledger and is retried on the next run
+                    logging.error(f"Failed hotel {hotel[1]}: {e!r}")
+                    await ledger.call(ledger.set_hotel, hotel[0], "failed")
+                    stats["errors"] += 1
+                stats["hotels"] += 1
+                if stats["hotels"] % 100 == 0:
+                    print(f"{stats['hotels']}/{len(hotels)} hotels, {stats['photos']} photos, "
+                          f"{stats['photos'] / (time.time() - start_time):.1f} photos/s")
+
+        await asyncio.gather(*(worker() for _ in range(DOWNLOAD_CONCURRENCY)))
+    return stats
+
 
 def process_csv(file_path, output_csv="images_output.csv"):
     """
     Read hotel data from CSV (expects columns: hotel_id, hotel_name, chain_id, latitude, longitude),
-    download images for each hotel, and write the image metadata (image_id, hotel_id, image_url)
-    to a CSV file.
+    download images for each hotel not finished by an earlier run, and write the image metadata
+    (image_id, hotel_id, image_url) of every downloaded image to a CSV file.
     """
     df = pd.read_csv(file_path, delimiter=',')
-    all_records = []
-    
-    for _, row in df.iterrows():
-        hotel_id = row["hotel_id"]
-        hotel_name = row["hotel_name"]
-        chain_id = row["chain_id"]
-        latitude = row["latitude"]
-        longitude = row["longitude"]
-        
-        if pd.notna(latitude) and pd.notna(longitude):
-            records = download_hotel_photos(hotel_id, hotel_name, chain_id, latitude, longitude, max_photos=20)
-            all_records.extend(records)
+    # Same directory names as 02_populate_database expects
+    df["chain_key"] = df["chain_id"].astype("Int64").astype("string").fillna("unknown")
+
+    ledger = DownloadLedger(DOWNLOAD_LEDGER_PATH)
+    finished = ledger.finished_hotels()
+
+    hotels = []
+    for row in df.itertuples(index=False):
+        if row.hotel_id in finished:
+            continue
+        if pd.notna(row.latitude) and pd.notna(row.longitude):
+            hotels.append((int(row.hotel_id), row.hotel_name, row.chain_key, row.latitude, row.longitude))
         else:
-            logging.info(f"Skipping hotel due to missing coordinates: {hotel_name}")
-    
+            logging.info(f"Skipping hotel due to missing coordinates: {row.hotel_name}")
+    print(f"{len(finished)} hotels already finished, {len(hotels)} to download")
+
+    stats = asyncio.run(download_all(hotels, ledger))
+    print(f"Downloaded {stats['photos']} photos for {stats['hotels']} hotels ({stats['errors']} failed hotels)")
+
     # Create and save the output CSV with the image metadata
-    records_df = pd.DataFrame(all_records, columns=["image_id", "hotel_id", "image_url"])
+    records_df = ledger.records()
     records_df.to_csv(output_csv, index=False)
-    logging.info(f"Saved image metadata CSV with {len(all_records)} records to {output_csv}")
+    logging.info(f"Saved image metadata CSV with {len(records_df)} records to {output_csv}")
 
 if __name__ == "__main__":
+    # Photos are downloaded concurrently: the stage's seconds add up the time of each photo
+    metrics.report_at_exit("00_2_download_images_from_google")
     print("Current working directory:", os.getcwd())
     print("Files in directory:", os.listdir(os.getcwd()))
     csv_file = "./scripts/hotel_info.csv"  # Ensure this path points to your hotel_info.csv file
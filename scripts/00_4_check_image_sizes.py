@@ -1,33 +1,30 @@
 import os
-from PIL import Image
-import pandas as pd
+import sys
 
-# Function to get image info
-def get_image_info(image_path):
-    try:
-        with Image.open(image_path) as img:
-            width, height = img.size
-        file_size = os.path.getsize(image_path)
-        return width, height, file_size
-    except Exception as e:
-        print(f"Error processing image: {e}")
-        return None, None, None
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hotel_ibs.image_manifest import ImageManifest, IMAGE_MANIFEST_PATH
 
-# Function to find image path recursively
+# Worker processes for reading new or modified images (default: one per CPU)
+IMAGE_SCAN_WORKERS = int(os.getenv("IMAGE_SCAN_WORKERS", "0")) or None
+
+# Function to scan the image tree: only new or modified files are opened,
+# everything else comes from the manifest of the previous run
 def scan_images(root_folder, output_csv):
-    image_data = []
+    manifest = ImageManifest(IMAGE_MANIFEST_PATH)
+    stats = manifest.update(root_folder, workers=IMAGE_SCAN_WORKERS)
+    print(f"Scanned {root_folder} in {stats['seconds']:.1f} seconds: {stats['examined']} new or modified, "
+          f"{stats['unchanged']} unchanged, {stats['removed']} removed, {stats['failed']} unreadable")
+
+    errors = manifest.query("SELECT path, error FROM images WHERE error IS NOT NULL")
+    for path, error in errors.itertuples(index=False):
+        print(f"Error processing image {path}: {error}")
 
-    for root, dirs, files in os.walk(root_folder):
-        for file in files:
-            if file.endswith('.jpg'):
-                image_path = os.path.join(root, file)
-                width, height, file_size = get_image_info(image_path)
-                print(f"Image: {image_path}, Width: {width}, Height: {height}, Size: {file_size}")
-                image_data.append([image_path, width, height, file_size])
-    
-    df = pd.DataFrame(image_data, columns=["image_path", "width", "height", "file_size"])
+    df = manifest.query("""
+        SELECT path AS image_path, width, height, size AS file_size FROM images ORDER BY path
+    """)
     df.to_csv(output_csv, index=False)
-    print(f"Image info saved to {output_csv}")
+    manifest.close()
+    print(f"Image info saved to {output_csv} (manifest: {IMAGE_MANIFEST_PATH})")
 
 if __name__ == "__main__":
     root_folder = "./images"
@@ -1,20 +1,17 @@
 import os
+import sys
 import pandas as pd
-import psycopg2
 from psycopg2 import sql
 import logging
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hotel_ibs import db
+from hotel_ibs.data_versions import CREATE_TABLE_SQL as CREATE_DATA_VERSIONS_SQL
+
 # Setup logging
 logging.basicConfig(filename='duplicates.log', level=logging.INFO, format='%(asctime)s - %(message)s')
 logging.basicConfig(filename='missing_images.log', level=logging.INFO, format='%(asctime)s - %(message)s')
 
-# Database connection details
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
-DB_NAME = os.getenv("DB_NAME")
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-
 # File paths
 DATASET_DIR = "./dataset"
 IMAGE_DIR = "./images/train"
@@ -24,10 +21,8 @@ train_set = pd.read_csv(os.path.join(DATASET_DIR, "train_set.csv"))
 hotel_info = pd.read_csv(os.path.join(DATASET_DIR, "hotel_info.csv"))
 chain_info = pd.read_csv(os.path.join(DATASET_DIR, "chain_info.csv"))
 
-# Establish database connection
-conn = psycopg2.connect(
-    dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
-)
+# Establish database connection (settings from hotel_ibs/db.py)
+conn = db.connect()
 cursor = conn.cursor()
 
 # Create tables
@@ -60,12 +55,15 @@ cursor.execute("""
 
 cursor.execute("""
     CREATE TABLE IF NOT EXISTS images (
-        image_id TEXT PRIMARY KEY,
+        image_id INT PRIMARY KEY,
         hotel_id INT REFERENCES hotels(hotel_id),
         image_url TEXT
     );
 """)
 
+# Version counters bumped by the import scripts and polled by the backend
+cursor.execute(CREATE_DATA_VERSIONS_SQL)
+
 # Commit changes and close connection
 conn.commit()
 cursor.close()
@@ -1,190 +1,311 @@
 ## NOTE!! Use Google Colab notebook instead! Image tagging on notebook is extremely slow! This script is for reference only.
 
 import os
-import torch
-import clip
-from PIL import Image
-import psycopg2
+import sys
+import glob
+import fcntl
+import shutil
+import socket
 import logging
 import time
+import multiprocessing
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hotel_ibs import db, metrics
+from hotel_ibs.data_versions import TAGS, bump_version
+from hotel_ibs.dedup import find_near_duplicates, saved_work_summary
+from hotel_ibs.embedding_store import EmbeddingStore, EMBEDDING_STORE_DIR
+from hotel_ibs.image_cache import PreprocessedImageCache, ShardedImageCache, IMAGE_CACHE_DIR
+from hotel_ibs.tag_bitmaps import quantized_confidence_sql
+from hotel_ibs.tagging import ClipTagger
+from hotel_ibs.vocabulary import GENERATED_TEXTS
+
+load_dotenv()
 
 # Setup logging
 logging.basicConfig(filename='clip_tagging.log', level=logging.INFO, format='%(asctime)s - %(message)s')
 
-# Database connection details
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
-DB_NAME = os.getenv("DB_NAME")
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-
-def connect_db():
-    return psycopg2.connect(
-        dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
-    )
-
-# Load CLIP model
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model, preprocess = clip.load("ViT-B/32", device=device)
-
-generated_texts = [
-    # Rooms & Room Types
-    "room", "view", "bathroom", "bedroom", "suite", "king", "queen", "twin", 
-    "single", "double", "bed", "couch", "sofa", "studio", "penthouse",
-    
-    # Room Features & Furniture
-    "balcony", "patio", "terrace", "desk", "chair", "lamp", "nightstand", 
-    "closet", "wardrobe", "safe", "television", "TV", "minibar", "refrigerator", 
-    "microwave", "coffee", "tea", "curtains", "window", "door", "mirror",
-    
-    # Bathroom Features
-    "shower", "bathtub", "jacuzzi", "toilet", "sink", "hairdryer", "toiletries", 
-    "amenities", "towels", "steam", "sauna",
-    
-    # Bedding & Comfort
-    "linens", "pillow", "blanket", "duvet", "comforter", "mattress", "memory foam", 
-    "pillow-top", "firm", "soft", "plush",
-    
-    # Hotel Areas
-    "lobby", "reception", "concierge", "entrance", "corridor", "hallway", "elevator", 
-    "stairs", "lounge", "courtyard", "rooftop",
-    
-    # Dining & Food
-    "restaurant", "bar", "breakfast", "lunch", "dinner", "brunch", "buffet", 
-    "à la carte", "menu", "chef", "cuisine", "meal", "room service", "dining", 
-    "table", "seating",
-    
-    # Specialty Diets
-    "vegetarian", "vegan", "gluten-free", "organic", "allergen-friendly",
-    
-    # Beverages
-    "alcohol", "wine", "beer", "cocktail", "minibar", "water", "beverage", "ice", 
-    "coffee", "tea",
-    
-    # Amenities & Facilities
-    "pool", "gym", "spa", "fitness", "business center", "conference", "meeting", 
-    "banquet", "event", "wedding", "WiFi", "internet", "laundry", "dry cleaning", 
-    "parking", "valet",
-    
-    # Pool Types
-    "indoor pool", "outdoor pool", "infinity pool", "heated pool", "lap pool", 
-    "kiddie pool",
-    
-    # Wellness & Recreation
-    "hot tub", "sauna", "steam room", "massage", "treatment", "facial", "manicure", 
-    "pedicure", "weights", "treadmill", "elliptical", "bike", "yoga",
-    
-    # Technology & Electronics
-    "WiFi", "USB", "outlet", "charging", "HDMI", "streaming", "cable", "satellite", 
-    "premium channels", "Netflix", "smart room", "digital key", "app-controlled", 
-    "Bluetooth", "speaker", "sound system",
-    
-    # Climate Control
-    "air-conditioning", "heating", "fan", "blackout",
-    
-    # Views & Locations
-    "ocean", "mountain", "city", "beach", "garden", "waterfront", "lakeside", 
-    "riverside", "downtown", "suburban", "rural", "urban", "central", "panoramic", 
-    "scenic", "picturesque",
-    
-    # Transportation & Access
-    "airport shuttle", "transportation", "rental", "car", "bicycle", "walking distance", 
-    "subway", "metro", "bus", "train", "station", "airport", "taxi", "uber", "lyft",
-    
-    # Design & Style
-    "decor", "modern", "classic", "luxury", "budget", "historic", "contemporary", 
-    "minimalist", "rustic", "industrial", "tropical", "Mediterranean", "alpine", 
-    "colonial", "Victorian", "Art Deco",
-    
-    # Hotel Types
-    "boutique", "chain", "independent", "resort", "motel", "inn", "lodge",
-    
-    # Special Features
-    "family-friendly", "adults-only", "pet-friendly", "accessible", "handicap", 
-    "wheelchair", "non-smoking", "smoking", "child-friendly", "kids club",
-    
-    # Service
-    "service", "staff", "turndown", "housekeeping", "concierge", "valet", 
-    "wake-up call", "towel service",
-    
-    # Activities & Entertainment
-    "playground", "games", "activities", "entertainment", "live music", "DJs", 
-    "shows", "performances", "nightlife", "clubbing", "dancing", "casino", 
-    "gambling", "library", "reading area",
-    
-    # Water Activities
-    "private beach", "cabana", "lounger", "umbrella", "sunbed", "sunscreen", 
-    "poolside", "diving board", "waterslide", "water sports", "sailing", "surfing", 
-    "paddleboarding", "kayaking", "jet skiing", "fishing",
-    
-    # Sports & Recreation
-    "golf", "tennis", "basketball", "volleyball", "billiards", "ping pong", 
-    "foosball", "arcade", "board games",
-    
-    # Special Occasions
-    "honeymoon", "anniversary", "birthday", "celebration",
-    
-    # Atmosphere & Quality
-    "privacy", "quiet", "noisy", "busy", "secluded", "isolated", "connected", 
-    "convenience", "cozy", "spacious", "compact", "intimate", "expansive", 
-    "clean", "fresh", "spotless", "immaculate", "well-maintained", "renovated", 
-    "updated", "new", "breathtaking", "stunning", "sunset", "sunrise", "fireplace"
-]
+# Work queue: any number of processes, on this machine (TAGGING_PROCESSES) or on
+# others sharing the database and image tree, claim TAGGING_CLAIM_SIZE untagged
+# images at a time. A claim is a lease: if a worker dies, its images become
+# claimable again after TAGGING_LEASE_SECONDS.
+TAGGING_PROCESSES = int(os.getenv("TAGGING_PROCESSES", "1"))
+TAGGING_CLAIM_SIZE = int(os.getenv("TAGGING_CLAIM_SIZE", "256"))
+TAGGING_LEASE_SECONDS = int(os.getenv("TAGGING_LEASE_SECONDS", "600"))
+TAGGING_MAX_ATTEMPTS = int(os.getenv("TAGGING_MAX_ATTEMPTS", "3"))
+
+# Load CLIP model once per process; the vocabulary embeddings are encoded on first
+# use and cached on disk, images are encoded in batches of TAGGING_BATCH_SIZE.
+# Image embeddings are kept in the embedding store so that a vocabulary change
+# only needs 06_rescore_tags.py, not another pass over the images.
+TAGGING_BATCH_SIZE = int(os.getenv("TAGGING_BATCH_SIZE", "64"))
+# Optional cache of decoded 224x224 pixels (IMAGE_CACHE_DIR), so later runs skip
+# JPEG decoding and resizing; TAGGING_WORKERS processes decode/read ahead of the encoder.
+USE_IMAGE_CACHE = os.getenv("USE_IMAGE_CACHE", "0") == "1"
+TAGGING_WORKERS = int(os.getenv("TAGGING_WORKERS", "0"))
+tagger = None
+
+def shard_suffix():
+    # The stores are single-writer append-only files: every tagging process, here or on
+    # another machine sharing the directory, writes its own shard, merged by merge_shards()
+    return f"_{socket.gethostname()}_{os.getpid()}"
+
+def get_tagger():
+    global tagger
+    if tagger is None:
+        embedding_store = EmbeddingStore(EMBEDDING_STORE_DIR + shard_suffix(), dim=512)
+        image_cache = None
+        if USE_IMAGE_CACHE:
+            # Pixels cached by earlier runs are read from the main cache, new ones go to the shard
+            image_cache = ShardedImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_DIR + shard_suffix())
+        tagger = ClipTagger(GENERATED_TEXTS, model_name="ViT-B/32", batch_size=TAGGING_BATCH_SIZE,
+                            embedding_store=embedding_store, image_cache=image_cache,
+                            num_workers=TAGGING_WORKERS)
+    return tagger
+
+TAG_IMAGE_SECONDS = metrics.histogram("tagging_image_seconds", "Time to tag one image with tag_image()")
 
 def tag_image(image_path):
-    try:
-        image = preprocess(Image.open(image_path)).unsqueeze(0).to(device)
-        with torch.no_grad():
-            image_features = model.encode_image(image)
-        
-        # Use OpenAI CLIP internal dictionary to generate tags dynamically
-        start_time = time.time()
-        text_features = model.encode_text(clip.tokenize(generated_texts).to(device))
-        similarities = (image_features @ text_features.T).softmax(dim=-1)
-        end_time = time.time()
-        print(f"Time taken to find tags: {end_time - start_time} seconds")
-
-        
-        # Select the most relevant generated tags based on the highest similarity scores
-        top_indices = similarities[0].argsort(descending=True)[:10]  # Top 5 tags
-        relevant_tags = {generated_texts[i]: float(similarities[0][i]) for i in top_indices}
-        
-        return relevant_tags
-    except Exception as e:
-        logging.info(f"Error tagging image {image_path}: {e}")
-        return {}
-
-def insert_tags_into_db(image_id, tag_results):
-    conn = connect_db()
+    with TAG_IMAGE_SECONDS.time():
+        return get_tagger().tag_image(image_path)
+
+def create_queue(conn):
     cursor = conn.cursor()
-    
-    for tag, score in tag_results.items():
-        cursor.execute("INSERT INTO tags (tag_name) VALUES (%s) ON CONFLICT (tag_name) DO NOTHING;", (tag,))
-        cursor.execute("SELECT tag_id FROM tags WHERE tag_name = %s;", (tag,))
-        tag_id = cursor.fetchone()[0]
-        cursor.execute("INSERT INTO image_tags (image_id, tag_id) VALUES (%s, %s) ON CONFLICT DO NOTHING;", (image_id, tag_id))
-    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tagging_queue (
+            image_id INT PRIMARY KEY,
+            image_url TEXT NOT NULL,
+            canonical_id INT,
+            lease_owner TEXT,
+            lease_expires_at TIMESTAMPTZ,
+            attempts INT NOT NULL DEFAULT 0,
+            done_at TIMESTAMPTZ,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_tagging_queue_pending
+        ON tagging_queue (image_id) WHERE done_at IS NULL AND canonical_id IS NULL;
+        CREATE INDEX IF NOT EXISTS idx_tagging_queue_canonical
+        ON tagging_queue (canonical_id) WHERE canonical_id IS NOT NULL;
+    """)
     conn.commit()
     cursor.close()
-    conn.close()
 
-def process_images():
-    conn = connect_db()
+def seed_queue(conn):
+    """
+    Queue every image that has no tags yet and is not queued, then mark the
+    near-duplicates among them (DEDUP_RADIUS, 0 disables) so that only their
+    canonical image is encoded. An advisory lock lets one process seed at a time.
+    """
     cursor = conn.cursor()
-    cursor.execute("SELECT image_id, image_url FROM images;")
-    images = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    
-    for image_id, image_path in images:
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('tagging_queue'));")
+    cursor.execute("""
+        INSERT INTO tagging_queue (image_id, image_url)
+        SELECT images.image_id, images.image_url
+        FROM images
+        WHERE NOT EXISTS (SELECT 1 FROM image_tags WHERE image_tags.image_id = images.image_id)
+        ON CONFLICT (image_id) DO NOTHING
+        RETURNING image_id, image_url;
+    """)
+    queued = sorted(cursor.fetchall(), key=lambda row: row[0])
+    existing = []
+    for image_id, image_path in queued:
         if os.path.exists(image_path):
-            tag_results = tag_image(image_path)
-            if tag_results:
-                insert_tags_into_db(image_id, tag_results)
-                logging.info(f"Tagged image {image_id}: {tag_results}")
+            existing.append((image_id, image_path))
         else:
             logging.info(f"Image not found: {image_path}")
 
+    canonical, duplicates, dedup_stats = find_near_duplicates(existing)
+    db.insert_values(cursor, """
+        UPDATE tagging_queue SET canonical_id = data.canonical_id
+        FROM (VALUES %s) AS data (image_id, canonical_id)
+        WHERE tagging_queue.image_id = data.image_id;
+    """, [(image_id, canonical_id) for canonical_id, ids in duplicates.items() for image_id in ids])
+    conn.commit()
+    cursor.close()
+    print(f"Queued {len(queued)} images ({dedup_stats['duplicates']} near-duplicates)")
+    return dedup_stats
+
+# The queue statements run once per batch for the worker's lifetime: they are
+# server-side prepared statements (hotel_ibs/db.py), planned once per connection.
+def claim_batch(conn, worker_name):
+    """Lease up to TAGGING_CLAIM_SIZE pending images; skips rows other workers hold."""
+    cursor = conn.cursor()
+    db.execute_prepared(cursor, "claim_batch", """
+        WITH batch AS (
+            SELECT image_id FROM tagging_queue
+            WHERE done_at IS NULL AND canonical_id IS NULL
+              AND (lease_expires_at IS NULL OR lease_expires_at < now())
+              AND attempts < %s
+            ORDER BY image_id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        UPDATE tagging_queue
+        SET lease_owner = %s, lease_expires_at = now() + make_interval(secs => %s), attempts = attempts + 1
+        FROM batch
+        WHERE tagging_queue.image_id = batch.image_id
+        RETURNING tagging_queue.image_id, tagging_queue.image_url;
+    """, (TAGGING_MAX_ATTEMPTS, TAGGING_CLAIM_SIZE, worker_name, TAGGING_LEASE_SECONDS))
+    batch = sorted(cursor.fetchall())
+    if batch:
+        db.execute_prepared(cursor, "claim_duplicates", """
+            SELECT canonical_id, image_id FROM tagging_queue
+            WHERE canonical_id = ANY(%s::int[]) AND done_at IS NULL;
+        """, ([image_id for image_id, _ in batch],))
+    duplicates = {}
+    for canonical_id, image_id in (cursor.fetchall() if batch else []):
+        duplicates.setdefault(canonical_id, []).append(image_id)
+    conn.commit()
+    cursor.close()
+    return batch, duplicates
+
+def pending_elsewhere(conn):
+    """True while other workers hold live leases on unfinished images."""
+    cursor = conn.cursor()
+    db.execute_prepared(cursor, "pending_elsewhere", """
+        SELECT EXISTS (
+            SELECT 1 FROM tagging_queue
+            WHERE done_at IS NULL AND canonical_id IS NULL AND attempts < %s
+        );
+    """, (TAGGING_MAX_ATTEMPTS,))
+    pending = cursor.fetchone()[0]
+    conn.commit()
+    cursor.close()
+    return pending
+
+def insert_tags_into_db(conn, worker_name, image_ids, tag_results):
+    """Write one claimed batch in a single transaction and mark it done."""
+    cursor = conn.cursor()
+    rows = [
+        (int(image_id), tag, float(score))
+        for image_id, tags in tag_results
+        for tag, score in tags.items()
+    ]
+    # Only names that are missing, so no SMALLSERIAL ids are burnt on conflicts
+    db.execute_prepared(cursor, "insert_tag_names", """
+        INSERT INTO tags (tag_name)
+        SELECT DISTINCT new.tag_name FROM unnest(%s::text[]) AS new (tag_name)
+        LEFT JOIN tags ON tags.tag_name = new.tag_name
+        WHERE tags.tag_id IS NULL
+        ON CONFLICT (tag_name) DO NOTHING;
+    """, (sorted({tag for _, tag, _ in rows}),))
+    # The batch as three arrays: one statement of the same shape whatever the batch size
+    db.execute_prepared(cursor, "insert_image_tags", f"""
+        INSERT INTO image_tags (image_id, tag_id, confidence_q)
+        SELECT new.image_id, tags.tag_id, {quantized_confidence_sql("new.confidence_score")}
+        FROM unnest(%s::int[], %s::text[], %s::float8[]) AS new (image_id, tag_name, confidence_score)
+        JOIN tags ON tags.tag_name = new.tag_name
+        ON CONFLICT (image_id, tag_id)
+        DO UPDATE SET confidence_q = EXCLUDED.confidence_q, tagged_at = now();
+    """, ([row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows]))
+    tagged = [int(image_id) for image_id, _ in tag_results]
+    db.execute_prepared(cursor, "finish_batch", """
+        UPDATE tagging_queue
+        SET done_at = now(), lease_owner = NULL, lease_expires_at = NULL,
+            error = CASE WHEN image_id = ANY(%s::int[]) THEN NULL ELSE 'unreadable' END
+        WHERE image_id = ANY(%s::int[]) OR canonical_id = ANY(%s::int[]);
+    """, (tagged, image_ids, image_ids))
+    bump_version(cursor, TAGS)
+    conn.commit()
+    cursor.close()
+    return len(rows)
+
+def run_worker(worker_index=0):
+    """Claim, tag and write batches until no claimable image is left."""
+    worker_name = f"{socket.gethostname()}:{os.getpid()}"
+    if TAGGING_PROCESSES > 1:
+        # Split the cores between the local workers instead of oversubscribing them
+        import torch
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // TAGGING_PROCESSES))
+    tagger = get_tagger()
+
+    start_time = time.time()
+    images_done = 0
+    with db.connection() as conn:  # One connection per worker, held for its lifetime
+        while True:
+            batch, duplicates = claim_batch(conn, worker_name)
+            if not batch:
+                if pending_elsewhere(conn):
+                    time.sleep(min(30, TAGGING_LEASE_SECONDS))  # wait for other leases to finish or expire
+                    continue
+                break
+            with metrics.timed_batch("tagging", items=len(batch)) as stage:  # all claimed images fail if it raises
+                tag_results = list(tagger.tag_images(batch, duplicates))
+                stage["items"] = len(tag_results)
+                # Claimed images that could not be decoded
+                stage["errors"] = len({image_id for image_id, _ in batch} - {image_id for image_id, _ in tag_results})
+            for image_id, tags in tag_results:
+                logging.info(f"Tagged image {image_id}: {tags}")
+            with metrics.timed_batch("tag_writes", items=len(tag_results)) as stage:
+                stage["items"] = insert_tags_into_db(conn, worker_name, [image_id for image_id, _ in batch],
+                                                     tag_results)
+            images_done += len(tag_results)
+            print(f"[{worker_name}] {images_done} images tagged, "
+                  f"{images_done / (time.time() - start_time):.1f} images/s")
+    return images_done
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Someone else's process
+    return True
+
+def merge_shards():
+    """
+    Fold the shards written on this machine into the main stores. Shards of
+    processes that are still running (another tagging run here) are left for
+    that run; other machines merge their own shards.
+
+    Every merger holds an exclusive lock on main/.lock while it scans, extends
+    and removes shards, so merges from several machines or runs never
+    interleave their appends to the main store. A shard is claimed by renaming
+    it to .merging first; one left over by a merge that died is merged again
+    (a re-appended row only supersedes an identical one).
+    """
+    for main, store_class in [(EMBEDDING_STORE_DIR, EmbeddingStore), (IMAGE_CACHE_DIR, PreprocessedImageCache)]:
+        prefix = f"{main}_{socket.gethostname()}_"
+        os.makedirs(main, exist_ok=True)
+        with open(os.path.join(main, ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            shards = []
+            for shard in sorted(glob.glob(glob.escape(prefix) + "*")):
+                pid = shard[len(prefix):]
+                if pid.endswith(".merging"):
+                    shards.append(shard)
+                elif pid.isdigit() and (int(pid) == os.getpid() or not process_alive(int(pid))):
+                    os.rename(shard, shard + ".merging")
+                    shards.append(shard + ".merging")
+            if not shards:
+                continue
+            target = EmbeddingStore(main, dim=512) if store_class is EmbeddingStore else store_class(main)
+            for shard in shards:
+                print(f"Merged {target.extend(store_class(shard))} rows from {shard} into {main}")
+                shutil.rmtree(shard)
+
+def process_images():
+    with db.connection() as conn:
+        create_queue(conn)
+        dedup_stats = seed_queue(conn)
+
+    start_time = time.time()
+    if TAGGING_PROCESSES > 1:
+        # Spawned processes load their own model and hold their own connection
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(TAGGING_PROCESSES) as pool:
+            images_done = sum(pool.map(run_worker, range(TAGGING_PROCESSES)))
+        # The workers' own metrics stay in their processes: record the run as one batch
+        metrics.record_batch("tagging", images_done, time.time() - start_time)
+    else:
+        images_done = run_worker()
+    merge_shards()
+    if dedup_stats["images"]:
+        print(saved_work_summary(dedup_stats, images_done - dedup_stats["duplicates"], time.time() - start_time))
+
 if __name__ == "__main__":
+    metrics.report_at_exit("03_tag_images")
     process_images()
     print("Image tagging completed!")
@@ -1,88 +1,204 @@
-import psycopg2
-import pandas as pd
-import json
+from psycopg2 import sql
 import os
+import sys
+import time
 from dotenv import load_dotenv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hotel_ibs.bulk_load import copy_rows, merge_staging
+from hotel_ibs import db, metrics
+from hotel_ibs.data_versions import TAGS, bump_version
+from hotel_ibs.tag_bitmaps import CREATE_TAGS_SQL, quantized_confidence_sql
+from hotel_ibs.tag_files import iter_csv_chunks, iter_jsonl_chunks, shard_paths
+
 # 🔹 Load environment variables from .env
 load_dotenv()
 
-# 🔹 PostgreSQL Connection Details
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
-DB_NAME = os.getenv("DB_NAME")
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-
-# 🔹 CSV File Paths
+# 🔹 CSV File Paths (or a directory of JSONL shards written by the tagging notebook)
 TAGGED_IMAGES_CSV_PATH = os.getenv("TAGGED_IMAGES_CSV_PATH")
 
-# ✅ Function to Connect to PostgreSQL
-def connect_db():
-    return psycopg2.connect(
-        dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
-    )
+# 🔹 Import Settings
+IMPORT_CHUNK_ROWS = int(os.getenv("IMPORT_CHUNK_ROWS", "20000"))  # CSV rows (images) per COPY batch
+IMPORT_RESTART = os.getenv("IMPORT_RESTART", "0") == "1"  # ignore the checkpoint and read from the start
+
+# Columns of the staging table, COPY fills the first three; the last three are merged into image_tags
+STAGED_COLUMNS = ["image_id", "tag_name", "confidence_score", "tag_id", "confidence_q"]
+MERGED_COLUMNS = ["image_id", "tag_id", "confidence_q"]
 
 # ✅ Create the `image_tags` Table If It Doesn't Exist
 def create_table():
-    conn = connect_db()
-    cursor = conn.cursor()
+    with db.connection() as conn:
+        cursor = conn.cursor()
+
+        # Tag dictionary: small integer ids used by image_tags.tag_id and the tag bitmaps (08_build_tag_bitmaps.py)
+        cursor.execute(CREATE_TAGS_SQL)
     
+        # Tag names live in `tags` only; the confidence is quantized to SMALLINT (see hotel_ibs/tag_bitmaps.py)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS image_tags (
+            image_id INT REFERENCES images(image_id) ON DELETE CASCADE,
+            tag_id SMALLINT NOT NULL REFERENCES tags(tag_id),
+            confidence_q SMALLINT NOT NULL,
+            tagged_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (image_id, tag_id)
+        );
+        """)
+        cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'image_tags' AND column_name = 'tag_name';
+        """)
+        if cursor.fetchone():
+            sys.exit("❌ image_tags still has its tag_name column: run 09_migrate_schema.py before importing.")
+
+        # `tagged_at` lets the backend's tag index pick up new tags incrementally
+        cursor.execute("""
+        ALTER TABLE image_tags ADD COLUMN IF NOT EXISTS tagged_at TIMESTAMPTZ NOT NULL DEFAULT now();
+        CREATE INDEX IF NOT EXISTS idx_image_tags_tagged_at ON image_tags (tagged_at);
+        """)
+
+        # Import checkpoints: byte offset reached in each source file, committed with the data
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS import_checkpoints (
+            source TEXT PRIMARY KEY,
+            file_size BIGINT NOT NULL,
+            byte_offset BIGINT NOT NULL,
+            rows_done BIGINT NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """)
+
+        conn.commit()
+        cursor.close()
+
+# ✅ Read the Checkpoint for a Source File (0 = start from the beginning)
+def load_checkpoint(cursor, source, file_size):
+    cursor.execute("SELECT file_size, byte_offset, rows_done FROM import_checkpoints WHERE source = %s;", (source,))
+    row = cursor.fetchone()
+    if row is None or IMPORT_RESTART or row[0] > file_size or row[1] > file_size:
+        return 0, 0  # No checkpoint, forced restart or the file was replaced by a smaller one
+    return row[1], row[2]
+
+# ✅ Record the Checkpoint (in the same transaction as the chunk it covers)
+def save_checkpoint(cursor, source, file_size, byte_offset, rows_done):
     cursor.execute("""
-    CREATE TABLE IF NOT EXISTS image_tags (
-        image_id INT,
-        tag_name TEXT,
-        confidence_score FLOAT,
-        PRIMARY KEY (image_id, tag_name)
-    );
-    """)
+        INSERT INTO import_checkpoints (source, file_size, byte_offset, rows_done, updated_at)
+        VALUES (%s, %s, %s, %s, now())
+        ON CONFLICT (source) DO UPDATE SET
+            file_size = EXCLUDED.file_size, byte_offset = EXCLUDED.byte_offset,
+            rows_done = EXCLUDED.rows_done, updated_at = EXCLUDED.updated_at;
+    """, (source, file_size, byte_offset, rows_done))
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+# ✅ Import One Tagging Output File, Resuming from Its Checkpoint
+def import_file(conn, cursor, staging, source, read_chunks):
+    file_size = os.path.getsize(source)
+    offset, rows_done = load_checkpoint(cursor, source, file_size)
+    if offset == file_size:
+        return 0, 0  # Already fully imported
+    if offset:
+        print(f"🔄 Resuming {source} at byte {offset}/{file_size} ({rows_done} images already imported).")
+
+    columns = STAGED_COLUMNS[:3]
+    start_time = time.time()
+    tags_copied = tags_inserted = tags_skipped = 0
+    for rows, offset in read_chunks(source, offset, IMPORT_CHUNK_ROWS):
+        chunk_start = time.perf_counter()
+        tag_rows = [(image_id, tag, score) for image_id, tags in rows for tag, score in tags.items()]
+        copy_rows(cursor, staging, columns, tag_rows)
+        # image_tags references images: tags of images that were never loaded are skipped
+        cursor.execute(sql.SQL("""
+            DELETE FROM {staging} WHERE NOT EXISTS (SELECT 1 FROM images WHERE images.image_id = {staging}.image_id);
+        """).format(staging=sql.Identifier(staging)))
+        chunk_skipped = cursor.rowcount
+        tags_skipped += chunk_skipped
+        # New names join the dictionary first, then every staged row gets its tag id and quantized confidence
+        cursor.execute(sql.SQL("""
+            INSERT INTO tags (tag_name)
+            SELECT DISTINCT {staging}.tag_name FROM {staging}
+            LEFT JOIN tags ON tags.tag_name = {staging}.tag_name
+            WHERE tags.tag_id IS NULL
+            ON CONFLICT (tag_name) DO NOTHING;
+            UPDATE {staging} SET tag_id = tags.tag_id, confidence_q = {confidence_q}
+            FROM tags WHERE tags.tag_name = {staging}.tag_name;
+        """).format(staging=sql.Identifier(staging),
+                    confidence_q=sql.SQL(quantized_confidence_sql("confidence_score"))))
+        tags_inserted += merge_staging(cursor, staging, "image_tags", MERGED_COLUMNS, ["image_id", "tag_id"],
+                                       update=False)
+        rows_done += len(rows)
+        save_checkpoint(cursor, source, file_size, offset, rows_done)
+        bump_version(cursor, TAGS)  # Retire the backend's cached search results
+        conn.commit()
+        # Tags of unknown images count as failed items of the stage
+        metrics.record_batch("import_tags", len(tag_rows) - chunk_skipped, time.perf_counter() - chunk_start,
+                             errors=chunk_skipped)
+
+        tags_copied += len(tag_rows)
+        elapsed = time.time() - start_time
+        print(f"📥 {os.path.basename(source)}: {rows_done} images ({100 * offset / max(file_size, 1):.0f}%), "
+              f"{tags_copied / max(elapsed, 1e-9):,.0f} tags/s")
+    if tags_skipped:
+        print(f"⚠️ {os.path.basename(source)}: skipped {tags_skipped} tags of images missing from the images table.")
+    return tags_copied, tags_inserted
 
 # ✅ Function to Insert Tags into Database
 def insert_tags_into_db():
-    conn = connect_db()
-    cursor = conn.cursor()
-    
-    # Load CSV File
-    df = pd.read_csv(TAGGED_IMAGES_CSV_PATH)
-
-    for _, row in df.iterrows():
-        image_id = row["image_id"]
-        
-        # Convert tags from string to dictionary
-        tags = json.loads(row["tags"].replace("'", "\""))  # Fix single quotes
-
-        for tag, score in tags.items():
-            cursor.execute("""
-                INSERT INTO image_tags (image_id, tag_name, confidence_score)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (image_id, tag_name) DO NOTHING;
-            """, (image_id, tag, score))
-
-    conn.commit()
-    cursor.close()
-    conn.close()
-    print("✅ Tags successfully inserted into the database.")
+    """
+    Stream the tagged CSV (or each completed JSONL shard) in chunks of
+    IMPORT_CHUNK_ROWS images. Each chunk is COPYed into a staging table and
+    merged with one INSERT ... ON CONFLICT, then committed together with the
+    byte offset it ends at, so a rerun after a failure resumes from the last
+    committed chunk and skips files that were fully imported.
+    """
+    with db.connection() as conn:
+        cursor = conn.cursor()
+
+        if os.path.isdir(TAGGED_IMAGES_CSV_PATH):
+            sources = [(os.path.abspath(path), iter_jsonl_chunks) for path in shard_paths(TAGGED_IMAGES_CSV_PATH)]
+        else:
+            sources = [(os.path.abspath(TAGGED_IMAGES_CSV_PATH), iter_csv_chunks)]
+
+        staging = create_staging_table(cursor)
+        start_time = time.time()
+        tags_copied = tags_inserted = 0
+        for source, read_chunks in sources:
+            copied, inserted = import_file(conn, cursor, staging, source, read_chunks)
+            tags_copied += copied
+            tags_inserted += inserted
+
+        cursor.close()
+
+    print(f"✅ Tags successfully inserted into the database: {tags_inserted} new of {tags_copied} read "
+          f"in {time.time() - start_time:.1f} seconds.")
+
+# ✅ Create the Staging Table: Tag Names and Float Confidences, Turned into Ids Before the Merge
+def create_staging_table(cursor):
+    cursor.execute("""
+        DROP TABLE IF EXISTS staging_image_tags;
+        CREATE TEMP TABLE staging_image_tags (
+            image_id INT, tag_name TEXT, confidence_score FLOAT, tag_id SMALLINT, confidence_q SMALLINT
+        );
+    """)
+    return "staging_image_tags"
 
 # ✅ Function to Fetch and Print Data for Verification
 def fetch_data():
-    conn = connect_db()
-    cursor = conn.cursor()
+    with db.connection() as conn:
+        cursor = conn.cursor()
     
-    cursor.execute("SELECT * FROM image_tags LIMIT 10;")
-    rows = cursor.fetchall()
+        cursor.execute("""
+            SELECT image_tags.image_id, tags.tag_name, image_tags.confidence_q, image_tags.tagged_at
+            FROM image_tags JOIN tags ON tags.tag_id = image_tags.tag_id
+            LIMIT 10;
+        """)
+        rows = cursor.fetchall()
 
-    cursor.close()
-    conn.close()
+        cursor.close()
 
     return rows
 
 # 🔹 Main Execution
 if __name__ == "__main__":
+    metrics.report_at_exit("04_import_tags_to_database")  # JSON summary of the run, see hotel_ibs/metrics.py
     create_table()  # Ensure table exists
-    insert_tags_into_db()  # Insert data
+    insert_tags_into_db()  # Insert data; then run 08_build_tag_bitmaps.py
     print("✅ First 10 Rows from the Database:")
     print(fetch_data())  # Verify inserted data
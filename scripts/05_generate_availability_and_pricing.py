@@ -1,26 +1,35 @@
 import pandas as pd
-import psycopg2
 import numpy as np
 import os
+import sys
+import time
 from dotenv import load_dotenv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hotel_ibs import db, metrics
+from hotel_ibs.bulk_load import copy_rows, create_staging_table, merge_staging
+from hotel_ibs.data_versions import PRICES, bump_version
+
 # 🔹 Load environment variables from .env
 load_dotenv()
-# Database connection parameters
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
-DB_NAME = os.getenv("DB_NAME")
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
+
+# Generator settings
+HOTEL_INFO_PATH = os.getenv("HOTEL_INFO_PATH", "./scripts/hotel_info.csv")
+CALENDAR_START = os.getenv("CALENDAR_START", "2025-04-01")
+CALENDAR_END = os.getenv("CALENDAR_END", "2025-04-30")  # inclusive
+CALENDAR_SEED = os.getenv("CALENDAR_SEED")  # unset: a fresh seed, printed so the run can be repeated
+SEASONAL_AMPLITUDE = float(os.getenv("SEASONAL_AMPLITUDE", "0.2"))  # +-20% over the year
+SEASONAL_PEAK_DAY = int(os.getenv("SEASONAL_PEAK_DAY", "196"))  # day of year with the highest prices (mid July)
+WEEKEND_UPLIFT = float(os.getenv("WEEKEND_UPLIFT", "0.1"))  # Friday and Saturday nights cost 10% more
+CALENDAR_CHUNK_ROWS = int(os.getenv("CALENDAR_CHUNK_ROWS", "1000000"))  # rows held in memory at once
+CALENDAR_PARQUET_PATH = os.getenv("CALENDAR_PARQUET_PATH")  # optional Parquet copy for offline benchmarks
+CALENDAR_WRITE_DB = os.getenv("CALENDAR_WRITE_DB", "1") == "1"
+
+COLUMNS = ["hotel_id", "date", "availability", "price", "currency"]
 
 
 # Create table function
 def create_table():
-    connection = psycopg2.connect(
-        dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
-    )
-    cursor = connection.cursor()
-    
     create_table_query = """
     CREATE TABLE IF NOT EXISTS availability_price (
         id SERIAL PRIMARY KEY,
@@ -29,6 +38,7 @@ def create_table():
         availability INT NOT NULL CHECK (availability >= 0),
         price DECIMAL(10,2) NOT NULL CHECK (price >= 0),
         currency VARCHAR(10) NOT NULL,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
         UNIQUE (hotel_id, date)
     );
     
@@ -36,50 +46,106 @@ def create_table():
     ON availability_price (hotel_id, date);
     """
     
-    cursor.execute(create_table_query)
-    connection.commit()
-    cursor.close()
-    connection.close()
+    with db.connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(create_table_query)
 
-# Load CSV data
-file_path = "./scripts/hotel_info.csv"
-df = pd.read_csv(file_path)
+# Price multiplier per night: yearly cosine season times a weekend uplift
+def seasonality(dates):
+    day_of_year = dates.dayofyear.to_numpy()
+    season = 1 + SEASONAL_AMPLITUDE * np.cos(2 * np.pi * (day_of_year - SEASONAL_PEAK_DAY) / 365.25)
+    weekend = np.where(dates.dayofweek.isin([4, 5]), 1 + WEEKEND_UPLIFT, 1.0)
+    return season * weekend
 
-# Generate availability and price data
-hotel_ids = df['hotel_id'].unique().tolist()
-dates = pd.date_range(start="2025-04-01", end="2025-04-30")
+# Generate the calendars of a block of hotels as arrays: one row per hotel, one column per night.
+# Every hotel draws from its own generator seeded with (seed, hotel_id), so its calendar does
+# not depend on the chunk size or on which other hotels are generated.
+def generate_block(hotel_ids, n_days, multiplier, seed):
+    prices = np.empty((len(hotel_ids), n_days))
+    availability = np.empty((len(hotel_ids), n_days), dtype=np.int32)
+    for i, hotel_id in enumerate(hotel_ids):
+        rng = np.random.default_rng([seed, int(hotel_id)])
+        base_price = rng.uniform(50, 500)
+        prices[i] = base_price * rng.uniform(0.8, 1.2, n_days)
+        availability[i] = rng.integers(0, 20, n_days)
+    return np.round(prices * multiplier, 2), availability
 
-availability_price_data = []
-for hotel_id in hotel_ids:
-    base_price = np.random.uniform(50, 500)
-    for date in dates:
-        price = float(base_price * np.random.uniform(0.8, 1.2))
-        availability = int(np.random.randint(0, 20))
-        availability_price_data.append((hotel_id, date.date(), availability, round(price, 2), "EUR"))
+# Yield the calendar as DataFrames of at most CALENDAR_CHUNK_ROWS rows
+def generate_chunks(hotel_ids, dates, seed):
+    multiplier = seasonality(dates)
+    hotels_per_chunk = max(1, CALENDAR_CHUNK_ROWS // len(dates))
+    for start in range(0, len(hotel_ids), hotels_per_chunk):
+        block = hotel_ids[start:start + hotels_per_chunk]
+        prices, availability = generate_block(block, len(dates), multiplier, seed)
+        yield pd.DataFrame({
+            "hotel_id": np.repeat(block, len(dates)),
+            "date": np.tile(dates.values, len(block)),
+            "availability": availability.ravel(),
+            "price": prices.ravel(),
+            "currency": "EUR",
+        })
 
-# Insert data into PostgreSQL
-def insert_data(data):
-    connection = psycopg2.connect(
-        dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
-    )
-    cursor = connection.cursor()
-    
-    insert_query = """
-        INSERT INTO availability_price (hotel_id, date, availability, price, currency)
-        VALUES (%s, %s, %s, %s, %s)
-        ON CONFLICT (hotel_id, date) DO NOTHING;
-    """
-    
+# Stream the chunks into PostgreSQL (COPY + merge) and/or a Parquet file
+def write_calendar(chunks, total_rows):
+    connection = cursor = staging = parquet = None
+    if CALENDAR_WRITE_DB:
+        connection = db.get_pool().getconn()
+        cursor = connection.cursor()
+        staging = create_staging_table(cursor, "availability_price", COLUMNS)
+
+    start_time = time.time()
+    rows_written = rows_inserted = 0
     try:
-        cursor.executemany(insert_query, data)
-        rows_inserted = cursor.rowcount
-        connection.commit()
-        print(f"Successfully inserted {rows_inserted} records.")
+        chunk_start = time.perf_counter()
+        for chunk in chunks:
+            if CALENDAR_PARQUET_PATH:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if parquet is None:
+                    parquet = pq.ParquetWriter(CALENDAR_PARQUET_PATH, table.schema)
+                parquet.write_table(table)
+            if cursor is not None:
+                copy_rows(cursor, staging, COLUMNS, chunk)
+                # Existing nights are kept, as before
+                rows_inserted += merge_staging(cursor, staging, "availability_price", COLUMNS,
+                                               ["hotel_id", "date"], update=False)
+                bump_version(cursor, PRICES)  # Retire the backend's cached search results
+                connection.commit()
+            rows_written += len(chunk)
+            # Generating the chunk is part of the stage: the timer runs from the end of the previous one
+            metrics.record_batch("availability", len(chunk), time.perf_counter() - chunk_start)
+            chunk_start = time.perf_counter()
+            elapsed = time.time() - start_time
+            print(f"{rows_written}/{total_rows} rows, {rows_written / max(elapsed, 1e-9):,.0f} rows/s")
     except Exception as e:
         print("Error inserting data:", e)
-        connection.rollback()
+        if connection is not None:
+            connection.rollback()
+        raise
+    finally:
+        if parquet is not None:
+            parquet.close()
+        if connection is not None:
+            cursor.close()
+            db.get_pool().putconn(connection)
+
+    if CALENDAR_WRITE_DB:
+        print(f"Successfully inserted {rows_inserted} records.")
+    if CALENDAR_PARQUET_PATH:
+        print(f"Wrote {rows_written} rows to {CALENDAR_PARQUET_PATH}")
+
+if __name__ == "__main__":
+    metrics.report_at_exit("05_generate_availability_and_pricing")
+    # Load CSV data
+    df = pd.read_csv(HOTEL_INFO_PATH)
+    hotel_ids = df['hotel_id'].unique()
+    dates = pd.date_range(start=CALENDAR_START, end=CALENDAR_END)
+    seed = int(CALENDAR_SEED) if CALENDAR_SEED else int(np.random.SeedSequence().entropy % 2**32)
+    print(f"Generating {len(hotel_ids)} hotels x {len(dates)} nights (seed {seed})")
 
-# Execute the table creation and data insertion
-# create_table()
-insert_data(availability_price_data)
-print("Table created and data inserted successfully.")
+    # Execute the table creation and data insertion
+    # create_table()
+    write_calendar(generate_chunks(hotel_ids, dates, seed), len(hotel_ids) * len(dates))
+    print("Table created and data inserted successfully.")
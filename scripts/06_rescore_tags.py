@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hotel_ibs import db
+from hotel_ibs.data_versions import TAGS, bump_version
+from hotel_ibs.embedding_store import EmbeddingStore, EMBEDDING_STORE_DIR
+from hotel_ibs.tag_bitmaps import quantized_confidence_sql
+from hotel_ibs.tagging import load_text_features, top_k_tags
+from hotel_ibs.vocabulary import GENERATED_TEXTS
+
+# Recompute image_tags from the stored image embeddings after the vocabulary
+# changed. No image is opened: each chunk is one matrix multiply against the
+# new text embeddings.
+
+load_dotenv()
+
+# Optional text file with one tag per line; defaults to hotel_ibs/vocabulary.py
+VOCABULARY_PATH = os.getenv("VOCABULARY_PATH")
+CLIP_MODEL_NAME = os.getenv("CLIP_MODEL_NAME", "ViT-B/32")
+TOP_K = int(os.getenv("RESCORE_TOP_K", "10"))
+CHUNK_SIZE = int(os.getenv("RESCORE_CHUNK_SIZE", "65536"))
+
+def load_vocabulary():
+    if not VOCABULARY_PATH:
+        return list(GENERATED_TEXTS)
+    with open(VOCABULARY_PATH, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+def replace_tags(cursor, image_ids, tag_results):
+    """Swap the stored tags of a chunk of images for freshly scored ones."""
+    cursor.execute("DELETE FROM image_tags WHERE image_id = ANY(%s);", (image_ids,))
+    rows = [
+        (image_id, tag, score)
+        for image_id, tags in zip(image_ids, tag_results)
+        for tag, score in tags.items()
+    ]
+    # New vocabulary entries join the tag dictionary before the rows that reference them
+    cursor.execute("""
+        INSERT INTO tags (tag_name)
+        SELECT DISTINCT new.tag_name FROM unnest(%s::text[]) AS new (tag_name)
+        LEFT JOIN tags ON tags.tag_name = new.tag_name
+        WHERE tags.tag_id IS NULL
+        ON CONFLICT (tag_name) DO NOTHING;
+    """, (sorted({tag for _, tag, _ in rows}),))
+    # Only images that are in the images table (image_tags references it)
+    db.insert_values(cursor, f"""
+        INSERT INTO image_tags (image_id, tag_id, confidence_q)
+        SELECT new.image_id, tags.tag_id, {quantized_confidence_sql("new.confidence_score")}
+        FROM (VALUES %s) AS new (image_id, tag_name, confidence_score)
+        JOIN tags ON tags.tag_name = new.tag_name
+        WHERE EXISTS (SELECT 1 FROM images WHERE images.image_id = new.image_id)
+        ON CONFLICT (image_id, tag_id)
+        DO UPDATE SET confidence_q = EXCLUDED.confidence_q, tagged_at = now();
+    """, rows)
+    return len(rows)
+
+def rescore():
+    texts = load_vocabulary()
+    text_features = load_text_features(CLIP_MODEL_NAME, texts)
+    store = EmbeddingStore(EMBEDDING_STORE_DIR)
+    print(f"Re-scoring {len(store)} images against {len(texts)} tags")
+
+    start_time = time.time()
+    images_done = 0
+    tags_written = 0
+    with db.connection() as conn, conn.cursor() as cursor:
+        for image_ids, embeddings in store.iter_chunks(CHUNK_SIZE):
+            tag_results = top_k_tags(embeddings, text_features, texts, TOP_K)
+            tags_written += replace_tags(cursor, [int(image_id) for image_id in image_ids], tag_results)
+            bump_version(cursor, TAGS)
+            conn.commit()
+            images_done += len(image_ids)
+            print(f"{images_done}/{len(store)} images re-scored")
+
+    print(f"Wrote {tags_written} tags in {time.time() - start_time:.1f} seconds")
+
+if __name__ == "__main__":
+    rescore()
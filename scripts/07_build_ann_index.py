@@ -0,0 +1,43 @@
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hotel_ibs.ann import IVFIndex, ANN_INDEX_DIR
+from hotel_ibs.embedding_store import EmbeddingStore, EMBEDDING_STORE_DIR
+
+# Build the IVF index used by the backend's semantic search from the image
+# embedding store, save it next to the store and report its recall against
+# brute-force search.
+
+N_LISTS = int(os.getenv("ANN_N_LISTS", "0")) or None  # default: ~4 * sqrt(#images)
+N_PROBE = int(os.getenv("ANN_N_PROBE", "16"))
+RECALL_QUERIES = int(os.getenv("ANN_RECALL_QUERIES", "200"))
+RECALL_K = 50
+
+def build_index():
+    store = EmbeddingStore(EMBEDDING_STORE_DIR)
+    rows = store.live_rows()
+    image_ids = [store.image_ids[row] for row in rows]
+    embeddings = np.asarray(store.matrix()[rows])
+    print(f"Building IVF index over {len(image_ids)} embeddings")
+
+    start_time = time.time()
+    index = IVFIndex.build(embeddings, image_ids, n_lists=N_LISTS, n_probe=N_PROBE)
+    index.save(ANN_INDEX_DIR)
+    print(f"Built {len(index.centroids)} lists in {time.time() - start_time:.1f} seconds, saved to {ANN_INDEX_DIR}")
+
+    # Stored image embeddings make reasonable stand-ins for query embeddings.
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(embeddings), min(RECALL_QUERIES, len(embeddings)), replace=False)
+    queries = np.asarray(embeddings[sample], dtype=np.float32)
+    start_time = time.time()
+    for query in queries:
+        index.search(query, RECALL_K)
+    per_query_ms = (time.time() - start_time) / max(1, len(queries)) * 1000
+    print(f"recall@{RECALL_K} with n_probe={N_PROBE}: {index.recall(queries, RECALL_K):.3f}, "
+          f"{per_query_ms:.2f} ms/query")
+
+if __name__ == "__main__":
+    build_index()
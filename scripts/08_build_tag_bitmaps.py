@@ -0,0 +1,40 @@
+import os
+import sys
+import time
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hotel_ibs import db
+from hotel_ibs.tag_bitmaps import TagBitmaps, TAG_BITMAPS_PATH, confidence_sql
+
+# Build one compressed bitmap of image ids per tag (with uint16 confidences)
+# from image_tags and the tags dictionary, and save them to TAG_BITMAPS_PATH
+# for the backend's boolean tag queries.
+
+load_dotenv()
+
+def build_tag_bitmaps():
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT tag_id, tag_name FROM tags;")
+        tag_names = dict(cursor.fetchall())
+        cursor.execute("SELECT pg_total_relation_size('image_tags');")
+        table_bytes = cursor.fetchone()[0]
+        cursor.close()
+
+        start_time = time.time()
+        # Server-side cursor: rows are streamed instead of fetched at once
+        batches = db.stream(conn, f"""
+            SELECT tag_id, image_id, {confidence_sql("confidence_q")}
+            FROM image_tags
+            ORDER BY tag_id, image_id;
+        """, name="tag_bitmap_rows")
+        bitmaps = TagBitmaps.build(tag_names, (row for batch in batches for row in batch))
+
+    bitmaps.save(TAG_BITMAPS_PATH)
+    print(f"Built bitmaps for {len(bitmaps.bitmaps)} tags in {time.time() - start_time:.1f} seconds")
+    print(f"image_tags: {table_bytes / 1e6:.1f} MB, tag bitmaps: {bitmaps.nbytes() / 1e6:.1f} MB "
+          f"({os.path.getsize(TAG_BITMAPS_PATH) / 1e6:.1f} MB on disk at {TAG_BITMAPS_PATH})")
+
+if __name__ == "__main__":
+    build_tag_bitmaps()
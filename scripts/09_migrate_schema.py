@@ -0,0 +1,293 @@
+import json
+import os
+import sys
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hotel_ibs import db
+from hotel_ibs.data_versions import CREATE_TABLE_SQL as CREATE_DATA_VERSIONS_SQL
+from hotel_ibs.tag_bitmaps import CREATE_TAGS_SQL, DB_CONFIDENCE_SCALE, quantized_confidence_sql
+
+# Versioned schema migrations. Each migration runs once, in order, and is
+# recorded in schema_migrations; rerunning the script only applies new ones.
+# Afterwards the search queries are EXPLAINed with sequential scans disabled:
+# if a table is still read in full, no index can serve that query and the
+# script exits with an error.
+
+load_dotenv()
+
+def column_type(cursor, table, column):
+    cursor.execute("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s;
+    """, (table, column))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def integer_image_ids(cursor):
+    """images.image_id was TEXT while image_tags.image_id is INT: make every image key INT."""
+    if column_type(cursor, "images", "image_id") != "integer":
+        cursor.execute("SELECT count(*) FROM images WHERE image_id !~ '^[0-9]+$';")
+        non_numeric = cursor.fetchone()[0]
+        if non_numeric:
+            raise RuntimeError(f"{non_numeric} images have non-numeric ids; fix them before migrating")
+        cursor.execute("ALTER TABLE images ALTER COLUMN image_id TYPE INT USING image_id::int;")
+    if column_type(cursor, "image_tags", "image_id") != "integer":
+        cursor.execute("ALTER TABLE image_tags ALTER COLUMN image_id TYPE INT USING image_id::int;")
+    # Work queue of 03_tag_images, if it was ever created
+    for column in ("image_id", "canonical_id"):
+        if column_type(cursor, "tagging_queue", column) not in (None, "integer"):
+            cursor.execute(f"ALTER TABLE tagging_queue ALTER COLUMN {column} TYPE INT USING {column}::int;")
+
+def image_tags_foreign_key(cursor):
+    """Tags of unknown images are dropped, then image_tags references images."""
+    cursor.execute("""
+        DELETE FROM image_tags
+        WHERE NOT EXISTS (SELECT 1 FROM images WHERE images.image_id = image_tags.image_id);
+    """)
+    if cursor.rowcount:
+        print(f"Deleted {cursor.rowcount} tags of images that do not exist")
+    cursor.execute("""
+        ALTER TABLE image_tags DROP CONSTRAINT IF EXISTS image_tags_image_id_fkey;
+        ALTER TABLE image_tags ADD CONSTRAINT image_tags_image_id_fkey
+        FOREIGN KEY (image_id) REFERENCES images(image_id) ON DELETE CASCADE;
+    """)
+
+def image_tags_tag_ids(cursor):
+    """image_tags gets the dictionary id and a SMALLINT confidence of every row, referencing tags."""
+    cursor.execute(CREATE_TAGS_SQL)
+    if column_type(cursor, "image_tags", "tag_name") is None:
+        return  # Created by 04_import_tags_to_database.py with only the ids
+    cursor.execute("""
+        ALTER TABLE image_tags ADD COLUMN IF NOT EXISTS tag_id SMALLINT;
+        ALTER TABLE image_tags ADD COLUMN IF NOT EXISTS confidence_q SMALLINT;
+        INSERT INTO tags (tag_name)
+        SELECT DISTINCT image_tags.tag_name FROM image_tags
+        LEFT JOIN tags ON tags.tag_name = image_tags.tag_name
+        WHERE tags.tag_id IS NULL
+        ORDER BY image_tags.tag_name
+        ON CONFLICT (tag_name) DO NOTHING;
+    """)
+    cursor.execute(f"""
+        UPDATE image_tags SET tag_id = tags.tag_id, confidence_q = {quantized_confidence_sql("image_tags.confidence_score")}
+        FROM tags
+        WHERE tags.tag_name = image_tags.tag_name
+          AND (image_tags.tag_id IS NULL OR image_tags.confidence_q IS NULL);
+    """)
+    if cursor.rowcount:
+        print(f"Filled tag ids of {cursor.rowcount} tags")
+    cursor.execute("""
+        ALTER TABLE image_tags DROP CONSTRAINT IF EXISTS image_tags_tag_id_fkey;
+        ALTER TABLE image_tags ADD CONSTRAINT image_tags_tag_id_fkey FOREIGN KEY (tag_id) REFERENCES tags(tag_id);
+    """)
+
+def compact_image_tags(cursor):
+    """
+    image_tags keeps only tag_id and confidence_q: names come from the tags
+    dictionary, so tag_name and confidence_score are dropped. The freed
+    space is reclaimed when migration 9 rewrites the table.
+    """
+    if column_type(cursor, "image_tags", "tag_name") is None:
+        return
+    image_tags_tag_ids(cursor)  # Rows written since migration 5 by scripts that did not fill the ids
+    cursor.execute("DELETE FROM image_tags WHERE tag_id IS NULL;")
+    if cursor.rowcount:
+        print(f"Deleted {cursor.rowcount} image tags without a tag name")
+    cursor.execute("""
+        UPDATE image_tags SET confidence_q = 0 WHERE confidence_q IS NULL;
+        ALTER TABLE image_tags ALTER COLUMN tag_id SET NOT NULL, ALTER COLUMN confidence_q SET NOT NULL;
+        DROP INDEX IF EXISTS idx_image_tags_tag_confidence;
+        ALTER TABLE image_tags DROP CONSTRAINT IF EXISTS image_tags_pkey;
+        ALTER TABLE image_tags ADD PRIMARY KEY (image_id, tag_id);
+        ALTER TABLE image_tags DROP COLUMN tag_name, DROP COLUMN confidence_score;
+    """)
+
+def image_tags_index(cursor):
+    """Rewrite image_tags once its text columns are dropped (DROP COLUMN frees no space), then index it."""
+    cursor.execute("""
+        SELECT count(*) FROM pg_attribute WHERE attrelid = 'image_tags'::regclass AND attisdropped;
+    """)
+    if cursor.fetchone()[0]:
+        # Takes an exclusive lock on image_tags until the copy is written
+        cursor.execute("VACUUM FULL image_tags;")
+    create_indexes(cursor, IMAGE_TAGS_INDEXES)
+
+def availability_price_updated_at(cursor):
+    """`updated_at` lets the backend's calendar index load only changed nights."""
+    # Same table as 05_generate_availability_and_pricing.py creates, for calendars written before it
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS availability_price (
+            id SERIAL PRIMARY KEY,
+            hotel_id INT REFERENCES hotels(hotel_id) ON DELETE CASCADE,
+            date DATE NOT NULL,
+            availability INT NOT NULL CHECK (availability >= 0),
+            price DECIMAL(10,2) NOT NULL CHECK (price >= 0),
+            currency VARCHAR(10) NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            UNIQUE (hotel_id, date)
+        );
+        CREATE INDEX IF NOT EXISTS idx_availability_price_hotel_date ON availability_price (hotel_id, date);
+        ALTER TABLE availability_price ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+        CREATE INDEX IF NOT EXISTS idx_availability_price_updated_at ON availability_price (updated_at);
+    """)
+
+# Indexes are built CONCURRENTLY (outside a transaction, one statement at a
+# time) so the backend keeps serving while they are built.
+SEARCH_INDEXES = [
+    # Images of the hotels passing the price/date filters
+    ("idx_images_hotel_id", """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_images_hotel_id
+       ON images (hotel_id) INCLUDE (image_id, image_url);"""),
+]
+
+# Images of a tag, best first, answered from the index alone (built by migration 9,
+# once image_tags holds tag ids)
+IMAGE_TAGS_INDEXES = [
+    ("idx_image_tags_tag_confidence", """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_image_tags_tag_confidence
+       ON image_tags (tag_id, confidence_q DESC, image_id);"""),
+]
+
+# Substring matches (tag ILIKE '%pool%') run on the small tag dictionary; the
+# matching ids are then looked up in idx_image_tags_tag_confidence.
+TRIGRAM_TAG_INDEX = [
+    ("idx_tags_tag_name_trgm", """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tags_tag_name_trgm
+       ON tags USING gin (tag_name gin_trgm_ops);"""),
+]
+
+def invalid_index(cursor, name):
+    cursor.execute("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s);", (name,))
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+def create_indexes(cursor, indexes):
+    """
+    Build (name, CREATE INDEX CONCURRENTLY statement) pairs. A concurrent
+    build that failed leaves an invalid index behind, which IF NOT EXISTS
+    would then accept: it is dropped and built again.
+    """
+    for name, statement in indexes:
+        if invalid_index(cursor, name):
+            print(f"Rebuilding invalid index {name}")
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name};")
+        cursor.execute(statement)
+        if invalid_index(cursor, name):
+            raise RuntimeError(f"Index {name} is still invalid after it was built")
+
+def search_indexes(cursor):
+    create_indexes(cursor, SEARCH_INDEXES)
+
+def trigram_tag_index(cursor):
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+    # The tag dictionary is filled by migration 5 on databases imported before it existed
+    cursor.execute(CREATE_TAGS_SQL)
+    create_indexes(cursor, TRIGRAM_TAG_INDEX)
+
+# (version, name, SQL statements or function(cursor), runs in a transaction)
+MIGRATIONS = [
+    (1, "integer image ids", integer_image_ids, True),
+    (2, "image_tags foreign key", image_tags_foreign_key, True),
+    (3, "search indexes", search_indexes, False),
+    (4, "trigram tag index", trigram_tag_index, False),
+    (5, "image_tags tag ids", image_tags_tag_ids, True),
+    (6, "availability_price updated_at", availability_price_updated_at, True),
+    (7, "data versions", [CREATE_DATA_VERSIONS_SQL], True),
+    (8, "compact image_tags", compact_image_tags, True),
+    (9, "image_tags rewrite and index", image_tags_index, False),
+]
+
+# Query shapes of the search path, with the tables that must be read through an index
+SEARCH_QUERIES = [
+    ("tag search", """
+        SELECT image_tags.image_id, image_tags.confidence_q
+        FROM image_tags
+        WHERE image_tags.tag_id IN (SELECT tag_id FROM tags WHERE tag_name ILIKE %s)
+          AND image_tags.confidence_q >= %s
+        ORDER BY image_tags.confidence_q DESC, image_tags.image_id
+        LIMIT 100;
+    """, ("%pool%", round(0.05 * DB_CONFIDENCE_SCALE)), {"image_tags", "tags"}),
+    ("tags of images", """
+        SELECT image_tags.image_id, tags.tag_name, image_tags.confidence_q
+        FROM image_tags JOIN tags ON tags.tag_id = image_tags.tag_id
+        WHERE image_tags.image_id = ANY(%s);
+    """, ([1, 2, 3],), {"image_tags"}),
+    ("image details", """
+        SELECT images.image_id, images.image_url, hotels.hotel_id, hotels.hotel_name, hotels.latitude, hotels.longitude
+        FROM images JOIN hotels ON images.hotel_id = hotels.hotel_id
+        WHERE images.image_id = ANY(%s::int[]);
+    """, ([1, 2, 3],), {"images", "hotels"}),
+    ("images of hotels", """
+        SELECT image_id, image_url FROM images WHERE hotel_id = ANY(%s);
+    """, ([1, 2, 3],), {"images"}),
+]
+
+def create_migrations_table(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+        """)
+    conn.commit()
+
+def migrate():
+    with db.connection() as conn:
+        create_migrations_table(conn)
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT version FROM schema_migrations;")
+            applied = {row[0] for row in cursor.fetchall()}
+        conn.commit()
+
+        for version, name, migration, transactional in MIGRATIONS:
+            if version in applied:
+                continue
+            print(f"Applying migration {version}: {name}")
+            conn.autocommit = not transactional
+            with conn.cursor() as cursor:
+                if callable(migration):
+                    migration(cursor)
+                else:
+                    for statement in migration:
+                        cursor.execute(statement)
+                cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s);", (version, name))
+            if transactional:
+                conn.commit()
+            conn.autocommit = False
+
+def full_scans(plan):
+    """
+    Relations read in full anywhere in an EXPLAIN (FORMAT JSON) plan: by a
+    Seq Scan, or by an index scan without an index condition.
+    """
+    node = plan.get("Node Type")
+    found = set()
+    if node == "Seq Scan" or (node in ("Index Scan", "Index Only Scan") and "Index Cond" not in plan):
+        found.add(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found |= full_scans(child)
+    return found
+
+def check_search_plans():
+    """EXPLAIN the search queries; returns the names of queries that still read a table in full."""
+    with db.connection() as conn:
+        failed = []
+        with conn.cursor() as cursor:
+            # Small tables are scanned sequentially by choice; forbid it to see whether an index *can* serve the query
+            cursor.execute("SET LOCAL enable_seqscan = off;")
+            for name, query, params, indexed_tables in SEARCH_QUERIES:
+                cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+                plan = cursor.fetchone()[0]
+                plan = json.loads(plan) if isinstance(plan, str) else plan
+                scanned = full_scans(plan[0]["Plan"]) & indexed_tables
+                print(f"{name}: {'full scan of ' + ', '.join(sorted(scanned)) if scanned else 'index scans only'}")
+                if scanned:
+                    failed.append(name)
+        conn.rollback()
+    return failed
+
+if __name__ == "__main__":
+    migrate()
+    failed = check_search_plans()
+    if failed:
+        sys.exit(f"Search queries without a usable index: {', '.join(failed)}")
+    print("Schema is up to date and every search query can use an index.")
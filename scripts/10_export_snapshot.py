@@ -0,0 +1,163 @@
+import os
+import sys
+import time
+import numpy as np
+import psycopg2.extensions
+import pyarrow as pa
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hotel_ibs import db
+from hotel_ibs.data_versions import READ_SQL as READ_DATA_VERSIONS_SQL
+from hotel_ibs.snapshot import SNAPSHOT_DIR, write_snapshot
+from hotel_ibs.tag_bitmaps import confidence_sql
+
+# Export chains, hotels, images, tags and nightly prices as a columnar
+# snapshot (hotel_ibs/snapshot.py). The backend memory-maps the newest
+# snapshot at startup instead of loading its indexes from SQL, then only
+# reads the rows written after the snapshot's watermarks. Run it after large
+# imports, e.g. nightly; a running backend picks up the new version by itself.
+
+load_dotenv()
+
+FETCH_ROWS = int(os.getenv("SNAPSHOT_FETCH_ROWS", "100000"))
+
+def stream(conn, name, query):
+    """Yield lists of rows from a server-side cursor."""
+    return db.stream(conn, query, name=name, rows=FETCH_ROWS)
+
+def export_images(conn):
+    image_ids, hotel_ids, image_urls = [], [], []
+    for rows in stream(conn, "snapshot_images", "SELECT image_id, hotel_id, image_url FROM images ORDER BY image_id;"):
+        for image_id, hotel_id, image_url in rows:
+            image_ids.append(image_id)
+            hotel_ids.append(-1 if hotel_id is None else hotel_id)
+            image_urls.append(image_url)
+    return np.asarray(image_ids, dtype=np.int32), np.asarray(hotel_ids, dtype=np.int32), image_urls
+
+def export_image_tags(conn, image_ids):
+    """Tag names and the image_tags columns in posting order (see hotel_ibs/snapshot.py)."""
+    tag_ids = {}
+    chunks = []
+    # Tags are matched case-insensitively by the backend: fold case here once
+    query = f"""
+        SELECT image_tags.image_id, lower(tags.tag_name), max({confidence_sql("image_tags.confidence_q")})
+        FROM image_tags JOIN tags ON tags.tag_id = image_tags.tag_id
+        GROUP BY image_tags.image_id, lower(tags.tag_name);
+    """
+    for rows in stream(conn, "snapshot_image_tags", query):
+        chunks.append((
+            np.fromiter((row[0] for row in rows), dtype=np.int32, count=len(rows)),
+            np.fromiter((tag_ids.setdefault(row[1], len(tag_ids)) for row in rows), dtype=np.int32, count=len(rows)),
+            np.fromiter((row[2] for row in rows), dtype=np.float64, count=len(rows)),
+        ))
+    if chunks:
+        tag_images, tags, confidences = (np.concatenate(columns) for columns in zip(*chunks))
+    else:
+        tag_images, tags, confidences = np.empty(0, np.int32), np.empty(0, np.int32), np.empty(0)
+
+    # Renumber tags alphabetically and drop tags of images missing from images
+    tag_names = sorted(tag_ids)
+    renumber = np.empty(len(tag_names), dtype=np.int32)
+    renumber[[tag_ids[name] for name in tag_names]] = np.arange(len(tag_names), dtype=np.int32)
+    known = np.isin(tag_images, image_ids)
+    tag_images, tags, neg_confidences = tag_images[known], renumber[tags[known]], -confidences[known]
+
+    order = np.lexsort((tag_images, neg_confidences, tags))
+    tag_images, tags, neg_confidences = tag_images[order], tags[order], neg_confidences[order]
+    by_image = np.argsort(tag_images, kind="stable")
+    posting_offsets = np.searchsorted(tags, np.arange(len(tag_names)))
+    tag_offsets = np.searchsorted(tag_images[by_image], image_ids)
+    return tag_names, posting_offsets, tags, tag_images, neg_confidences, by_image, tag_offsets
+
+def export_nights(conn):
+    hotel_ids, dates, availability, prices = [], [], [], []
+    query = "SELECT hotel_id, date, availability, price FROM availability_price;"
+    for rows in stream(conn, "snapshot_nights", query):
+        for hotel_id, night_date, night_availability, price in rows:
+            hotel_ids.append(hotel_id)
+            dates.append(night_date)
+            availability.append(night_availability)
+            prices.append(None if price is None else float(price))
+    return pa.table({
+        "hotel_id": pa.array(hotel_ids, pa.int32()),
+        "date": pa.array(dates, pa.date32()),
+        "availability": pa.array(availability, pa.int32()),
+        "price": pa.array(prices, pa.float64()),
+    })
+
+def scalar(cursor, query):
+    cursor.execute(query)
+    return cursor.fetchone()[0]
+
+def export_snapshot():
+    conn = db.get_pool().getconn()
+    # Every table and watermark is read from the same database snapshot
+    conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+    start_time = time.time()
+    with conn.cursor() as cursor:
+        data_versions = {}
+        if scalar(cursor, "SELECT to_regclass('data_versions') IS NOT NULL;"):
+            cursor.execute(READ_DATA_VERSIONS_SQL)
+            data_versions = dict(cursor.fetchall())
+        tags_watermark = scalar(cursor, "SELECT max(tagged_at) FROM image_tags;")
+        prices_watermark = scalar(cursor, "SELECT max(updated_at) FROM availability_price;")
+        cursor.execute("SELECT chain_id, chain_name FROM chains ORDER BY chain_id;")
+        chains = cursor.fetchall()
+        cursor.execute("SELECT hotel_id, hotel_name, chain_id, latitude, longitude FROM hotels ORDER BY hotel_id;")
+        hotels = cursor.fetchall()
+
+    image_ids, image_hotels, image_urls = export_images(conn)
+    print(f"Read {len(chains)} chains, {len(hotels)} hotels and {len(image_ids)} images")
+    tag_names, posting_offsets, tags, tag_images, neg_confidences, by_image, tag_offsets = \
+        export_image_tags(conn, image_ids)
+    print(f"Read {len(tags)} image tags over {len(tag_names)} tags")
+    nights = export_nights(conn)
+    print(f"Read {nights.num_rows} nights")
+    conn.rollback()
+    db.get_pool().putconn(conn)
+
+    tables = {
+        "chains": pa.table({
+            "chain_id": pa.array([row[0] for row in chains], pa.int32()),
+            "chain_name": pa.array([row[1] for row in chains], pa.string()),
+        }),
+        "hotels": pa.table({
+            "hotel_id": pa.array([row[0] for row in hotels], pa.int32()),
+            "hotel_name": pa.array([row[1] for row in hotels], pa.string()),
+            "chain_id": pa.array([row[2] for row in hotels], pa.int32()),
+            "latitude": pa.array([row[3] for row in hotels], pa.float64()),
+            "longitude": pa.array([row[4] for row in hotels], pa.float64()),
+        }),
+        "images": pa.table({
+            "image_id": image_ids,
+            "hotel_id": image_hotels,
+            "image_url": pa.array(image_urls, pa.string()),
+            "tag_offset": tag_offsets.astype(np.int64),
+        }),
+        "tags": pa.table({
+            "tag_name": pa.array(tag_names, pa.string()),
+            "posting_offset": posting_offsets.astype(np.int64),
+        }),
+        "image_tags": pa.table({
+            "tag_id": tags,
+            "image_id": tag_images,
+            "neg_confidence": neg_confidences,
+            "by_image": by_image.astype(np.int64),
+        }),
+        "nights": nights,
+    }
+    manifest = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "data_versions": data_versions,
+        "tags_watermark": tags_watermark.isoformat() if tags_watermark else None,
+        "prices_watermark": prices_watermark.isoformat() if prices_watermark else None,
+    }
+    version = write_snapshot(tables, manifest, SNAPSHOT_DIR)
+    size = sum(os.path.getsize(os.path.join(SNAPSHOT_DIR, version, name))
+               for name in os.listdir(os.path.join(SNAPSHOT_DIR, version)))
+    print(f"Snapshot {version} written to {SNAPSHOT_DIR} ({size / 1e6:.1f} MB) "
+          f"in {time.time() - start_time:.1f} seconds")
+
+if __name__ == "__main__":
+    export_snapshot()
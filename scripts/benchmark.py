@@ -0,0 +1,390 @@
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+import numpy as np
+from psycopg2 import sql
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hotel_ibs import db, synthetic
+from hotel_ibs.embedding_store import EmbeddingStore
+from hotel_ibs.tagging import DEFAULT_LOGIT_SCALE, ClipTagger, normalize_rows
+from hotel_ibs.vocabulary import GENERATED_TEXTS
+
+# Benchmark of the ingest scripts, the tagging inner loop and the search API
+# on synthetic Hotels-50K-shaped data (hotel_ibs/synthetic.py).
+#
+# The data is loaded into a separate database, BENCHMARK_DB_NAME, which is
+# dropped and recreated on every run, through the same scripts as the real
+# dataset: 01, 02, 04, the calendar of 05 and the indexes of 09. Tagging is
+# timed with a stub encoder, so the numbers cover batching, scoring and the
+# embedding store but not CLIP itself. The backend is then started twice,
+# without and with a snapshot (10_export_snapshot.py), and tag searches with
+# date, price and distance filters are sent at each BENCHMARK_CONCURRENCY.
+# The search cache is disabled so every request runs the search.
+#
+# Results go to BENCHMARK_RESULTS_DIR/<time>_<commit>.json. With
+# BENCHMARK_BASELINE=<earlier results file>, the change of every metric is
+# printed. Only a local PostgreSQL server is accepted.
+#
+# BENCHMARK_SCALE=1 is the size of Hotels-50K: 50k hotels, 1M images, 10M
+# image tags and 18M nights; plan for several GB of disk and RAM.
+
+load_dotenv()
+
+DB_HOST = os.getenv("DB_HOST")
+DB_NAME = os.getenv("DB_NAME")
+
+BENCHMARK_SCALE = float(os.getenv("BENCHMARK_SCALE", "0.01"))  # 1 = Hotels-50K
+BENCHMARK_SEED = int(os.getenv("BENCHMARK_SEED", "0"))
+BENCHMARK_DIR = os.path.abspath(os.getenv("BENCHMARK_DIR", "./cache/benchmark"))  # generated data, reused
+BENCHMARK_DB_NAME = os.getenv("BENCHMARK_DB_NAME", "hotel_ibs_benchmark")
+BENCHMARK_RESULTS_DIR = os.getenv("BENCHMARK_RESULTS_DIR", "./benchmark_results")
+BENCHMARK_BASELINE = os.getenv("BENCHMARK_BASELINE")  # results file to compare with
+BENCHMARK_CONCURRENCY = [int(n) for n in os.getenv("BENCHMARK_CONCURRENCY", "1,4,16").split(",")]
+BENCHMARK_REQUESTS = int(os.getenv("BENCHMARK_REQUESTS", "500"))  # search requests per concurrency level
+BENCHMARK_TAGGING_IMAGES = int(os.getenv("BENCHMARK_TAGGING_IMAGES", "20000"))
+BENCHMARK_PORT = int(os.getenv("BENCHMARK_PORT", "5099"))
+BENCHMARK_CALENDAR_DAYS = int(os.getenv("BENCHMARK_CALENDAR_DAYS", "365"))
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS_DIR = os.path.join(REPO_ROOT, "scripts")
+LOCAL_HOSTS = {"", "localhost", "127.0.0.1", "::1"}
+CALENDAR_START = date(2025, 1, 1)
+BACKEND_START_TIMEOUT = 1800
+
+# Share of each kind of search in the load
+QUERY_MIX = {"tag": 0.4, "any_of_two": 0.2, "all_of_two": 0.1, "dates_and_price": 0.15, "nearby": 0.15}
+
+def check_local():
+    """Refuse to run anywhere but on a local server, in a database of its own."""
+    host = DB_HOST or ""
+    if host not in LOCAL_HOSTS and not host.startswith("/"):
+        sys.exit(f"DB_HOST={host} is not local: the benchmark drops and recreates its database, "
+                 "run it against a local PostgreSQL server only")
+    if BENCHMARK_DB_NAME == DB_NAME:
+        sys.exit(f"BENCHMARK_DB_NAME must differ from DB_NAME ({DB_NAME})")
+
+def connect_db(dbname=BENCHMARK_DB_NAME):
+    # Not pooled: the benchmark database is dropped while this process runs
+    return db.connect(dbname)
+
+def recreate_database():
+    conn = connect_db("postgres")
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("DROP DATABASE IF EXISTS {};").format(sql.Identifier(BENCHMARK_DB_NAME)))
+        cursor.execute(sql.SQL("CREATE DATABASE {};").format(sql.Identifier(BENCHMARK_DB_NAME)))
+    conn.close()
+
+def query_all(query, params=None):
+    conn = connect_db()
+    with conn.cursor() as cursor:
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+def run_script(name, **env):
+    """Run a loader script from the data directory; returns its wall time in seconds."""
+    log_path = os.path.join(BENCHMARK_DIR, "logs", f"{name}.log")
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    start_time = time.time()
+    with open(log_path, "w") as log:
+        result = subprocess.run([sys.executable, os.path.join(SCRIPTS_DIR, name)], cwd=BENCHMARK_DIR,
+                                env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT)
+    seconds = time.time() - start_time
+    if result.returncode:
+        with open(log_path) as log:
+            print(log.read()[-2000:])
+        sys.exit(f"{name} failed, see {log_path}")
+    print(f"{name}: {seconds:.1f} s")
+    return seconds
+
+def table_rows(table):
+    return query_all(sql.SQL("SELECT count(*) FROM {};").format(sql.Identifier(table)))[0][0]
+
+def rate(seconds, rows):
+    return {"seconds": round(seconds, 3), "rows": rows, "rows_per_second": round(rows / max(seconds, 1e-9))}
+
+def load_dataset():
+    """Load the generated files with the loader scripts; returns the timing of every step."""
+    recreate_database()
+    ingest = {}
+    ingest["create_database"] = {"seconds": round(run_script("01_create_database.py"), 3)}
+    seconds = run_script("02_populate_database",
+                         IMAGE_MANIFEST_PATH=os.path.join(BENCHMARK_DIR, "image_manifest.sqlite"))
+    ingest["populate_database"] = rate(seconds, table_rows("hotels") + table_rows("images"))
+    seconds = run_script("04_import_tags_to_database.py", IMPORT_RESTART="1",
+                         TAGGED_IMAGES_CSV_PATH=os.path.join(BENCHMARK_DIR, "tagged_images.csv"))
+    ingest["import_tags"] = rate(seconds, table_rows("image_tags"))
+    # The migrations also create availability_price, which 05 only fills
+    ingest["migrate_schema"] = {"seconds": round(run_script("09_migrate_schema.py"), 3)}
+
+    calendar_end = CALENDAR_START + timedelta(days=BENCHMARK_CALENDAR_DAYS - 1)
+    seconds = run_script("05_generate_availability_and_pricing.py",
+                         HOTEL_INFO_PATH=os.path.join(BENCHMARK_DIR, "scripts", "hotel_info.csv"),
+                         CALENDAR_START=CALENDAR_START.isoformat(), CALENDAR_END=calendar_end.isoformat(),
+                         CALENDAR_SEED=str(BENCHMARK_SEED))
+    ingest["availability"] = rate(seconds, table_rows("availability_price"))
+
+    # The backend re-reads rows written within REFRESH_OVERLAP of its snapshot's
+    # watermark; age the fresh rows so a warm start sees the usual, older data
+    conn = connect_db()
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("UPDATE image_tags SET tagged_at = now() - interval '1 hour';")
+        cursor.execute("UPDATE availability_price SET updated_at = now() - interval '1 hour';")
+        cursor.execute("VACUUM ANALYZE;")
+    conn.close()
+    return ingest
+
+class StubTagger(ClipTagger):
+    """ClipTagger whose text and image embeddings are random unit vectors: everything but CLIP."""
+
+    def __init__(self, texts, dim=512, batch_size=64, top_k=10, embedding_store=None, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.texts = list(texts)
+        self.batch_size = batch_size
+        self.top_k = top_k
+        self.embedding_store = embedding_store
+        self.logit_scale = DEFAULT_LOGIT_SCALE
+        self.text_features = normalize_rows(self.rng.standard_normal((len(self.texts), dim)))
+
+    def encode_images(self, images):
+        return normalize_rows(self.rng.standard_normal((len(images), self.text_features.shape[1])))
+
+def benchmark_tagging():
+    """Images per second through ClipTagger.tag_batch: encode (stubbed), store and score."""
+    store_path = os.path.join(BENCHMARK_DIR, "image_embeddings")
+    shutil.rmtree(store_path, ignore_errors=True)
+    tagger = StubTagger(GENERATED_TEXTS, embedding_store=EmbeddingStore(store_path, dim=512),
+                        seed=BENCHMARK_SEED)
+    images = np.zeros((tagger.batch_size, 224, 224, 3), dtype=np.uint8)
+    tagged = 0
+    start_time = time.time()
+    for start in range(0, BENCHMARK_TAGGING_IMAGES, tagger.batch_size):
+        ids = list(range(start + 1, min(start + tagger.batch_size, BENCHMARK_TAGGING_IMAGES) + 1))
+        tagged += len(tagger.tag_batch(ids, images[:len(ids)]))
+    seconds = time.time() - start_time
+    shutil.rmtree(store_path, ignore_errors=True)
+    print(f"Tagging: {tagged / seconds:,.0f} images/s")
+    return {"images": tagged, "vocabulary": len(tagger.texts), "batch_size": tagger.batch_size,
+            "seconds": round(seconds, 3), "images_per_second": round(tagged / seconds)}
+
+def search_queries(count, seed):
+    """(kind, query string) pairs: popular tags are searched more often, like the tags themselves."""
+    rng = np.random.default_rng(seed)
+    tag_counts = query_all("""
+        SELECT lower(tags.tag_name), count(*) FROM image_tags JOIN tags ON tags.tag_id = image_tags.tag_id GROUP BY 1;
+    """)
+    tags = [tag for tag, _ in tag_counts]
+    weights = np.array([count for _, count in tag_counts], dtype=float)
+    weights /= weights.sum()
+    hotels = query_all("SELECT latitude, longitude FROM hotels;")
+    kinds = list(QUERY_MIX)
+    queries = []
+    for kind in rng.choice(kinds, count, p=list(QUERY_MIX.values())):
+        terms = rng.choice(tags, 1 if kind in ("tag", "dates_and_price", "nearby") else 2, replace=False, p=weights)
+        params = {"tag": ",".join(terms)}
+        if kind == "all_of_two":
+            params["mode"] = "and"
+        elif kind == "dates_and_price":
+            check_in = CALENDAR_START + timedelta(days=int(rng.integers(0, BENCHMARK_CALENDAR_DAYS - 7)))
+            params.update(startDate=check_in.isoformat(),
+                          endDate=(check_in + timedelta(days=int(rng.integers(1, 8)))).isoformat(),
+                          maxPrice=int(rng.choice([150, 250, 400])))
+        elif kind == "nearby":
+            latitude, longitude = hotels[rng.integers(len(hotels))]
+            params.update(lat=latitude, lon=longitude, radiusKm=int(rng.choice([5, 20, 50])))
+        queries.append((str(kind), urlencode(params)))
+    return queries
+
+def backend_env():
+    return {
+        **os.environ,
+        # Everything the backend reads from disk comes from the benchmark directory
+        "SNAPSHOT_DIR": os.path.join(BENCHMARK_DIR, "snapshots"),
+        "TAG_BITMAPS_PATH": os.path.join(BENCHMARK_DIR, "tag_bitmaps.npz"),
+        "EMBEDDING_STORE_DIR": os.path.join(BENCHMARK_DIR, "image_embeddings"),
+        "ANN_INDEX_DIR": os.path.join(BENCHMARK_DIR, "ann_index"),
+        "AWS_S3_bucket": "",
+        "SEARCH_CACHE_URL": "",
+        "SEARCH_CACHE_MAX_ENTRIES": "0",
+    }
+
+def start_backend(ready_query):
+    """Start the backend and wait for its first search; returns (process, seconds until answered)."""
+    log = open(os.path.join(BENCHMARK_DIR, "logs", "backend.log"), "a")
+    start_time = time.time()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "flask", "--app", "backend.app", "run", "--port", str(BENCHMARK_PORT)],
+        cwd=REPO_ROOT, env=backend_env(), stdout=log, stderr=subprocess.STDOUT,
+    )
+    while True:
+        if process.poll() is not None:
+            sys.exit(f"The backend exited with code {process.returncode}, see {log.name}")
+        if time.time() - start_time > BACKEND_START_TIMEOUT:
+            process.terminate()
+            sys.exit(f"The backend did not answer within {BACKEND_START_TIMEOUT} s")
+        try:
+            with urlopen(f"http://127.0.0.1:{BENCHMARK_PORT}/api/images?{ready_query}",
+                         timeout=BACKEND_START_TIMEOUT) as response:
+                response.read()
+            return process, time.time() - start_time
+        except OSError:
+            time.sleep(0.05)
+
+def stop_backend(process):
+    process.terminate()
+    process.wait()
+
+def timed_request(query):
+    start_time = time.perf_counter()
+    try:
+        with urlopen(f"http://127.0.0.1:{BENCHMARK_PORT}/api/images?{query}", timeout=300) as response:
+            response.read()
+            ok = response.status == 200
+    except OSError:
+        ok = False
+    return time.perf_counter() - start_time, ok
+
+def latency_stats(latencies):
+    milliseconds = np.asarray(latencies) * 1000
+    if not len(milliseconds):
+        return {}
+    p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+    return {"p50_ms": round(p50, 2), "p95_ms": round(p95, 2), "p99_ms": round(p99, 2),
+            "mean_ms": round(milliseconds.mean(), 2), "max_ms": round(milliseconds.max(), 2)}
+
+def run_load(queries, concurrency):
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed_request, [query for _, query in queries]))
+    seconds = time.time() - start_time
+    by_kind = {}
+    for (kind, _), (latency, ok) in zip(queries, results):
+        if ok:
+            by_kind.setdefault(kind, []).append(latency)
+    stats = {
+        "requests": len(queries),
+        "errors": sum(not ok for _, ok in results),
+        "queries_per_second": round(len(queries) / seconds, 1),
+        **latency_stats([latency for latency, ok in results if ok]),
+        "by_query": {kind: latency_stats(latencies) for kind, latencies in sorted(by_kind.items())},
+    }
+    return stats
+
+def benchmark_backend():
+    """Cold and warm start times, then search latency under load on the warm-started backend."""
+    shutil.rmtree(os.path.join(BENCHMARK_DIR, "snapshots"), ignore_errors=True)
+    queries = search_queries(BENCHMARK_REQUESTS, BENCHMARK_SEED)
+    ready_query = queries[0][1]
+
+    process, cold_start = start_backend(ready_query)
+    stop_backend(process)
+    print(f"Backend cold start: {cold_start:.1f} s")
+    export_seconds = run_script("10_export_snapshot.py", SNAPSHOT_DIR=os.path.join(BENCHMARK_DIR, "snapshots"))
+    process, warm_start = start_backend(ready_query)
+    print(f"Backend warm start: {warm_start:.1f} s")
+    backend = {"cold_start_seconds": round(cold_start, 3), "export_snapshot_seconds": round(export_seconds, 3),
+               "warm_start_seconds": round(warm_start, 3)}
+
+    search = {}
+    try:
+        run_load(search_queries(min(100, BENCHMARK_REQUESTS), BENCHMARK_SEED + 1), 1)  # warm-up
+        for concurrency in BENCHMARK_CONCURRENCY:
+            stats = search[f"concurrency_{concurrency}"] = run_load(queries, concurrency)
+            print(f"Concurrency {concurrency}: {stats['queries_per_second']} q/s, p50 {stats.get('p50_ms')} ms, "
+                  f"p95 {stats.get('p95_ms')} ms, p99 {stats.get('p99_ms')} ms, {stats['errors']} errors")
+    finally:
+        stop_backend(process)
+    return backend, search
+
+def git_state():
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+    return {"commit": git("rev-parse", "HEAD") or None,
+            "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+def machine():
+    return {"platform": platform.platform(), "processor": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count(), "python": platform.python_version()}
+
+def metrics(results):
+    """Flat {section.name...: number} of the measured values, without the per-query breakdown."""
+    flat = {}
+
+    def walk(prefix, value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                if key != "by_query":
+                    walk(f"{prefix}.{key}", item)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix] = value
+
+    for section in ("ingest", "tagging", "backend", "search"):
+        walk(section, results.get(section, {}))
+    return flat
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"Compared with {baseline_path} (commit {baseline['git']['commit']}, scale {baseline['config']['scale']}):")
+    before, after = metrics(baseline), metrics(results)
+    for name in sorted(before.keys() & after.keys()):
+        change = f"{(after[name] - before[name]) / before[name]:+.1%}" if before[name] else "n/a"
+        print(f"  {name}: {before[name]} -> {after[name]} ({change})")
+
+def run_benchmark():
+    check_local()
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    print(f"Generating scale {BENCHMARK_SCALE} data in {BENCHMARK_DIR}")
+    dataset = synthetic.generate(BENCHMARK_DIR, BENCHMARK_SCALE, BENCHMARK_SEED)
+    # 01 reads ./dataset, 02 and 05 read ./scripts
+    os.makedirs(os.path.join(BENCHMARK_DIR, "scripts"), exist_ok=True)
+    for name in ("chain_info.csv", "hotel_info.csv", "train_set.csv"):
+        shutil.copy(os.path.join(BENCHMARK_DIR, "dataset", name), os.path.join(BENCHMARK_DIR, "scripts", name))
+    print(f"{dataset['hotels']} hotels, {dataset['images']} images, {dataset['image_tags']} image tags")
+
+    # The scripts and the backend all read the connection settings from the environment
+    os.environ["DB_NAME"] = BENCHMARK_DB_NAME
+    ingest = load_dataset()
+    dataset["nights"] = table_rows("availability_price")
+    tagging = benchmark_tagging()
+    backend, search = benchmark_backend()
+
+    results = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "git": git_state(),
+        "machine": machine(),
+        "postgres": query_all("SHOW server_version;")[0][0],
+        "config": {"scale": BENCHMARK_SCALE, "seed": BENCHMARK_SEED, "requests": BENCHMARK_REQUESTS,
+                   "concurrency": BENCHMARK_CONCURRENCY, "calendar_days": BENCHMARK_CALENDAR_DAYS,
+                   "query_mix": QUERY_MIX},
+        "dataset": dataset,
+        "ingest": ingest,
+        "tagging": tagging,
+        "backend": backend,
+        "search": search,
+    }
+    os.makedirs(BENCHMARK_RESULTS_DIR, exist_ok=True)
+    commit = (results["git"]["commit"] or "nogit")[:10] + ("-dirty" if results["git"]["dirty"] else "")
+    path = os.path.join(BENCHMARK_RESULTS_DIR, f"{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}_{commit}.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {path}")
+    if BENCHMARK_BASELINE:
+        compare(results, BENCHMARK_BASELINE)
+
+if __name__ == "__main__":
+    run_benchmark()
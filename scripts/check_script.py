@@ -1,7 +1,21 @@
 import os
+import sys
 import csv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hotel_ibs.image_manifest import ImageManifest, IMAGE_MANIFEST_PATH
+
 def extract_images(image_root):
+    # Read the manifest of 00_4_check_image_sizes.py when there is one instead of walking the tree
+    if os.path.exists(IMAGE_MANIFEST_PATH):
+        manifest = ImageManifest(IMAGE_MANIFEST_PATH)
+        files = manifest.image_files()
+        manifest.close()
+        image_data = [(image_id, hotel_id, f"./images/{chain_id}/{hotel_id}/{os.path.basename(path)}")
+                      for chain_id, hotel_id, image_id, path in files.itertuples(index=False)
+                      if image_id.isdigit()]
+        return sorted(image_data, key=lambda x: int(x[0]))
+
     image_data = []
     for root, _, files in os.walk(image_root):
         parts = root.split(os.sep)
@@ -0,0 +1,140 @@
+import importlib
+import importlib.machinery
+import importlib.util
+import os
+import shutil
+import subprocess
+import sys
+
+import psycopg2
+import pytest
+from psycopg2 import sql
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from hotel_ibs import db, synthetic  # noqa: E402
+
+# Scratch database, dropped and recreated for every test that uses `postgres`
+TEST_DB_NAME = os.getenv("TEST_DB_NAME", "hotel_ibs_test")
+LOCAL_HOSTS = {"", "localhost", "127.0.0.1", "::1"}
+
+
+@pytest.fixture
+def load_script():
+    """Import a file of scripts/ as a fresh module (names start with digits); its main block does not run."""
+    def load(name):
+        path = os.path.join(REPO_DIR, "scripts", name)
+        module_name = "script_" + "".join(c if c.isalnum() else "_" for c in os.path.splitext(name)[0])
+        loader = importlib.machinery.SourceFileLoader(module_name, path)  # also for files without .py
+        spec = importlib.util.spec_from_file_location(module_name, path, loader=loader)
+        module = importlib.util.module_from_spec(spec)
+        loader.exec_module(module)
+        return module
+    return load
+
+
+def _admin_connection():
+    conn = db.connect("postgres")
+    conn.autocommit = True
+    return conn
+
+
+@pytest.fixture
+def postgres(monkeypatch):
+    """
+    An empty TEST_DB_NAME database on the server of DB_HOST/DB_USER, with
+    DB_NAME pointing at it. Skipped without a reachable local server.
+    """
+    host = os.getenv("DB_HOST") or ""
+    if host not in LOCAL_HOSTS and not host.startswith("/"):
+        pytest.skip(f"DB_HOST={host} is not local; the tests drop and recreate {TEST_DB_NAME}")
+    try:
+        conn = _admin_connection()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"No PostgreSQL server: {e}")
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("DROP DATABASE IF EXISTS {};").format(sql.Identifier(TEST_DB_NAME)))
+        cursor.execute(sql.SQL("CREATE DATABASE {};").format(sql.Identifier(TEST_DB_NAME)))
+    monkeypatch.setenv("DB_NAME", TEST_DB_NAME)
+    yield TEST_DB_NAME
+
+    db.close_pools()
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("DROP DATABASE IF EXISTS {};").format(sql.Identifier(TEST_DB_NAME)))
+    conn.close()
+
+
+def _run_script(name, cwd, **env):
+    result = subprocess.run([sys.executable, os.path.join(REPO_DIR, "scripts", name)], cwd=cwd,
+                            env={**os.environ, **env}, capture_output=True, text=True)
+    assert result.returncode == 0, f"{name} failed:\n{result.stdout[-2000:]}{result.stderr[-2000:]}"
+
+
+@pytest.fixture
+def run_script():
+    """Run a file of scripts/ in a subprocess from a directory, with extra environment variables."""
+    return _run_script
+
+
+def trigram_available():
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM pg_available_extensions WHERE name = 'pg_trgm';")
+        return cursor.fetchone()[0] > 0
+
+
+@pytest.fixture
+def search_db(postgres, load_script, tmp_path):
+    """
+    The test database loaded with a small synthetic dataset (about 2000
+    images) through the loader scripts and migrated, like scripts/benchmark.py
+    does. Without pg_trgm on the server the trigram index is left out.
+    Returns the directory of the generated files.
+    """
+    data_dir = str(tmp_path / "data")
+    synthetic.generate(data_dir, scale=0.002, seed=0)
+    os.makedirs(os.path.join(data_dir, "scripts"))
+    for name in ("chain_info.csv", "hotel_info.csv", "train_set.csv"):
+        shutil.copy(os.path.join(data_dir, "dataset", name), os.path.join(data_dir, "scripts", name))
+
+    _run_script("01_create_database.py", data_dir)
+    _run_script("02_populate_database", data_dir, IMAGE_MANIFEST_PATH=os.path.join(data_dir, "image_manifest.sqlite"))
+    _run_script("04_import_tags_to_database.py", data_dir, IMPORT_RESTART="1",
+                TAGGED_IMAGES_CSV_PATH=os.path.join(data_dir, "tagged_images.csv"))
+    migrations = load_script("09_migrate_schema.py")
+    if not trigram_available():
+        migrations.MIGRATIONS = [m for m in migrations.MIGRATIONS if m[2] is not migrations.trigram_tag_index]
+    migrations.migrate()
+    _run_script("05_generate_availability_and_pricing.py", data_dir, CALENDAR_START="2025-01-01",
+                CALENDAR_END="2025-01-31", CALENDAR_SEED="0")
+    return data_dir
+
+
+@pytest.fixture
+def backend_app(search_db, monkeypatch, tmp_path):
+    """
+    backend/app.py serving the search_db database from empty in-memory
+    indexes: no snapshot, tag bitmaps, S3 bucket or shared search cache.
+    """
+    from backend.search_cache import SearchCache
+    from backend.signed_urls import UrlSigner
+    from backend.tag_suggest import TagSuggester
+
+    app_module = importlib.import_module("backend.app")  # the engine is bound to DB_NAME, set by `postgres`
+    monkeypatch.setattr(app_module, "TAG_BITMAPS_PATH", str(tmp_path / "tag_bitmaps.npz"))
+    monkeypatch.setattr(app_module, "tag_bitmaps", None)
+    monkeypatch.setattr(app_module, "tag_bitmaps_mtime", None)
+    monkeypatch.setattr(app_module, "indexes", app_module.SearchIndexes())
+    monkeypatch.setattr(app_module, "tag_suggester", TagSuggester())
+    monkeypatch.setattr(app_module, "search_cache", SearchCache(url=None))
+    monkeypatch.setattr(app_module, "url_signer", UrlSigner(bucket=None))
+    monkeypatch.setattr(app_module, "indexes_refreshed_at", 0.0)
+    monkeypatch.setattr(app_module, "data_versions", {})
+    monkeypatch.setattr(app_module, "data_versions_checked_at", 0.0)
+    monkeypatch.setattr(app_module, "loaded_indexes", None)
+    monkeypatch.setattr(app_module, "snapshot_checked_at", float("inf"))  # never looks for a snapshot
+    yield app_module
+
+    with app_module.app.app_context():
+        app_module.db.session.remove()
+        app_module.db.engine.dispose()
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from backend.semantic_search import SemanticSearch
+from hotel_ibs.ann import IVFIndex, exact_search
+from hotel_ibs.embedding_store import EmbeddingStore
+
+DIM = 32
+
+
+def normalized(vectors):
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+@pytest.fixture(scope="module")
+def embeddings():
+    """Normalized vectors around 40 directions, like image embeddings of similar scenes."""
+    rng = np.random.default_rng(3)
+    centers = normalized(rng.normal(size=(40, DIM)))
+    vectors = centers[rng.integers(0, 40, 4000)] + 0.3 * rng.normal(size=(4000, DIM)) / np.sqrt(DIM)
+    return normalized(vectors), np.arange(1000, 5000)
+
+
+@pytest.fixture(scope="module")
+def index(embeddings):
+    vectors, image_ids = embeddings
+    return IVFIndex.build(vectors, image_ids, n_lists=64, n_probe=8, train_size=2000)
+
+
+@pytest.fixture(scope="module")
+def queries(embeddings):
+    rng = np.random.default_rng(4)
+    vectors, _ = embeddings
+    return normalized(vectors[rng.integers(0, len(vectors), 50)] + 0.1 * rng.normal(size=(50, DIM)))
+
+
+def test_recall_against_exact_search(index, embeddings, queries):
+    vectors, image_ids = embeddings
+    assert index.recall(queries, k=10) >= 0.9
+    assert index.recall(queries, k=10, n_probe=64) == 1.0
+
+    # The exact baseline is a plain scan of the embeddings
+    for query in queries[:5]:
+        rows, scores = exact_search(vectors, query, 10, chunk_size=1000)
+        expected = image_ids[np.argsort(-(vectors @ query), kind="stable")[:10]]
+        assert rows.tolist() == (expected - 1000).tolist()
+        assert [image_id for image_id, _ in index.search_exact(query, 10)] == expected.tolist()
+        assert scores == pytest.approx(np.sort(vectors @ query)[::-1][:10], abs=1e-3)  # float16 rows
+
+
+def test_round_trip_through_the_memory_mapped_files(index, queries, tmp_path):
+    index.save(str(tmp_path))
+    loaded = IVFIndex.load(str(tmp_path))
+    assert isinstance(loaded.vectors, np.memmap) and isinstance(loaded.image_ids, np.memmap)
+    assert (len(loaded), loaded.n_probe) == (len(index), index.n_probe)
+    for query in queries[:10]:
+        assert loaded.search(query, 20) == index.search(query, 20)
+        assert loaded.search(query, 20, n_probe=3) == index.search(query, 20, n_probe=3)
+
+
+def test_empty_lists_and_out_of_range_probes():
+    vectors = normalized(np.eye(4, DIM) + 0.01)
+    # Lists 0 and 2 are empty; list 1 holds images 10-12, list 3 image 13
+    centroids = normalized(np.eye(4, DIM))
+    index = IVFIndex(centroids, np.array([0, 0, 3, 3, 4]), vectors.astype(np.float16), np.arange(10, 14), n_probe=1)
+
+    assert index.search(centroids[0], k=5) == []
+    assert [image_id for image_id, _ in index.search(centroids[0], k=5, n_probe=100)] == \
+        [image_id for image_id, _ in index.search_exact(centroids[0], k=5)]
+    assert len(index.search(centroids[1], k=5, n_probe=-3)) == 3  # at least one list
+    assert index.search(centroids[1], k=0) == []
+
+
+def test_semantic_search_falls_back_to_the_embedding_store(index, embeddings, queries, tmp_path):
+    vectors, image_ids = embeddings
+    store = EmbeddingStore(str(tmp_path / "store"), dim=DIM)
+    store.append([str(image_id) for image_id in image_ids[:100]], -vectors[:100])
+    store.append([str(image_id) for image_id in image_ids[:100]], vectors[:100])  # supersedes the rows above
+    index.save(str(tmp_path / "index"))
+
+    search = SemanticSearch(index_dir=str(tmp_path / "missing"), store_dir=str(tmp_path / "store")).load()
+    search.embed = lambda text: vectors[7]
+    found = search.search("pool", k=3)
+    assert found[0][0] == str(image_ids[7]) and found[0][1] == pytest.approx(1.0, abs=1e-3)
+    assert len({image_id for image_id, _ in search.search("pool", k=100)}) == 100  # superseded rows are skipped
+
+    search = SemanticSearch(index_dir=str(tmp_path / "index"), store_dir=str(tmp_path / "store")).load()
+    search.embed = lambda text: queries[0]
+    assert search.search("pool", k=10) == index.search(queries[0], 10)
+    assert search.search("pool", k=10, exact=True) == index.search_exact(queries[0], 10)
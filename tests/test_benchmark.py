@@ -0,0 +1,45 @@
+import pytest
+
+
+@pytest.fixture
+def benchmark(load_script):
+    return load_script("benchmark.py")
+
+
+@pytest.mark.parametrize("host", ["db.example.com", "10.0.0.5"])
+def test_refuses_remote_databases(benchmark, monkeypatch, host):
+    monkeypatch.setattr(benchmark, "DB_HOST", host)
+    with pytest.raises(SystemExit, match="not local"):
+        benchmark.check_local()
+
+
+def test_refuses_its_own_database_name(benchmark, monkeypatch):
+    monkeypatch.setattr(benchmark, "DB_HOST", "localhost")
+    monkeypatch.setattr(benchmark, "DB_NAME", benchmark.BENCHMARK_DB_NAME)
+    with pytest.raises(SystemExit, match="must differ"):
+        benchmark.check_local()
+
+
+def test_metrics_are_flattened_for_comparison(benchmark, capsys, tmp_path):
+    results = {
+        "ingest": {"import_tags": {"seconds": 2.0, "rows_per_second": 500}},
+        "backend": {"warm_start_seconds": 1.5, "snapshot": True},
+        "search": {"concurrency_4": {"p50_ms": 10.0, "by_query": {"tag": {"p50_ms": 8.0}}}},
+        "git": {"commit": "abc"},
+    }
+    assert benchmark.metrics(results) == {
+        "ingest.import_tags.seconds": 2.0, "ingest.import_tags.rows_per_second": 500,
+        "backend.warm_start_seconds": 1.5, "search.concurrency_4.p50_ms": 10.0,
+    }
+
+    baseline = tmp_path / "baseline.json"
+    baseline.write_text('{"git": {"commit": "old"}, "config": {"scale": 0.01}, '
+                        '"search": {"concurrency_4": {"p50_ms": 20.0}}}')
+    benchmark.compare(results, str(baseline))
+    assert "search.concurrency_4.p50_ms: 20.0 -> 10.0 (-50.0%)" in capsys.readouterr().out
+
+
+def test_latency_stats(benchmark):
+    assert benchmark.latency_stats([]) == {}
+    stats = benchmark.latency_stats([0.001 * i for i in range(1, 101)])
+    assert (stats["p50_ms"], stats["max_ms"]) == (50.5, 100.0)
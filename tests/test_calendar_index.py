@@ -0,0 +1,133 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from backend.calendar_index import CalendarIndex
+
+START = date(2025, 3, 1)
+
+
+def random_nights(rng, hotel_ids, first_day, days):
+    """(hotel_id, date, availability, price) rows; some nights are missing, sold out or unpriced."""
+    nights = []
+    for hotel_id in hotel_ids:
+        for d in range(days):
+            if rng.random() < 0.1:
+                continue
+            availability = int(rng.integers(0, 4))  # 0 about a quarter of the time
+            price = None if rng.random() < 0.05 else round(float(rng.uniform(50, 400)), 2)
+            nights.append((hotel_id, first_day + timedelta(days=d), availability, price))
+    return nights
+
+
+def brute_force(calendar, check_in, check_out):
+    """{hotel_id: (average price or None, available every night)} from a loop over the nights."""
+    result = {}
+    for hotel_id in {hotel_id for hotel_id, _ in calendar}:
+        prices, available = [], True
+        night = check_in
+        while night < check_out:
+            availability, price = calendar.get((hotel_id, night), (0, None))
+            available &= availability > 0
+            if price is not None:
+                prices.append(price)
+            night += timedelta(days=1)
+        result[hotel_id] = (sum(prices) / len(prices) if prices else None, available)
+    return result
+
+
+def check_stay(index, calendar, check_in, check_out):
+    hotel_ids, averages, available = index.stay(check_in, check_out)
+    found = {hotel_id: (None if np.isnan(average) else average, bool(ok))
+             for hotel_id, average, ok in zip(hotel_ids.tolist(), averages.tolist(), available.tolist())}
+    expected = brute_force(calendar, check_in, check_out)
+    assert found.keys() == expected.keys()
+    for hotel_id, (average, ok) in expected.items():
+        assert found[hotel_id][1] == ok, (hotel_id, check_in, check_out)
+        assert found[hotel_id][0] == (None if average is None else pytest.approx(average)), (hotel_id, check_in)
+
+
+def apply(index, calendar, nights):
+    index.update(nights)
+    for hotel_id, night, availability, price in nights:
+        calendar[(hotel_id, night)] = (availability, None if price is None else float(price))
+
+
+def test_stays_match_a_loop_over_the_nights_as_the_range_grows():
+    rng = np.random.default_rng(6)
+    index, calendar = CalendarIndex(), {}
+    apply(index, calendar, random_nights(rng, [1, 2, 3], START, 30))
+    assert (index.start, index.days) == (START, CalendarIndex.GROW_DAYS)
+
+    # Earlier nights, later nights past the block, a new hotel, and changed nights
+    apply(index, calendar, random_nights(rng, [2, 4], START - timedelta(days=20), 25))
+    apply(index, calendar, random_nights(rng, [1, 5], START + timedelta(days=60), 40))
+    apply(index, calendar, [(3, START + timedelta(days=2), 0, 120), (1, START + timedelta(days=3), 5, None)])
+    assert index.start == START - timedelta(days=CalendarIndex.GROW_DAYS)
+    assert index.days % CalendarIndex.GROW_DAYS == 0 and len(index) == 5
+
+    first = START - timedelta(days=20)
+    for _ in range(200):
+        check_in = first + timedelta(days=int(rng.integers(0, 120)))
+        check_stay(index, calendar, check_in, check_in + timedelta(days=int(rng.integers(1, 15))))
+    # Stays across the boundaries of each update
+    for check_in, nights in [(START - timedelta(days=3), 6), (START + timedelta(days=27), 40), (first, 120)]:
+        check_stay(index, calendar, check_in, check_in + timedelta(days=nights))
+
+
+def test_stays_outside_the_range_are_empty():
+    index = CalendarIndex()
+    assert len(index.stay(START, START + timedelta(days=1))[0]) == 0
+    index.update([(1, START, 1, 100)])
+    end = index.start + timedelta(days=index.days)
+    for check_in, check_out in [(START - timedelta(days=1), START + timedelta(days=1)),
+                                (end - timedelta(days=1), end + timedelta(days=1)), (START, START)]:
+        assert len(index.stay(check_in, check_out)[0]) == 0
+    assert index.filter_hotels(START, START + timedelta(days=1)) == {1: 100.0}
+    assert index.filter_hotels(START, START + timedelta(days=2)) == {}  # The second night has no data
+
+
+def test_filter_hotels_applies_the_price_range():
+    index = CalendarIndex()
+    index.update([(1, START, 2, 100), (1, START + timedelta(days=1), 1, 200),
+                  (2, START, 1, 80), (2, START + timedelta(days=1), 0, 80),
+                  (3, START, 1, 300), (3, START + timedelta(days=1), 1, 300)])
+    check_out = START + timedelta(days=2)
+    assert index.filter_hotels(START, check_out) == {1: 150.0, 3: 300.0}
+    assert index.filter_hotels(START, check_out, min_price=100, max_price=200) == {1: 150.0}
+
+
+def database_calendar(backend_app):
+    with backend_app.app.app_context():
+        rows = backend_app.db.session.query(
+            backend_app.AvailabilityPrice.hotel_id, backend_app.AvailabilityPrice.date,
+            backend_app.AvailabilityPrice.availability, backend_app.AvailabilityPrice.price).all()
+    return {(hotel_id, night): (availability, None if price is None else float(price))
+            for hotel_id, night, availability, price in rows}
+
+
+def test_refresh_reads_only_nights_after_the_watermark(backend_app):
+    index = CalendarIndex()
+    with backend_app.app.app_context():
+        session, AvailabilityPrice = backend_app.db.session, backend_app.AvailabilityPrice
+        touched = index.refresh(session, AvailabilityPrice)
+        assert touched == len(index) > 0
+        watermark = index.watermark
+        assert index.refresh(session, AvailabilityPrice) == len(index)  # everything is inside the overlap
+
+        hotel_ids = index.hotel_ids[:3].tolist()
+        session.execute(backend_app.sql_text("""
+            UPDATE availability_price SET updated_at = updated_at - interval '1 day';
+            UPDATE availability_price SET availability = 0, updated_at = now()
+            WHERE hotel_id = ANY(:hotel_ids) AND date = '2025-01-10';
+        """), {"hotel_ids": hotel_ids})
+        session.commit()  # every other night now looks written a day before the last refresh
+        assert index.refresh(session, AvailabilityPrice) == len(hotel_ids)
+        assert index.watermark > watermark
+
+    calendar = database_calendar(backend_app)
+    for check_in in [date(2025, 1, 1), date(2025, 1, 8), date(2025, 1, 10), date(2025, 1, 25)]:
+        check_stay(index, calendar, check_in, check_in + timedelta(days=5))
+    hotels, _, available = index.stay(date(2025, 1, 9), date(2025, 1, 12))
+    assert not available[np.isin(hotels, hotel_ids)].any()
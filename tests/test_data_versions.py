@@ -0,0 +1,24 @@
+import psycopg2
+import pytest
+
+from hotel_ibs import db
+from hotel_ibs.data_versions import CREATE_TABLE_SQL, PRICES, READ_SQL, TAGS, bump_version
+
+
+def test_bump_version_counts_per_name(postgres):
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute(CREATE_TABLE_SQL)
+    for name in (TAGS, TAGS, PRICES):
+        with db.connection() as conn, conn.cursor() as cursor:
+            bump_version(cursor, name)
+
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute(READ_SQL)
+        assert dict(cursor.fetchall()) == {TAGS: 2, PRICES: 1}
+
+
+def test_bump_version_runs_no_ddl(postgres):
+    # The table comes from 01_create_database.py or a migration, not from every batch
+    with pytest.raises(psycopg2.errors.UndefinedTable):
+        with db.connection() as conn, conn.cursor() as cursor:
+            bump_version(cursor, TAGS)
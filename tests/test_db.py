@@ -0,0 +1,191 @@
+import threading
+
+import psycopg2
+import psycopg2.pool
+import pytest
+
+from hotel_ibs import db
+
+
+def replaced(reason):
+    return db.CONNECTIONS_REPLACED.values.get((reason,), 0)
+
+
+def backend_pid(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_backend_pid();")
+        return cursor.fetchone()[0]
+
+
+def terminate(pid):
+    with db.connect() as admin, admin.cursor() as cursor:
+        cursor.execute("SELECT pg_terminate_backend(%s);", (pid,))
+    admin.close()
+
+
+def test_pooled_connection_is_reused(postgres):
+    with db.connection() as conn:
+        first = conn
+    with db.connection() as conn:
+        assert conn is first
+    assert db.get_pool() is db.get_pool()
+    assert db.get_pool(postgres) is db.get_pool()
+
+
+def test_dead_idle_connection_is_replaced(postgres, monkeypatch):
+    monkeypatch.setattr(db, "DB_PING_AFTER_SECONDS", 0)
+    with db.connection() as conn:
+        first, pid = conn, backend_pid(conn)
+    terminate(pid)
+    before = replaced("ping_failed")
+
+    with db.connection() as conn:
+        assert conn is not first and backend_pid(conn) != pid
+    assert replaced("ping_failed") == before + 1
+
+
+def test_closed_and_old_connections_are_replaced(postgres, monkeypatch):
+    with db.connection() as conn:
+        first = conn
+    first.close()
+    with db.connection() as conn:
+        assert conn is not first
+        second = conn
+
+    monkeypatch.setattr(db, "DB_POOL_RECYCLE_SECONDS", 0)
+    before = replaced("recycled")
+    with db.connection() as conn:
+        assert conn is not second
+    assert replaced("recycled") == before + 1 and second.closed
+
+
+def test_recently_used_connection_is_not_pinged(postgres, monkeypatch):
+    with db.connection() as conn:
+        first = conn
+    monkeypatch.setattr(db, "_ping", lambda conn: pytest.fail("pinged"))
+    with db.connection() as conn:
+        assert conn is first
+
+
+def test_borrower_waits_then_times_out(postgres):
+    pool = db.Pool(postgres, size=1, max_overflow=0, timeout=0.2)
+    conn = pool.getconn()
+    with pytest.raises(psycopg2.pool.PoolError):
+        pool.getconn()
+
+    threading.Timer(0.05, pool.putconn, (conn,)).start()
+    assert pool.getconn() is conn
+    pool.putconn(conn)
+    pool.closeall()
+    assert conn.closed
+
+
+def test_overflow_connections_are_closed_on_return(postgres):
+    pool = db.Pool(postgres, size=1, max_overflow=1, timeout=0)
+    first, extra = pool.getconn(), pool.getconn()
+    pool.putconn(first)
+    pool.putconn(extra)
+    assert extra.closed and not first.closed and pool._open == 1
+    pool.closeall()
+
+
+def test_block_is_committed_or_rolled_back(postgres):
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("CREATE TABLE t (id int PRIMARY KEY);")
+        cursor.execute("INSERT INTO t VALUES (1);")
+    with pytest.raises(psycopg2.errors.UniqueViolation):
+        with db.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("INSERT INTO t VALUES (2);")
+            cursor.execute("INSERT INTO t VALUES (1);")
+    with pytest.raises(ZeroDivisionError):
+        with db.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("INSERT INTO t VALUES (3);")
+            1 / 0
+
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT array_agg(id) FROM t;")
+        assert cursor.fetchone()[0] == [1]
+
+
+def test_borrower_session_settings_are_reset(postgres):
+    with db.connection() as conn:
+        conn.set_session(readonly=True, autocommit=True)
+    with db.connection() as conn:
+        assert not conn.autocommit and not conn.readonly
+
+
+def test_broken_connection_is_not_returned(postgres):
+    with pytest.raises(psycopg2.OperationalError):
+        with db.connection() as conn, conn.cursor() as cursor:
+            first = conn
+            terminate(backend_pid(conn))
+            cursor.execute("SELECT 1;")
+    with db.connection() as conn:
+        assert conn is not first
+    assert db.get_pool()._open == 1
+
+
+def prepared_statements(cursor):
+    """{name: (statement, prepare_time)} of the session."""
+    cursor.execute("SELECT name, statement, prepare_time FROM pg_prepared_statements;")
+    return {name: (statement, prepared_at) for name, statement, prepared_at in cursor.fetchall()}
+
+
+def test_statement_is_prepared_once_per_connection(postgres):
+    query = "SELECT %s::int + 1, '100%%';"
+    with db.connection() as conn, conn.cursor() as cursor:
+        db.execute_prepared(cursor, "add_one", query, (0,))
+        assert cursor.fetchone() == (1, "100%")
+        first = prepared_statements(cursor)
+        for i in range(1, 3):
+            db.execute_prepared(cursor, "add_one", query, (i,))
+            assert cursor.fetchone() == (i + 1, "100%")
+        assert prepared_statements(cursor) == first and list(first) == ["add_one"]
+        assert conn.prepared == {"add_one": "SELECT $1::int + 1, '100%'"}
+
+        db.execute_prepared(cursor, "add_one", "SELECT %s::int + 2;", (1,))
+        assert cursor.fetchone() == (3,)
+        assert prepared_statements(cursor)["add_one"][0].startswith("PREPARE add_one AS SELECT $1::int + 2")
+
+        db.execute_prepared(cursor, "no_params", "SELECT 7;")
+        assert cursor.fetchone() == (7,)
+
+
+def test_failed_prepare_is_not_recorded(postgres):
+    with pytest.raises(psycopg2.errors.UndefinedTable):
+        with db.connection() as conn, conn.cursor() as cursor:
+            db.execute_prepared(cursor, "missing", "SELECT * FROM missing WHERE id = %s;", (1,))
+    with db.connection() as conn, conn.cursor() as cursor:
+        assert "missing" not in conn.prepared
+        cursor.execute("CREATE TABLE missing (id int);")
+        db.execute_prepared(cursor, "missing", "SELECT * FROM missing WHERE id = %s;", (1,))
+        assert cursor.fetchall() == []
+
+
+def test_plain_connection_executes_directly(postgres):
+    conn = psycopg2.connect(**db.connect_kwargs())
+    with conn.cursor() as cursor:
+        db.execute_prepared(cursor, "plain", "SELECT %s::int;", (5,))
+        assert cursor.fetchone() == (5,) and prepared_statements(cursor) == {}
+    conn.close()
+
+
+def test_stream_yields_bounded_batches(postgres):
+    with db.connection() as conn:
+        batches = list(db.stream(conn, "SELECT i FROM generate_series(1, %s) AS i ORDER BY i;", (25,), rows=10))
+        assert [len(batch) for batch in batches] == [10, 10, 5]
+        assert [row[0] for batch in batches for row in batch] == list(range(1, 26))
+        assert list(db.stream(conn, "SELECT 1 WHERE false;")) == []
+
+
+def test_insert_values_pages_rows(postgres):
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("CREATE TABLE t (id int PRIMARY KEY, name text);")
+        rows = ((i, f"name {i}") for i in range(23))
+        assert db.insert_values(cursor, "INSERT INTO t (id, name) VALUES %s;", rows, page_size=10) == 23
+        assert db.insert_values(cursor, "INSERT INTO t (id, name) VALUES %s ON CONFLICT DO NOTHING;",
+                                [(1, "x"), (100, "y")], template="(%s, %s)") == 1
+        update = "UPDATE t SET name = v.name FROM (VALUES %s) AS v (id, name) WHERE t.id = v.id;"
+        assert db.insert_values(cursor, update, [(i, "renamed") for i in range(0, 30, 3)], page_size=4) == 8
+        cursor.execute("SELECT count(*), count(*) FILTER (WHERE name = 'renamed') FROM t;")
+        assert cursor.fetchone() == (24, 8)
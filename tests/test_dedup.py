@@ -0,0 +1,90 @@
+import random
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from hotel_ibs.dedup import candidate_pairs, find_near_duplicates, group_duplicates, hamming
+
+
+def photo(seed, size=(320, 240)):
+    """A smooth random picture, like a blurred photo: distinct seeds give unrelated images."""
+    rng = np.random.default_rng(seed)
+    coarse = rng.uniform(0, 255, (6, 8, 3)).astype(np.uint8)
+    return Image.fromarray(coarse).resize(size, Image.BICUBIC)
+
+
+@pytest.fixture
+def images(tmp_path):
+    """(image_id, path) items with three copies of picture 0, two of picture 1, then unrelated pictures."""
+    items = []
+
+    def save(image_id, image, **kwargs):
+        path = str(tmp_path / f"{image_id}.jpg")
+        image.save(path, **kwargs)
+        items.append((image_id, path))
+
+    save(1, photo(0), quality=95)
+    save(2, photo(1), quality=95)
+    save(3, photo(0).resize((160, 120), Image.LANCZOS), quality=95)  # a thumbnail
+    save(4, photo(0), quality=40)  # re-encoded
+    save(5, photo(1).resize((640, 480), Image.BICUBIC), quality=70)  # an upscaled copy
+    for image_id in range(6, 26):
+        save(image_id, photo(image_id + 100), quality=90)
+    (tmp_path / "26.jpg").write_bytes(b"not an image")
+    items.append((26, str(tmp_path / "26.jpg")))
+    return items
+
+
+def test_copies_share_one_canonical_image(images, tmp_path):
+    canonical, duplicates, stats = find_near_duplicates(images, workers=1, cache_path=str(tmp_path / "hashes.db"))
+    assert duplicates == {1: [3, 4], 2: [5]}
+    assert [image_id for image_id, _ in canonical] == [1, 2] + list(range(6, 27))  # the unreadable one stays
+    assert (stats["images"], stats["duplicates"], stats["unreadable"]) == (26, 3, 1)
+
+
+def test_grouping_is_deterministic_and_follows_input_order(images, tmp_path):
+    cache_path = str(tmp_path / "hashes.db")
+    first = find_near_duplicates(images, workers=1, cache_path=cache_path)[:2]
+    assert find_near_duplicates(images, workers=1, cache_path=cache_path)[:2] == first  # from the cache
+    assert find_near_duplicates(images, workers=2, cache_path=None)[:2] == first
+
+    # The earliest copy is canonical, whatever the order
+    reordered = [images[3]] + [item for item in images if item != images[3]]
+    assert find_near_duplicates(reordered, workers=1, cache_path=cache_path)[1] == {4: [1, 3], 2: [5]}
+    assert find_near_duplicates(images, radius=0, workers=1, cache_path=cache_path)[1] == {}
+
+
+def brute_force_pairs(hashes, radius):
+    return {(i, j) for i in range(len(hashes)) for j in range(i + 1, len(hashes))
+            if bin(int(hashes[i]) ^ int(hashes[j])).count("1") <= radius}
+
+
+def flip(value, bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+@pytest.mark.parametrize("radius", [1, 4, 8])
+def test_candidate_pairs_match_all_pairs(radius):
+    rng = random.Random(radius)
+    hashes = [rng.getrandbits(64) for _ in range(60)]
+    # Close variants of a few hashes, some exactly at the radius
+    hashes += [flip(hashes[i], rng.sample(range(64), rng.randint(0, radius + 1))) for i in range(0, 60, 3)]
+    hashes = np.array(hashes, dtype=np.uint64)
+    assert set(map(tuple, candidate_pairs(hashes, radius).tolist())) == brute_force_pairs(hashes, radius)
+
+
+def test_groups_do_not_chain_across_distant_images():
+    base = random.Random(1).getrandbits(64)
+    # b is close to a and c, but a and c are 8 bits apart
+    a, b, c = base, flip(base, range(4)), flip(base, range(8))
+    phash = np.array([a, b, c, a, c], dtype=np.uint64)
+    dhash = np.zeros(5, dtype=np.uint64)
+    assert group_duplicates(phash, dhash, radius=4).tolist() == [0, 0, 2, 0, 2]
+
+    # Both hashes must be close
+    dhash = np.array([0, 0, 0, 0, 0xFFFF], dtype=np.uint64)
+    assert group_duplicates(phash, dhash, radius=4, dhash_radius=8).tolist() == [0, 0, 2, 0, 4]
+    assert hamming(phash[:1], phash[2:3]).tolist() == [8]
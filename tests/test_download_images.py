@@ -0,0 +1,210 @@
+import asyncio
+import os
+import threading
+import time
+
+import aiohttp
+import pandas as pd
+import pytest
+from aiohttp import web
+
+PHOTO_BYTES = 200 * 1024  # several DOWNLOAD_CHUNK_BYTES chunks per photo
+PHOTOS_PER_PLACE = 3
+
+
+class PlacesStandIn:
+    """Google Places find/details/photo endpoints with switchable failures; records every request."""
+
+    def __init__(self):
+        self.requests = []  # (path, params, monotonic time)
+        self.rate_limited = set()  # hotel names answered with one 429 before succeeding
+        self.refused = set()  # photo references answered with 403
+        self.missing_details = set()  # place ids answered with 404
+        self.generation = 0  # photo references change between runs, as Google's expire
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/findplacefromtext/json", self.find_place)
+        app.router.add_get("/details/json", self.details)
+        app.router.add_get("/photo", self.photo)
+        return app
+
+    def record(self, request):
+        self.requests.append((request.path, dict(request.query), time.monotonic()))
+
+    def count(self, path):
+        return sum(1 for request_path, _, _ in self.requests if request_path == path)
+
+    async def find_place(self, request):
+        self.record(request)
+        name = request.query["input"]
+        if name in self.rate_limited:
+            self.rate_limited.discard(name)
+            return web.json_response({"status": "OVER_QUERY_LIMIT"}, status=429)
+        return web.json_response({"candidates": [{"place_id": f"place-{name}"}]})
+
+    async def details(self, request):
+        self.record(request)
+        place_id = request.query["place_id"]
+        if place_id in self.missing_details:
+            return web.json_response({"status": "NOT_FOUND"}, status=404)
+        photos = [{"photo_reference": f"{place_id}-{i}-gen{self.generation}"} for i in range(PHOTOS_PER_PLACE)]
+        return web.json_response({"result": {"photos": photos}})
+
+    async def photo(self, request):
+        self.record(request)
+        reference = request.query["photo_reference"]
+        if reference in self.refused:
+            return web.Response(status=403)
+        response = web.StreamResponse()
+        response.content_length = PHOTO_BYTES
+        await response.prepare(request)
+        body = photo_body(reference)
+        for start in range(0, PHOTO_BYTES, 50 * 1024):
+            await response.write(body[start:start + 50 * 1024])
+        return response
+
+
+def photo_body(reference):
+    body = (reference.encode() + b"|") * (PHOTO_BYTES // (len(reference) + 1) + 1)
+    return body[:PHOTO_BYTES]
+
+
+@pytest.fixture
+def downloader(load_script, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # images/ and the log file are relative paths
+    module = load_script("00_2_download_images_from_google.py")
+    monkeypatch.setattr(module, "DOWNLOAD_LEDGER_PATH", str(tmp_path / "ledger.sqlite"))
+    monkeypatch.setattr(module, "DOWNLOAD_RATE", 1000.0)
+    monkeypatch.setattr(module, "DOWNLOAD_BURST", 1000)
+    return module
+
+
+@pytest.fixture
+def places_api(downloader, monkeypatch):
+    """The stand-in server on its own event loop thread, with the downloader pointed at it."""
+    stand_in = PlacesStandIn()
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(stand_in.app())
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", 0).start())
+    base_url = "http://127.0.0.1:%d" % runner.addresses[0][1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    monkeypatch.setattr(downloader, "PLACES_API_URL", f"{base_url}/findplacefromtext/json")
+    monkeypatch.setattr(downloader, "PLACE_DETAILS_URL", f"{base_url}/details/json")
+    monkeypatch.setattr(downloader, "PHOTO_API_URL", f"{base_url}/photo")
+    yield stand_in
+
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def write_hotels(path, hotels):
+    pd.DataFrame(hotels, columns=["hotel_id", "hotel_name", "chain_id", "latitude", "longitude"]).to_csv(
+        path, index=False)
+
+
+def requests_count(downloader, result):
+    return downloader.PLACES_REQUESTS.values.get((result,), 0)
+
+
+def test_token_bucket_paces_requests(downloader):
+    bucket = downloader.TokenBucket(rate=50, capacity=5)
+
+    async def acquire_all():
+        start = time.monotonic()
+        for _ in range(30):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    # The burst is free, the other 25 acquisitions wait 1/50 s each
+    assert asyncio.run(acquire_all()) >= 25 / 50 * 0.9
+
+
+def test_download_all_respects_rate_limit(downloader, places_api, monkeypatch):
+    monkeypatch.setattr(downloader, "DOWNLOAD_RATE", 40.0)
+    monkeypatch.setattr(downloader, "DOWNLOAD_BURST", 1)
+    ledger = downloader.DownloadLedger(downloader.DOWNLOAD_LEDGER_PATH)
+    hotels = [(hotel_id, f"Hotel {hotel_id}", "1", 1.0, 2.0) for hotel_id in range(1, 4)]
+
+    stats = asyncio.run(downloader.download_all(hotels, ledger))
+
+    assert stats == {"hotels": 3, "photos": 3 * PHOTOS_PER_PLACE, "errors": 0}
+    times = sorted(request_time for _, _, request_time in places_api.requests)
+    assert len(times) == 3 * (2 + PHOTOS_PER_PLACE)
+    assert times[-1] - times[0] >= (len(times) - 1) / 40 * 0.9
+
+
+def test_retries_429_then_succeeds(downloader, places_api):
+    places_api.rate_limited.add("Busy Hotel")
+    rate_limited, ok = requests_count(downloader, "rate_limited"), requests_count(downloader, "ok")
+
+    async def find():
+        async with aiohttp.ClientSession() as session:
+            client = downloader.PlacesClient(session, downloader.TokenBucket(1000, 1000))
+            return await client.get_place_id("Busy Hotel", 1.0, 2.0)
+
+    assert asyncio.run(find()) == "place-Busy Hotel"
+    assert places_api.count("/findplacefromtext/json") == 2
+    assert requests_count(downloader, "rate_limited") == rate_limited + 1
+    assert requests_count(downloader, "ok") == ok + 1
+
+
+def test_permanent_4xx_is_not_retried(downloader, places_api):
+    places_api.missing_details.add("place-gone")
+    errors, ok = requests_count(downloader, "error"), requests_count(downloader, "ok")
+
+    async def details():
+        async with aiohttp.ClientSession() as session:
+            client = downloader.PlacesClient(session, downloader.TokenBucket(1000, 1000))
+            return await client.get_hotel_photos("place-gone")
+
+    with pytest.raises(aiohttp.ClientResponseError) as raised:
+        asyncio.run(details())
+    assert raised.value.status == 404
+    assert places_api.count("/details/json") == 1
+    assert requests_count(downloader, "error") == errors + 1
+    assert requests_count(downloader, "ok") == ok
+
+
+def test_photos_stream_to_disk(downloader, places_api, tmp_path):
+    write_hotels(tmp_path / "hotels.csv", [(7, "Sea View", 3, 1.0, 2.0)])
+    downloaded_bytes = downloader.DOWNLOAD_BYTES.values.get((), 0)
+
+    downloader.process_csv(tmp_path / "hotels.csv", output_csv=tmp_path / "images.csv")
+
+    records = pd.read_csv(tmp_path / "images.csv")
+    assert list(records["hotel_id"]) == [7] * PHOTOS_PER_PLACE
+    for i, (image_id, image_url) in enumerate(zip(records["image_id"], records["image_url"])):
+        assert image_url == os.path.join("images", "3", "7", f"{image_id}.jpg")
+        with open(tmp_path / image_url, "rb") as f:
+            assert f.read() == photo_body(f"place-Sea View-{i}-gen0")
+    assert not list((tmp_path / "images" / "3" / "7").glob("*.part"))
+    assert downloader.DOWNLOAD_BYTES.values.get((), 0) == downloaded_bytes + PHOTOS_PER_PLACE * PHOTO_BYTES
+
+
+def test_rerun_resumes_with_the_same_image_ids(downloader, places_api, tmp_path):
+    write_hotels(tmp_path / "hotels.csv", [(1, "Alpha", 1, 1.0, 2.0), (2, "Beta", 1, 1.0, 2.0)])
+    places_api.refused.add("place-Beta-1-gen0")
+
+    downloader.process_csv(tmp_path / "hotels.csv", output_csv=tmp_path / "first.csv")
+    first = pd.read_csv(tmp_path / "first.csv")
+    assert len(first) == 2 * PHOTOS_PER_PLACE - 1  # Beta's second photo was refused
+
+    # Second run: Alpha is finished and skipped; Beta's photos come with fresh references
+    places_api.requests.clear()
+    places_api.generation = 1
+    downloader.process_csv(tmp_path / "hotels.csv", output_csv=tmp_path / "second.csv")
+    second = pd.read_csv(tmp_path / "second.csv")
+
+    assert places_api.count("/findplacefromtext/json") == 0  # Beta's place id is in the ledger
+    assert places_api.count("/details/json") == 1
+    assert [params["photo_reference"] for path, params, _ in places_api.requests if path == "/photo"] == [
+        "place-Beta-1-gen1"]
+    assert list(second.set_index("image_id").loc[first["image_id"], "image_url"]) == list(first["image_url"])
+    assert sorted(second["image_id"]) == list(range(1, 2 * PHOTOS_PER_PLACE + 1))
+    assert set(second["image_id"]) - set(first["image_id"]) == {PHOTOS_PER_PLACE + 2}
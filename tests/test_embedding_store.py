@@ -0,0 +1,128 @@
+import os
+
+import numpy as np
+import pytest
+
+from hotel_ibs import db
+from hotel_ibs.embedding_store import EmbeddingStore
+from hotel_ibs.tag_bitmaps import DB_CONFIDENCE_SCALE
+from hotel_ibs.tagging import normalize_rows, top_k_tags, vocabulary_hash
+
+DIM = 16
+
+
+def random_rows(n, seed=0):
+    return normalize_rows(np.random.default_rng(seed).normal(size=(n, DIM)))
+
+
+@pytest.fixture
+def store(tmp_path):
+    """A store holding images 1-10 with image 3 appended twice; returns (store, latest rows by image_id)."""
+    store = EmbeddingStore(str(tmp_path / "store"), dim=DIM)
+    rows = random_rows(11)
+    store.append(list(range(1, 11)), rows[:10])
+    store.append([3], rows[10:])
+    return store, {str(image_id): row for image_id, row in zip(list(range(1, 11)) + [3], rows)}
+
+
+def check(store, expected):
+    assert len(store) == len(expected) and set(store.rows) == set(expected)
+    assert store.get(list(expected)) == pytest.approx(np.stack(list(expected.values())), abs=1e-3)
+    image_ids = [image_id for chunk, _ in store.iter_chunks(chunk_size=4) for image_id in chunk]
+    assert sorted(image_ids) == sorted(expected)
+
+
+def test_latest_row_wins_across_reopens(store):
+    store, expected = store
+    check(store, expected)
+    reopened = EmbeddingStore(store.path)
+    check(reopened, expected)
+    assert len(reopened.image_ids) == 11 and reopened.rows["3"] == 10
+    with pytest.raises(ValueError):
+        EmbeddingStore(store.path, dim=DIM + 1)
+
+
+def torn_sizes(store):
+    return os.path.getsize(store.matrix_path), open(store.ids_path).read().count("\n")
+
+
+@pytest.mark.parametrize("tear", ["orphan_rows", "truncated_row", "ids_past_matrix"])
+def test_torn_append_is_repaired_on_open(store, tear):
+    store, expected = store
+    row_bytes = DIM * 2
+    if tear == "orphan_rows":  # crash after writing the matrix, before the ids
+        with open(store.matrix_path, "ab") as f:
+            f.write(random_rows(2, seed=1).astype(np.float16).tobytes())
+    elif tear == "truncated_row":  # crash in the middle of a matrix write
+        with open(store.matrix_path, "ab") as f:
+            f.write(random_rows(1, seed=1).astype(np.float16).tobytes()[:row_bytes // 2 + 3])
+    else:  # a sidecar longer than the matrix, e.g. copied from another store
+        with open(store.ids_path, "a") as f:
+            f.write("11\n12\n")
+
+    repaired = EmbeddingStore(store.path)
+    check(repaired, expected)
+    assert torn_sizes(repaired) == (11 * row_bytes, 11)
+
+    # Appends after the repair line up again
+    repaired.append([11, 5], random_rows(2, seed=2))
+    expected.update(zip(["11", "5"], random_rows(2, seed=2)))
+    check(EmbeddingStore(store.path), expected)
+    assert torn_sizes(repaired) == (13 * row_bytes, 13)
+
+
+def test_extend_copies_only_the_latest_rows(store, tmp_path):
+    store, expected = store
+    merged = EmbeddingStore(str(tmp_path / "merged"), dim=DIM)
+    assert merged.extend(store, chunk_size=3) == 10
+    check(merged, expected)
+    with pytest.raises(ValueError):
+        merged.append([1, 2], random_rows(1))
+
+
+def stored_tags(image_ids):
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT image_tags.image_id, tags.tag_name, image_tags.confidence_q
+            FROM image_tags JOIN tags USING (tag_id)
+            WHERE image_tags.image_id = ANY(%s);
+        """, (list(image_ids),))
+        tags = {}
+        for image_id, tag_name, confidence_q in cursor.fetchall():
+            tags.setdefault(image_id, {})[tag_name] = confidence_q
+        return tags
+
+
+def test_rescore_replaces_tags_with_the_new_vocabulary(search_db, run_script, tmp_path):
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT image_id FROM image_tags GROUP BY image_id ORDER BY image_id LIMIT 25;")
+        image_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT max(image_id) + 1000 FROM images;")
+        missing_id = cursor.fetchone()[0]
+    untouched = stored_tags(image_ids[20:])
+
+    # New names next to ones already in the tags table
+    texts = ["rooftop cinema", "pool", "sauna with a view", "lobby", "chef's table"]
+    vocabulary_path = tmp_path / "vocabulary.txt"
+    vocabulary_path.write_text("\n".join(texts) + "\n\n", encoding="utf-8")
+    text_features = random_rows(len(texts), seed=3)
+    cache_dir = tmp_path / "text_embeddings"
+    cache_dir.mkdir()
+    np.save(cache_dir / f"{vocabulary_hash('ViT-B/32', texts)}.npy", text_features)
+
+    store = EmbeddingStore(str(tmp_path / "store"), dim=DIM)
+    embeddings = random_rows(21, seed=4)
+    store.append(image_ids[:20] + [missing_id], embeddings)  # the last image is not in the database
+
+    run_script("06_rescore_tags.py", search_db, VOCABULARY_PATH=str(vocabulary_path),
+               EMBEDDING_STORE_DIR=store.path, TEXT_EMBEDDING_CACHE_DIR=str(cache_dir),
+               RESCORE_TOP_K="3", RESCORE_CHUNK_SIZE="6")
+
+    expected = top_k_tags(store.get(image_ids[:20]), text_features, texts, top_k=3)  # the float16 rows
+    found = stored_tags(image_ids + [missing_id])
+    assert set(found) == set(image_ids)
+    for image_id, tags in zip(image_ids, expected):
+        assert found[image_id].keys() == tags.keys()
+        for tag, score in tags.items():
+            assert abs(found[image_id][tag] - score * DB_CONFIDENCE_SCALE) <= 0.5
+    assert {image_id: found[image_id] for image_id in image_ids[20:]} == untouched
@@ -0,0 +1,49 @@
+import os
+from decimal import Decimal
+
+import pandas as pd
+
+from hotel_ibs import db
+
+SCRIPT = "05_generate_availability_and_pricing.py"
+JANUARY = {"CALENDAR_START": "2025-01-01", "CALENDAR_END": "2025-01-31", "CALENDAR_SEED": "0"}
+
+
+def database_calendar():
+    """{(hotel_id, date): (availability, price, currency)} of availability_price."""
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT hotel_id, date, availability, price, currency FROM availability_price;")
+        return {(hotel_id, night): (availability, price, currency)
+                for hotel_id, night, availability, price, currency in cursor.fetchall()}
+
+
+def clear_calendar():
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("DELETE FROM availability_price;")
+
+
+def test_calendar_does_not_depend_on_the_chunk_size(search_db, run_script, tmp_path):
+    # search_db generated January in one chunk
+    calendar = database_calendar()
+    hotels = len(pd.read_csv(os.path.join(search_db, "scripts", "hotel_info.csv"))["hotel_id"].unique())
+    assert len(calendar) == hotels * 31
+
+    clear_calendar()
+    parquet_path = str(tmp_path / "calendar.parquet")
+    run_script(SCRIPT, search_db, CALENDAR_CHUNK_ROWS="100", CALENDAR_PARQUET_PATH=parquet_path, **JANUARY)
+    assert database_calendar() == calendar
+
+    # The Parquet copy holds the same rows as the COPY into the database
+    frame = pd.read_parquet(parquet_path)
+    assert list(frame.columns) == ["hotel_id", "date", "availability", "price", "currency"]
+    copied = {(int(row.hotel_id), row.date.date()): (int(row.availability), Decimal(f"{row.price:.2f}"), row.currency)
+              for row in frame.itertuples(index=False)}
+    assert len(frame) == len(copied) and copied == calendar
+
+    # Parquet only, in chunks of a few nights of a single hotel
+    clear_calendar()
+    only_parquet = str(tmp_path / "only.parquet")
+    run_script(SCRIPT, search_db, CALENDAR_CHUNK_ROWS="7", CALENDAR_PARQUET_PATH=only_parquet,
+               CALENDAR_WRITE_DB="0", **JANUARY)
+    assert database_calendar() == {}
+    assert pd.read_parquet(only_parquet).equals(frame)
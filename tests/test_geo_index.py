@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from backend.geo_index import GeoIndex, haversine_km
+
+
+@pytest.fixture(scope="module")
+def hotels():
+    rng = np.random.default_rng(16)
+    latitudes = np.concatenate([rng.uniform(-89.9, 89.9, 3000), rng.uniform(-1, 1, 500), rng.uniform(88, 89.9, 200)])
+    longitudes = np.concatenate([rng.uniform(-180, 180, 3000), rng.uniform(179, 180, 250),
+                                 rng.uniform(-180, -179, 250), rng.uniform(-180, 180, 200)])
+    return [(hotel_id, lat, lon) for hotel_id, (lat, lon) in enumerate(zip(latitudes, longitudes))]
+
+
+@pytest.fixture(scope="module")
+def index(hotels):
+    return GeoIndex().build(hotels + [(99999, None, None)])
+
+
+def brute_force_radius(hotels, lat, lon, radius_km):
+    ids = np.array([hotel[0] for hotel in hotels])
+    latitudes, longitudes = np.array([hotel[1] for hotel in hotels]), np.array([hotel[2] for hotel in hotels])
+    distances = haversine_km(lat, lon, latitudes, longitudes)
+    return dict(zip(ids[distances <= radius_km].tolist(), distances[distances <= radius_km].tolist()))
+
+
+def test_hotels_without_coordinates_are_left_out(index, hotels):
+    assert len(index) == len(hotels)
+
+
+def test_haversine_known_distance():
+    # Paris to London, about 344 km
+    assert haversine_km(48.8566, 2.3522, np.array([51.5074]), np.array([-0.1278]))[0] == pytest.approx(343.5, abs=1)
+
+
+@pytest.mark.parametrize("lat, lon, radius_km", [
+    (0.0, 0.0, 50),
+    (0.5, 179.9, 120),  # circle crossing the antimeridian
+    (0.0, -179.95, 30),
+    (89.5, 10.0, 100),  # circle containing the north pole
+    (45.0, 7.0, 2000),
+    (-30.0, 150.0, 0.5),
+])
+def test_within_radius_matches_brute_force(index, hotels, lat, lon, radius_km):
+    found = index.within_radius(lat, lon, radius_km)
+    expected = brute_force_radius(hotels, lat, lon, radius_km)
+    assert found.keys() == expected.keys()
+    for hotel_id, distance in found.items():
+        assert distance == pytest.approx(expected[hotel_id])
+
+
+@pytest.mark.parametrize("south, west, north, east", [
+    (-1.0, -1.0, 1.0, 1.0),
+    (-1.0, 179.5, 1.0, -179.5),  # viewport crossing the antimeridian
+    (88.0, -180.0, 90.0, 180.0),
+    (-90.0, -180.0, 90.0, 180.0),
+])
+def test_within_bbox_matches_brute_force(index, hotels, south, west, north, east):
+    if west <= east:
+        expected = {h for h, lat, lon in hotels if south <= lat <= north and west <= lon <= east}
+    else:
+        expected = {h for h, lat, lon in hotels if south <= lat <= north and (lon >= west or lon <= east)}
+    assert index.within_bbox(south, west, north, east) == expected
@@ -0,0 +1,60 @@
+import hashlib
+import os
+
+from PIL import Image
+
+from hotel_ibs import image_manifest
+from hotel_ibs.image_manifest import ImageManifest, examine
+
+
+def save_image(path, size, format="JPEG", comment=b""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.new("RGB", size, (200, 120, 40)).save(path, format=format, **({"comment": comment} if comment else {}))
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def blake2b(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def test_examine_hashes_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_manifest, "HASH_CHUNK_BYTES", 1000)
+    data = save_image(str(tmp_path / "a.jpg"), (640, 480))
+    data += os.urandom(50_000)  # trailing bytes after the end of image still count for the hash
+    (tmp_path / "a.jpg").write_bytes(data)
+
+    assert examine(str(tmp_path / "a.jpg")) == (str(tmp_path / "a.jpg"), 640, 480, blake2b(data), None)
+
+
+def test_examine_falls_back_to_pil_past_the_header(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_manifest, "HEADER_BYTES", 64)
+    data = save_image(str(tmp_path / "b.jpg"), (33, 17), comment=b"x" * 500)  # COM segment before the frame
+    assert image_manifest.jpeg_size(data[:64]) is None
+
+    assert examine(str(tmp_path / "b.jpg"))[1:] == (33, 17, blake2b(data), None)
+
+
+def test_examine_reports_unreadable_files(tmp_path):
+    (tmp_path / "broken.jpg").write_bytes(b"not an image")
+
+    path, width, height, content_hash, error = examine(str(tmp_path / "broken.jpg"))
+    assert (width, height, content_hash) == (None, None, None)
+    assert error
+
+
+def test_update_only_examines_changed_files(tmp_path):
+    root = tmp_path / "images"
+    save_image(str(root / "1" / "10" / "100.jpg"), (20, 10))
+    save_image(str(root / "1" / "10" / "101.png"), (30, 15), format="PNG")
+    manifest = ImageManifest(str(tmp_path / "manifest.sqlite"))
+
+    assert manifest.update(str(root), workers=1)["examined"] == 2
+    stats = manifest.update(str(root), workers=1)
+    assert (stats["unchanged"], stats["examined"]) == (2, 0)
+
+    save_image(str(root / "1" / "10" / "100.jpg"), (40, 20))
+    os.remove(root / "1" / "10" / "101.png")
+    stats = manifest.update(str(root), workers=1)
+    assert (stats["examined"], stats["removed"], stats["failed"]) == (1, 1, 0)
+    assert manifest.conn.execute("SELECT width, height FROM images").fetchall() == [(40, 20)]
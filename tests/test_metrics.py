@@ -0,0 +1,76 @@
+import pytest
+
+from hotel_ibs import metrics
+from hotel_ibs.metrics import Registry
+
+
+def test_counters_and_gauges_render_in_prometheus_format():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests", ["endpoint"])
+    requests.inc(endpoint="/api/images")
+    requests.inc(2, endpoint="/api/images")
+    requests.inc(endpoint='say "hi"\n')
+    registry.gauge("entries", "Entries", function=lambda: 7)
+
+    assert registry.render().splitlines() == [
+        "# HELP entries Entries",
+        "# TYPE entries gauge",
+        "entries 7",
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{endpoint="/api/images"} 3',
+        'requests_total{endpoint="say \\"hi\\"\\n"} 1',
+    ]
+
+
+def test_registry_returns_the_registered_metric():
+    registry = Registry()
+    assert registry.counter("a", "A") is registry.counter("a", "A")
+    with pytest.raises(ValueError):
+        registry.gauge("a", "A")
+
+
+def test_failing_gauge_does_not_break_the_scrape():
+    registry = Registry()
+    registry.gauge("broken", "Broken", function=lambda: 1 / 0)
+    registry.counter("ok", "Ok").inc()
+    text = registry.render()
+    assert "# broken unavailable: ZeroDivisionError" in text and "ok 1" in text
+    assert "error" in registry.summary()["broken"]["values"]
+
+
+def test_histogram_buckets_and_quantiles():
+    registry = Registry()
+    histogram = registry.histogram("latency", "Latency", buckets=(0.1, 1))
+    for value in [0.05] * 50 + [0.5] * 45 + [3.0] * 5:
+        histogram.observe(value)
+
+    lines = registry.render().splitlines()
+    assert lines[2:] == [
+        'latency_bucket{le="0.1"} 50', 'latency_bucket{le="1"} 95', 'latency_bucket{le="+Inf"} 100',
+        "latency_sum 40.0", "latency_count 100",
+    ]
+    [summary] = histogram.summary()
+    assert (summary["count"], summary["mean"], summary["max"]) == (100, 0.4, 3.0)
+    assert summary["p50"] == pytest.approx(0.1)
+    assert 0.1 < summary["p95"] <= 1 and 1 < summary["p99"] <= 3.0
+
+
+def test_timed_batch_records_items_and_errors():
+    with metrics.timed_batch("test_ok", items=3) as batch:
+        batch["items"] = 4
+        batch["errors"] = 1
+    assert metrics.stage_summary()["test_ok"]["items"] == 4
+    assert metrics.stage_summary()["test_ok"]["errors"] == 1
+
+
+def test_timed_batch_counts_a_failed_batch_and_reraises():
+    with pytest.raises(RuntimeError):
+        with metrics.timed_batch("test_failing", items=5):
+            raise RuntimeError("database went away")
+    with pytest.raises(KeyError):
+        with metrics.timed_batch("test_failing"):
+            raise KeyError("no items known yet")
+
+    stage = metrics.stage_summary()["test_failing"]
+    assert (stage["batches"], stage["items"], stage["errors"]) == (2, 0, 6)
@@ -0,0 +1,121 @@
+import json
+
+import pytest
+
+from hotel_ibs import db
+
+TAG_QUERY = """
+    SELECT image_id, confidence_q FROM image_tags
+    WHERE tag_id = %s AND confidence_q >= %s
+    ORDER BY confidence_q DESC, image_id
+    LIMIT 100;
+"""
+
+
+def plan_indexes(query, params):
+    """Names of the indexes read by the plan of query, with the default planner settings and fresh statistics."""
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+        plan = cursor.fetchone()[0]
+        conn.rollback()
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+
+    def walk(node):
+        names = {node["Index Name"]} if "Index Name" in node else set()
+        for child in node.get("Plans", []):
+            names |= walk(child)
+        return names
+    return walk(plan[0]["Plan"])
+
+
+def analyze():
+    with db.connection() as conn:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("ANALYZE;")
+        conn.autocommit = False
+
+
+def test_tag_query_uses_tag_confidence_index(search_db):
+    analyze()
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT tag_id FROM image_tags GROUP BY tag_id ORDER BY count(*) DESC, tag_id LIMIT 1;")
+        tag_id = cursor.fetchone()[0]
+    assert "idx_image_tags_tag_confidence" in plan_indexes(TAG_QUERY, (tag_id, 1638))
+
+
+def test_substring_query_uses_trigram_index(search_db, load_script):
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('idx_tags_tag_name_trgm') IS NOT NULL;")
+        if not cursor.fetchone()[0]:
+            pytest.skip("pg_trgm is not available on this server: search_db has no trigram index")
+    # A vocabulary the size of a real deployment's, so that scanning it is not the cheapest plan
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO tags (tag_name) SELECT 'generated tag ' || md5(i::text) FROM generate_series(1, 20000) i;
+        """)
+    analyze()
+    _, query, params, _ = next(q for q in load_script("09_migrate_schema.py").SEARCH_QUERIES if q[0] == "tag search")
+    assert {"idx_tags_tag_name_trgm", "idx_image_tags_tag_confidence"} <= plan_indexes(query, params)
+
+
+def test_invalid_index_is_rebuilt_before_the_migration_is_recorded(postgres, load_script):
+    migrations = load_script("09_migrate_schema.py")
+    migrations.MIGRATIONS = [m for m in migrations.MIGRATIONS if m[0] in (3, 9)]
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE images (image_id INT PRIMARY KEY, hotel_id INT, image_url TEXT);
+            CREATE TABLE image_tags (image_id INT, tag_id SMALLINT, confidence_q SMALLINT);
+            -- What an interrupted CREATE INDEX CONCURRENTLY leaves behind
+            CREATE INDEX idx_images_hotel_id ON images (hotel_id);
+            UPDATE pg_index SET indisvalid = false WHERE indexrelid = 'idx_images_hotel_id'::regclass;
+        """)
+
+    migrations.migrate()
+
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT indexrelid::regclass::text, indisvalid, pg_get_indexdef(indexrelid) FROM pg_index
+            WHERE indrelid IN ('images'::regclass, 'image_tags'::regclass) AND NOT indisprimary ORDER BY 1;
+        """)
+        indexes = cursor.fetchall()
+        cursor.execute("SELECT version FROM schema_migrations ORDER BY version;")
+        assert cursor.fetchall() == [(3,), (9,)]
+    assert [(name, valid) for name, valid, _ in indexes] == [
+        ("idx_image_tags_tag_confidence", True), ("idx_images_hotel_id", True)]
+    assert "INCLUDE (image_id, image_url)" in indexes[1][2]  # built again from the migration's definition
+
+
+def test_legacy_image_tags_are_compacted(postgres, load_script):
+    migrations = load_script("09_migrate_schema.py")
+    migrations.MIGRATIONS = [m for m in migrations.MIGRATIONS if m[0] in (5, 8, 9)]
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE images (image_id INT PRIMARY KEY, hotel_id INT, image_url TEXT);
+            INSERT INTO images SELECT i, 1, 'x' FROM generate_series(1, 3) i;
+            CREATE TABLE image_tags (
+                image_id INT REFERENCES images(image_id), tag_name TEXT, confidence_score FLOAT,
+                tagged_at TIMESTAMPTZ NOT NULL DEFAULT now(), PRIMARY KEY (image_id, tag_name)
+            );
+            CREATE INDEX idx_image_tags_tag_confidence ON image_tags (tag_name, confidence_score DESC, image_id);
+            INSERT INTO image_tags (image_id, tag_name, confidence_score) VALUES
+                (1, 'pool', 0.5), (1, 'gym', NULL), (2, 'pool', 1.0), (3, 'chef''s table', 0.25);
+        """)
+
+    migrations.migrate()
+
+    with db.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'image_tags' ORDER BY ordinal_position;
+        """)
+        assert [row[0] for row in cursor.fetchall()] == ["image_id", "tagged_at", "tag_id", "confidence_q"]
+        cursor.execute("""
+            SELECT image_tags.image_id, tags.tag_name, image_tags.confidence_q
+            FROM image_tags JOIN tags ON tags.tag_id = image_tags.tag_id ORDER BY 1, 2;
+        """)
+        assert cursor.fetchall() == [(1, "gym", 0), (1, "pool", 16384), (2, "pool", 32767), (3, "chef's table", 8192)]
+        cursor.execute("SELECT pg_get_indexdef('idx_image_tags_tag_confidence'::regclass);")
+        assert "(tag_id, confidence_q DESC, image_id)" in cursor.fetchone()[0]
+        cursor.execute("SELECT pg_get_constraintdef(oid) FROM pg_constraint WHERE conname = 'image_tags_pkey';")
+        assert cursor.fetchone()[0] == "PRIMARY KEY (image_id, tag_id)"
@@ -0,0 +1,74 @@
+import pytest
+
+from backend import search_cache
+from backend.search_cache import LocalBackend, SearchCache
+
+
+def test_key_depends_on_versions_not_dict_order():
+    key = SearchCache.key("images", {"tag": "pool", "limit": 10}, {"tags": 1, "prices": 2})
+    assert key == SearchCache.key("images", {"limit": 10, "tag": "pool"}, {"prices": 2, "tags": 1})
+    assert key != SearchCache.key("images", {"tag": "pool", "limit": 10}, {"tags": 2, "prices": 2})
+    assert key != SearchCache.key("semantic", {"tag": "pool", "limit": 10}, {"tags": 1, "prices": 2})
+
+
+def test_round_trip_with_headers():
+    cache = SearchCache(url=None)
+    cache.put("k", b'{"images": []}\n', {"X-Next-Cursor": "abc"})
+
+    assert cache.get("k") == (b'{"images": []}\n', {"X-Next-Cursor": "abc"})
+    assert cache.get("other") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_lru_is_bounded_by_entries_and_bytes():
+    backend = LocalBackend(max_entries=3, max_bytes=100)
+    for key in "abc":
+        backend.put(key, b"x" * 10, 60)
+    backend.get("a")  # most recently used
+    backend.put("d", b"x" * 10, 60)
+    assert set(backend.entries) == {"a", "c", "d"}
+
+    backend.put("e", b"x" * 90, 60)
+    assert set(backend.entries) == {"d", "e"} and backend.nbytes == 100
+    backend.put("f", b"x" * 101, 60)  # larger than the whole cache: not stored
+    assert "f" not in backend.entries
+    assert backend.evictions == 3
+
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(search_cache.time, "time", lambda: now[0])
+    cache = SearchCache(url=None, ttl_seconds=5)
+    cache.put("k", b"body")
+    now[0] += 4
+    assert cache.get("k") is not None
+    now[0] += 2
+    assert cache.get("k") is None
+    assert len(cache.backend) == 0
+
+
+def test_invalidate_clears_local_entries():
+    cache = SearchCache(url=None)
+    cache.put("k", b"body")
+    cache.invalidate()
+    assert cache.get("k") is None
+    assert cache.stats()["invalidations"] == 1
+
+
+class BrokenBackend:
+    def get(self, key):
+        raise ConnectionError("redis is down")
+
+    put = get
+
+    def stats(self):
+        return {}
+
+
+def test_failing_backend_counts_as_miss():
+    cache = SearchCache(url=None)
+    cache.backend = BrokenBackend()
+    cache.put("k", b"body")
+    assert cache.get("k") is None
+    assert cache.stats() == pytest.approx({"hits": 0, "misses": 1, "hit_rate": 0.0, "errors": 2,
+                                           "invalidations": 0})
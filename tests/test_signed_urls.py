@@ -0,0 +1,137 @@
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlsplit
+from urllib.request import urlopen
+
+import boto3
+import botocore.auth
+import pytest
+from botocore.config import Config
+
+from backend.signed_urls import UrlSigner, object_key
+
+KEYS = ["images/1/2/3.jpg", "images/1/2/4 copy+1.jpg", "images/7/8/é.png"]
+NOW = 1_700_000_123  # 23 seconds into a 900-second bucket
+
+
+def botocore_url(signer, key, now, endpoint_url=None, session_token=None):
+    """The URL botocore's s3v4 presigner gives for key, signed at the start of now's time bucket."""
+    signed_at = datetime.fromtimestamp(signer.current_bucket(now) * signer.bucket_seconds, timezone.utc)
+    client = boto3.client(
+        "s3", region_name=signer.region, endpoint_url=endpoint_url,
+        aws_access_key_id=signer.access_key, aws_secret_access_key=signer.secret_key,
+        aws_session_token=session_token,
+        config=Config(signature_version="s3v4", s3={"addressing_style": "path" if endpoint_url else "virtual"}),
+    )
+    original = botocore.auth.get_current_datetime
+    botocore.auth.get_current_datetime = lambda: signed_at
+    try:
+        return client.generate_presigned_url("get_object", Params={"Bucket": signer.bucket, "Key": key},
+                                             ExpiresIn=signer.expires)
+    finally:
+        botocore.auth.get_current_datetime = original
+
+
+@pytest.mark.parametrize("endpoint_url, session_token", [
+    (None, None),
+    (None, "session/token+=="),
+    ("http://127.0.0.1:9000", None),
+])
+def test_urls_are_identical_to_botocore(endpoint_url, session_token):
+    signer = UrlSigner(bucket="hotel-images", region="eu-west-1", access_key="AKIDEXAMPLE", secret_key="secret",
+                       session_token=session_token, endpoint_url=endpoint_url)
+    urls = signer.sign_many(KEYS, now=NOW)
+    assert urls == [botocore_url(signer, key, NOW, endpoint_url, session_token) for key in KEYS]
+
+
+def test_object_key():
+    assert object_key("./images/1/2/3.jpg") == "images/1/2/3.jpg"
+    assert object_key("/images/1/2/3.jpg") == "images/1/2/3.jpg"
+
+
+def signer(**kwargs):
+    return UrlSigner(bucket="hotel-images", region="us-east-1", access_key="AKIDEXAMPLE", secret_key="secret",
+                     endpoint_url=None, bucket_seconds=900, min_validity_seconds=3600, **kwargs)
+
+
+def test_urls_are_stable_within_a_bucket():
+    first = signer()
+    urls = first.sign_many(KEYS, now=NOW)
+    # Same bucket: served from the cache, and another worker process signs the same bytes
+    assert first.sign_many(KEYS, now=NOW + 600) == urls
+    assert signer().sign_many(KEYS, now=NOW + 600) == urls
+    assert first.stats() == {"cached_urls": 3, "hits": 3, "signed": 3}
+
+    assert first.sign_many(KEYS, now=NOW + 900)[0] != urls[0]
+
+
+@pytest.mark.parametrize("offset", [0, 876, 877])  # bucket start, last second of the bucket, next bucket
+def test_urls_are_resigned_before_they_expire(offset):
+    url_signer = signer()
+    url_signer.sign_many(KEYS, now=NOW)
+    url = url_signer.sign_many(KEYS[:1], now=NOW + offset)[0]
+
+    query = parse_qs(urlsplit(url).query)
+    signed_at = datetime.strptime(query["X-Amz-Date"][0], "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+    expires_at = signed_at.timestamp() + int(query["X-Amz-Expires"][0])
+    assert expires_at == url_signer.expires_at(now=NOW + offset)
+    assert expires_at - (NOW + offset) >= 3600
+    assert url_signer.signed == (3 if offset < 877 else 4)
+
+
+def test_cache_is_bounded():
+    url_signer = signer(cache_size=2)
+    url_signer.sign_many(KEYS, now=NOW)
+    assert list(url_signer.urls) == KEYS[1:]
+
+
+@pytest.fixture
+def s3_server():
+    """A local S3 stand-in (moto) with an object under each of KEYS; yields its endpoint URL."""
+    from moto.server import ThreadedMotoServer
+
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    endpoint_url = f"http://{host}:{port}"
+    client = boto3.client("s3", region_name="us-east-1", endpoint_url=endpoint_url,
+                          aws_access_key_id="test", aws_secret_access_key="test")
+    client.create_bucket(Bucket="hotel-images")
+    for key in KEYS:
+        client.put_object(Bucket="hotel-images", Key=key, Body=key.encode("utf-8"))
+    yield endpoint_url
+    server.stop()
+
+
+def test_signed_urls_fetch_from_s3_stand_in(s3_server):
+    url_signer = UrlSigner(bucket="hotel-images", region="us-east-1", access_key="test", secret_key="test",
+                           endpoint_url=s3_server)
+    for key, url in zip(KEYS, url_signer.sign_many(KEYS)):
+        with urlopen(url) as response:
+            assert response.read() == key.encode("utf-8")
+
+
+def test_search_signs_each_page_in_one_batch(backend_app, monkeypatch):
+    url_signer = UrlSigner(bucket="hotel-images", region="us-east-1", access_key="AKIDEXAMPLE", secret_key="secret",
+                           endpoint_url=None)
+    monkeypatch.setattr(backend_app, "url_signer", url_signer)
+    monkeypatch.setattr(backend_app, "STREAM_CHUNK_ROWS", 7)  # several chunks per page
+    batches = []
+    sign_many = url_signer.sign_many
+    monkeypatch.setattr(url_signer, "sign_many", lambda keys, now=None: batches.append(keys) or sign_many(keys, now))
+
+    client = backend_app.app.test_client()
+    client.post("/api/index/refresh")
+    tag = max(backend_app.indexes.tag_index.tag_counts().items(), key=lambda item: item[1])[0]
+    pages = []
+    params = {"tag": tag, "limit": 30}
+    for _ in range(2):
+        response = client.get("/api/images", query_string=params)
+        pages.append(response.get_json())  # reads the streamed body
+        params["cursor"] = response.headers["X-Next-Cursor"]
+
+    assert [len(keys) for keys in batches] == [30, 30]
+    for results in pages:
+        assert len(results) == 30
+        assert all(result["image_url"].startswith("https://hotel-images.s3.us-east-1.amazonaws.com/images/")
+                   for result in results)
+        assert {result["image_url_expires_at"] for result in results} == {url_signer.expires_at()}
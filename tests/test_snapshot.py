@@ -0,0 +1,102 @@
+import os
+from datetime import date
+
+import pyarrow as pa
+import pytest
+
+from hotel_ibs import snapshot as snapshot_module
+from hotel_ibs.snapshot import TABLES, Snapshot, current_version, write_snapshot
+
+
+def small_tables(n):
+    tables = {name: pa.table({"id": pa.array([], pa.int32())}) for name in TABLES}
+    tables["images"] = pa.table({
+        "image_id": pa.array([2, 5, 9][:n], pa.int32()),
+        "hotel_id": pa.array([1, 1, 3][:n], pa.int32()),
+        "image_url": pa.array(["./images/a.jpg", "./images/b.jpg", "./images/c.jpg"][:n], pa.string()),
+    })
+    return tables
+
+
+def test_write_publishes_and_keeps_recent_versions(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot_module, "SNAPSHOT_KEEP", 2)
+    root = str(tmp_path)
+    assert current_version(root) is None and Snapshot.open(root) is None
+
+    versions = [write_snapshot(small_tables(n), {"n": n}, root) for n in (1, 2, 3)]
+    assert len(set(versions)) == 3
+    assert current_version(root) == versions[-1]
+    assert sorted(name for name in os.listdir(root) if name != "CURRENT") == sorted(versions[1:])
+
+    snapshot = Snapshot.open(root)
+    assert snapshot.manifest["n"] == 3 and snapshot.manifest["rows"]["images"] == 3
+    assert snapshot.lookup("images", "image_id", [9, 2, 4]) == {
+        2: {"image_id": 2, "hotel_id": 1, "image_url": "./images/a.jpg"},
+        9: {"image_id": 9, "hotel_id": 3, "image_url": "./images/c.jpg"},
+    }
+    assert not snapshot.array("images", "image_id").flags.writeable  # mapped, not copied
+
+
+@pytest.fixture
+def exported(search_db, run_script, tmp_path):
+    """search_db exported by 10_export_snapshot.py; returns the opened snapshot."""
+    root = str(tmp_path / "snapshots")
+    run_script("10_export_snapshot.py", search_db, SNAPSHOT_DIR=root)
+    return Snapshot.open(root)
+
+
+def cold_indexes(backend_app):
+    """SearchIndexes loaded from the database only."""
+    indexes = backend_app.SearchIndexes()
+    with backend_app.app.app_context():
+        indexes.tag_index.refresh(backend_app.db.session, backend_app.ImageTag, backend_app.Image, backend_app.Tag)
+        indexes.calendar_index.refresh(backend_app.db.session, backend_app.AvailabilityPrice)
+        indexes.geo_index.refresh(backend_app.db.session, backend_app.Hotel)
+    return indexes
+
+
+def test_snapshot_indexes_match_the_database(backend_app, exported):
+    cold, warm = cold_indexes(backend_app), backend_app.SearchIndexes(exported)
+
+    assert len(warm.tag_index) == len(cold.tag_index) > 0
+    assert warm.tag_index.tag_counts() == cold.tag_index.tag_counts()
+    for tag in sorted(cold.tag_index.tag_counts())[:10]:
+        assert warm.tag_index.search([tag], k=50) == cold.tag_index.search([tag], k=50)
+    assert warm.calendar_index.filter_hotels(date(2025, 1, 10), date(2025, 1, 14), 0, 300) == \
+        cold.calendar_index.filter_hotels(date(2025, 1, 10), date(2025, 1, 14), 0, 300)
+    assert len(warm.geo_index) == len(cold.geo_index)
+    lat, lon = next(exported.rows("hotels", ["latitude", "longitude"]))
+    assert warm.geo_index.within_radius(lat, lon, 200) == cold.geo_index.within_radius(lat, lon, 200)
+
+
+def search_pages(client, tag):
+    response = client.get("/api/images", query_string={"tag": tag, "limit": 40, "startDate": "2025-01-05",
+                                                       "endDate": "2025-01-08"})
+    return response.get_json(), response.headers.get("X-Next-Cursor")
+
+
+def test_warm_start_serves_the_same_results(backend_app, exported, monkeypatch):
+    client = backend_app.app.test_client()
+    client.post("/api/index/refresh")
+    tag = max(backend_app.indexes.tag_index.tag_counts().items(), key=lambda item: item[1])[0]
+    cold = search_pages(client, tag)
+
+    monkeypatch.setattr(backend_app, "indexes", backend_app.SearchIndexes(exported))
+    backend_app.search_cache.invalidate()
+    assert client.post("/api/index/refresh").get_json()["snapshot"] == exported.version
+    assert search_pages(client, tag) == cold
+    assert cold[0]
+
+
+def test_snapshot_is_swapped_in_as_one_object(backend_app, exported, monkeypatch):
+    client = backend_app.app.test_client()
+    client.post("/api/index/refresh")
+    before = backend_app.indexes
+    loaded = backend_app.SearchIndexes(exported)
+    monkeypatch.setattr(backend_app, "loaded_indexes", loaded)
+
+    assert backend_app.swap_snapshot()
+    assert backend_app.indexes is loaded and backend_app.loaded_indexes is None
+    # A request that read the old object keeps a complete, unchanged set of indexes
+    assert before.snapshot is None and len(before.tag_index) == len(loaded.tag_index)
+    assert not backend_app.swap_snapshot()
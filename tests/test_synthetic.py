@@ -0,0 +1,77 @@
+import csv
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from hotel_ibs import synthetic
+from hotel_ibs.image_manifest import ImageManifest
+
+
+@pytest.fixture(scope="module")
+def dataset(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("synthetic"))
+    return path, synthetic.generate(path, scale=0.002, seed=3)
+
+
+def test_sizes_scale_with_hotels_50k():
+    assert synthetic.sizes(1) == {"chains": 92, "hotels": 50000, "images": 1000000}
+    assert synthetic.sizes(0.01) == {"chains": 9, "hotels": 500, "images": 10000}
+    assert synthetic.sizes(0) == {"chains": 2, "hotels": 10, "images": 100}
+
+
+def test_tables_have_the_shape_of_the_loader_inputs(dataset):
+    path, summary = dataset
+    chains = pd.read_csv(os.path.join(path, "dataset", "chain_info.csv"))
+    hotels = pd.read_csv(os.path.join(path, "dataset", "hotel_info.csv"))
+    images = pd.read_csv(os.path.join(path, "dataset", "train_set.csv"))
+
+    assert (len(chains), len(hotels), len(images)) == (summary["chains"], summary["hotels"], summary["images"])
+    assert list(hotels.columns) == ["hotel_id", "hotel_name", "chain_id", "latitude", "longitude"]
+    assert hotels["chain_id"].isin(chains["chain_id"]).all()
+    assert hotels["latitude"].between(-90, 90).all() and hotels["longitude"].between(-180, 180).all()
+    assert images["image_id"].is_unique and images["hotel_id"].isin(hotels["hotel_id"]).all()
+
+    manifest = ImageManifest(os.path.join(path, "image_manifest.sqlite"))
+    rows = manifest.conn.execute(
+        "SELECT path, hotel_key, image_key FROM images ORDER BY CAST(image_key AS INT)").fetchall()
+    manifest.close()
+    assert len(rows) == len(images)
+    assert [int(row[2]) for row in rows] == images["image_id"].tolist()
+    assert all(row[0].endswith(f"/{row[1]}/{row[2]}.jpg") for row in rows)
+
+
+def test_tags_look_like_the_tagger_output(dataset):
+    path, summary = dataset
+    with open(os.path.join(path, "tagged_images.csv"), newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+
+    assert len(rows) == summary["images"]
+    popularity = {}
+    for row in rows:
+        tags = json.loads(row["tags"])
+        confidences = list(tags.values())
+        assert len(tags) == synthetic.TAGS_PER_IMAGE
+        assert confidences == sorted(confidences, reverse=True) and 0 < sum(confidences) < 1
+        for tag in tags:
+            popularity[tag] = popularity.get(tag, 0) + 1
+    assert sum(tags_per_image for tags_per_image in popularity.values()) == summary["image_tags"]
+    counts = sorted(popularity.values(), reverse=True)
+    assert counts[0] > 5 * counts[len(counts) // 2]  # a few tags are on most images
+
+
+def test_same_seed_gives_the_same_data():
+    rng_a, rng_b = np.random.default_rng(7), np.random.default_rng(7)
+    image_ids = np.arange(1, 51)
+    assert list(synthetic.generate_tags(image_ids, rng_a)) == list(synthetic.generate_tags(image_ids, rng_b))
+
+
+def test_generated_data_is_reused_for_the_same_parameters(tmp_path):
+    first = synthetic.generate(str(tmp_path), scale=0, seed=1)
+    mtime = os.path.getmtime(tmp_path / "tagged_images.csv")
+    assert synthetic.generate(str(tmp_path), scale=0, seed=1) == first
+    assert os.path.getmtime(tmp_path / "tagged_images.csv") == mtime
+
+    assert synthetic.generate(str(tmp_path), scale=0, seed=2)["seed"] == 2
@@ -0,0 +1,131 @@
+import csv
+import json
+import math
+import os
+
+import pytest
+
+from hotel_ibs.tag_files import (TagShardWriter, iter_csv_chunks, iter_jsonl_chunks, parse_tags, read_checkpoint,
+                                 shard_paths, shards_to_csv)
+
+TRICKY_TAGS = {
+    "pool": 0.5,
+    "chef's table": 0.25,
+    "à la carte": 0.125,
+    'the "grand" ballroom': 0.0625,
+    "it's a \"view\"": 0.03125,  # both quotes: repr escapes one of them
+    "back\\slash": 1e-05,
+    "two\nlines": 0.75,
+    "日本庭園": 0.375,
+}
+
+
+@pytest.mark.parametrize("text, expected", [
+    (repr({"pool": 0.5, "chef's table": 0.25, "à la carte": 0.125}),
+     {"pool": 0.5, "chef's table": 0.25, "à la carte": 0.125}),
+    (json.dumps({"chef's table": 0.25, "à la carte": 0.125}, ensure_ascii=False),
+     {"chef's table": 0.25, "à la carte": 0.125}),
+    (json.dumps({"à la carte": 0.125}), {"à la carte": 0.125}),  # \u escapes, decoded by the ast fallback
+    ("{'pool': 1, 'gym': -2.5e-3}", {"pool": 1.0, "gym": -0.0025}),
+    ("{}", {}),
+    ("", {}),
+])
+def test_parse_tags(text, expected):
+    assert parse_tags(text) == expected
+
+
+def test_parse_tags_round_trips_python_repr():
+    assert parse_tags(repr(TRICKY_TAGS)) == TRICKY_TAGS
+    assert parse_tags(json.dumps(TRICKY_TAGS)) == TRICKY_TAGS
+
+
+def test_parse_tags_keeps_nan_scores():
+    assert math.isnan(parse_tags("{'pool': nan}")["pool"])
+
+
+@pytest.fixture
+def tagged_csv(tmp_path):
+    """A tagged CSV whose tags fields contain quotes, commas and line breaks; returns (path, rows)."""
+    rows = []
+    for image_id in range(1, 50):
+        tags = {tag: score for i, (tag, score) in enumerate(TRICKY_TAGS.items()) if (image_id + i) % 3}
+        rows.append((image_id, tags))
+    path = tmp_path / "tagged_images.csv"
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["image_id", "tags"])
+        for image_id, tags in rows:
+            # Some fields span lines, like a pretty-printed dict
+            writer.writerow((image_id, repr(tags).replace(", ", ",\n ") if image_id % 5 == 0 else repr(tags)))
+    return str(path), rows
+
+
+def test_chunks_cover_the_file_in_order(tagged_csv):
+    path, rows = tagged_csv
+    chunks = list(iter_csv_chunks(path, chunk_rows=10))
+    assert [len(chunk) for chunk, _ in chunks] == [10, 10, 10, 10, 9]
+    assert [row for chunk, _ in chunks for row in chunk] == rows
+    assert chunks[-1][1] == len(open(path, "rb").read())
+
+
+def test_resuming_at_a_saved_offset_yields_exactly_the_remaining_rows(tagged_csv):
+    path, rows = tagged_csv
+    done = 0
+    for chunk, offset in iter_csv_chunks(path, chunk_rows=7):
+        done += len(chunk)
+        resumed = [row for rest, _ in iter_csv_chunks(path, start_offset=offset, chunk_rows=7) for row in rest]
+        assert resumed == rows[done:]
+
+
+def tag(image_id):
+    return {"pool": image_id / 100, "chef's table": 0.5}
+
+
+def tag_images(writer, image_ids):
+    """The tagger's loop: skip finished images, write the others; returns the images it tagged."""
+    tagged = [image_id for image_id in image_ids if image_id not in writer]
+    for image_id in tagged:
+        writer.write(image_id, tag(image_id))
+    return tagged
+
+
+def test_restarted_writer_skips_finished_images(tmp_path):
+    directory = str(tmp_path / "shards")
+    with TagShardWriter(directory, shard_size=3) as writer:
+        assert tag_images(writer, range(1, 8)) == list(range(1, 8))
+    assert read_checkpoint(directory) == {"shards": ["part-00000.jsonl", "part-00001.jsonl", "part-00002.jsonl"],
+                                          "images": 7}
+
+    # A crash: two buffered results are lost, a shard is renamed but not yet in the
+    # checkpoint, another is half written, and the last listed shard ends in a torn line
+    writer = TagShardWriter(directory, shard_size=3)
+    tag_images(writer, range(8, 10))
+    with open(os.path.join(directory, "part-00003.jsonl"), "w") as f:
+        f.write(json.dumps({"image_id": 10, "tags": tag(10)}) + "\n")
+    with open(os.path.join(directory, "part-00004.jsonl.tmp"), "w") as f:
+        f.write(json.dumps({"image_id": 11, "tags": tag(11)}) + "\n")
+    with open(shard_paths(directory)[-1], "a") as f:
+        f.write(json.dumps({"image_id": 12, "tags": tag(12)})[:20])
+
+    with TagShardWriter(directory, shard_size=3) as writer:
+        assert writer.done == {str(image_id) for image_id in range(1, 8)}
+        assert tag_images(writer, range(1, 16)) == list(range(8, 16))
+
+    rows = [row for path in shard_paths(directory) for chunk, _ in iter_jsonl_chunks(path) for row in chunk]
+    assert rows == [(image_id, tag(image_id)) for image_id in range(1, 16)]
+    assert read_checkpoint(directory)["images"] == 15 and len(shard_paths(directory)) == 6
+
+    csv_path = str(tmp_path / "tagged_images.csv")
+    shards_to_csv(directory, csv_path)
+    assert [row for chunk, _ in iter_csv_chunks(csv_path) for row in chunk] == rows
+
+
+def test_only_a_torn_last_line_is_skipped(tmp_path):
+    path = tmp_path / "part-00000.jsonl"
+    lines = [json.dumps({"image_id": image_id, "tags": tag(image_id)}) for image_id in (1, 2)]
+    path.write_text(lines[0] + "\n" + lines[1][:-5])
+    assert [row for chunk, _ in iter_jsonl_chunks(str(path)) for row in chunk] == [(1, tag(1))]
+
+    path.write_text(lines[0] + "\n" + lines[1][:-5] + "\n")  # a broken line followed by more data
+    with pytest.raises(ValueError):
+        list(iter_jsonl_chunks(str(path)))
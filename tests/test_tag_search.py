@@ -0,0 +1,190 @@
+import numpy as np
+import pytest
+
+from backend import tag_index as tag_index_module
+from backend.tag_index import Posting, TagIndex
+from hotel_ibs.roaring import RoaringBitmap
+from hotel_ibs.tag_bitmaps import TagBitmaps, dequantize, quantize
+
+TAGS = ["pool", "infinity pool", "ocean", "ocean view", "gym", "kids club"]
+
+
+@pytest.fixture(scope="module")
+def image_tags():
+    """{image_id: {tag: confidence}} over several bitmap containers, with many tied confidences."""
+    rng = np.random.default_rng(18)
+    image_ids = rng.choice(300_000, size=3000, replace=False).tolist()
+    return {image_id: {tag: round(float(rng.uniform(0, 1)), 2) for tag in rng.choice(TAGS, size=3, replace=False)}
+            for image_id in image_ids}
+
+
+def hotel_of(image_id):
+    return image_id % 50
+
+
+@pytest.fixture(params=["lists", "frozen"])
+def index(request, image_tags):
+    index = TagIndex()
+    index.load_rows((image_id, tag, confidence, None, hotel_of(image_id))
+                    for image_id, tags in image_tags.items() for tag, confidence in tags.items())
+    if request.param == "frozen":  # postings as read-only arrays, as after a snapshot load
+        index.postings = {tag: Posting.frozen(np.array(posting.neg_scores), np.array(posting.image_ids))
+                          for tag, posting in index.postings.items()}
+    return index
+
+
+def reference_ranking(image_tags, terms, mode, min_confidence=0.0, hotels=None):
+    ranking = []
+    for image_id, tags in image_tags.items():
+        if hotels is not None and hotel_of(image_id) not in hotels:
+            continue
+        best = [max((c for tag, c in tags.items() if term in tag and c >= min_confidence), default=None)
+                for term in terms]
+        if all(score is None for score in best) or (mode == "and" and None in best):
+            continue
+        total = 0.0
+        for score in best:
+            if score is not None:
+                total += score
+        ranking.append((image_id, total))
+    return sorted(ranking, key=lambda item: (-item[1], item[0]))
+
+
+def all_pages(search, k):
+    pages, after = [], None
+    while True:
+        page = search(k, after)
+        if not page:
+            return pages
+        pages.extend(page)
+        after = (page[-1][1], page[-1][0])
+
+
+@pytest.mark.parametrize("terms, mode, min_confidence, hotels", [
+    (["pool"], "or", 0.0, None),
+    (["pool", "ocean"], "or", 0.0, None),
+    (["pool", "ocean"], "and", 0.3, None),
+    (["gym", "view", "kids"], "or", 0.5, {1, 2, 3, 4, 5}),
+    (["pool"], "or", 0.2, set(range(45))),
+    (["pool", "ocean"], "and", 0.0, {7}),
+    (["sauna"], "or", 0.0, None),
+])
+def test_tag_index_pages_match_full_ranking(index, image_tags, terms, mode, min_confidence, hotels):
+    expected = reference_ranking(image_tags, terms, mode, min_confidence, hotels)
+
+    def search(k, after):
+        return index.search(terms, mode=mode, min_confidence=min_confidence, k=k, hotel_ids=hotels, after=after)
+
+    assert search(25, None) == expected[:25]
+    assert all_pages(search, 37) == expected
+
+
+def test_tag_index_reads_postings_only_to_the_page(index, monkeypatch):
+    read = []
+    entries = Posting.entries
+
+    def counted(self, *args, **kwargs):
+        for entry in entries(self, *args, **kwargs):
+            read.append(entry)
+            yield entry
+
+    monkeypatch.setattr(tag_index_module.Posting, "entries", counted)
+    first = index.search(["ocean"], k=10)
+    assert len(read) < 200 < len(index.postings["ocean"]) + len(index.postings["ocean view"])
+
+    read.clear()
+    index.search(["ocean"], k=10, after=(first[-1][1], first[-1][0]))
+    assert len(read) < 200  # the walk starts at the cursor's score
+
+
+def count_work(monkeypatch):
+    """Lists of the posting entries read and of the images scored by searches."""
+    read, scored = [], []
+    entries, image_score = Posting.entries, TagIndex.image_score
+
+    def counted_entries(self, *args, **kwargs):
+        for entry in entries(self, *args, **kwargs):
+            read.append(entry)
+            yield entry
+
+    def counted_score(self, image_id, *args):
+        scored.append(image_id)
+        return image_score(self, image_id, *args)
+
+    monkeypatch.setattr(tag_index_module.Posting, "entries", counted_entries)
+    monkeypatch.setattr(tag_index_module.TagIndex, "image_score", counted_score)
+    return read, scored
+
+
+def test_few_hotels_are_scored_without_reading_postings(index, image_tags, monkeypatch):
+    read, scored = count_work(monkeypatch)
+    hotels = {3, 4}
+    allowed = index.images_of_hotels(hotels)
+    assert len(allowed) * TagIndex.DIRECT_SCORE_RATIO <= len(index.postings["pool"])
+
+    calls = []
+
+    def search(k, after):
+        calls.append(after)
+        return index.search(["pool"], k=k, hotel_ids=hotels, after=after)
+
+    assert search(10, None) == reference_ranking(image_tags, ["pool"], "or", hotels=hotels)[:10]
+    assert read == [] and sorted(scored) == sorted(allowed)
+
+    calls.clear()
+    scored.clear()
+    assert all_pages(search, 10) == reference_ranking(image_tags, ["pool"], "or", hotels=hotels)
+    assert read == [] and len(scored) == len(allowed) * len(calls)  # each page scores the hotels' images once
+
+    read.clear()
+    index.search(["pool"], k=10, hotel_ids=set(range(45)))
+    assert read  # most hotels: the walk stops early instead
+
+
+@pytest.fixture(scope="module")
+def bitmaps(image_tags):
+    tag_ids = {tag: tag_id for tag_id, tag in enumerate(TAGS)}
+    rows = sorted((tag_ids[tag], image_id, confidence)
+                  for image_id, tags in image_tags.items() for tag, confidence in tags.items())
+    return TagBitmaps.build({tag_id: tag for tag, tag_id in tag_ids.items()}, rows)
+
+
+def reference_boolean(image_tags, matches, positive_terms):
+    ranking = []
+    for image_id, tags in image_tags.items():
+        if not matches(tags):
+            continue
+        total = np.float32(0)
+        for term in positive_terms:
+            total += max((dequantize(quantize([c]))[0] for tag, c in tags.items() if term in tag),
+                         default=np.float32(0))
+        ranking.append((image_id, float(total)))
+    return sorted(ranking, key=lambda item: (-item[1], item[0]))
+
+
+def has(tags, term):
+    return any(term in tag for tag in tags)
+
+
+@pytest.mark.parametrize("expression, matches, positive_terms", [
+    ("pool AND NOT kids club", lambda tags: has(tags, "pool") and not has(tags, "kids club"), ["pool"]),
+    ("pool OR ocean", lambda tags: has(tags, "pool") or has(tags, "ocean"), ["pool", "ocean"]),
+    ("(pool OR gym) AND ocean", lambda tags: (has(tags, "pool") or has(tags, "gym")) and has(tags, "ocean"),
+     ["pool", "gym", "ocean"]),
+])
+def test_bitmap_query_pages_match_full_ranking(bitmaps, image_tags, expression, matches, positive_terms):
+    expected = reference_boolean(image_tags, matches, positive_terms)
+
+    def search(k, after):
+        return bitmaps.query(expression, k=k, after=after)
+
+    assert search(25, None) == expected[:25]
+    assert all_pages(search, 41) == expected
+
+
+def test_bitmap_query_respects_allowed(bitmaps, image_tags):
+    allowed_ids = sorted(image_tags)[::3]
+    expected = reference_boolean({i: image_tags[i] for i in allowed_ids}, lambda tags: has(tags, "gym"), ["gym"])
+    assert expected
+    found = bitmaps.query("gym", k=len(expected) + 5, allowed=RoaringBitmap.from_array(allowed_ids))
+    assert found == expected
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from backend.tag_suggest import TagSuggester, trigrams
+from hotel_ibs.vocabulary import GENERATED_TEXTS
+
+
+@pytest.fixture(scope="module")
+def counts():
+    rng = np.random.default_rng(21)
+    tags = sorted({" ".join(text.lower().split()) for text in GENERATED_TEXTS})
+    return {tag: int(count) for tag, count in zip(tags, rng.integers(1, 50, len(tags)))}
+
+
+def suggester(counts):
+    tag_suggester = TagSuggester()
+    tag_suggester.update(counts)
+    return tag_suggester
+
+
+def prefixes(counts):
+    """Every prefix of every word-suffix of every tag, plus a few that match nothing."""
+    found = {key[:i].strip() for tag in counts for key in TagSuggester._keys(tag) for i in range(1, len(key) + 1)}
+    return sorted(found) + ["zzz", "q"]
+
+
+def brute_force(counts, text, limit):
+    matches = [tag for tag in counts if any(key.startswith(text) for key in TagSuggester._keys(tag))]
+    return sorted(matches, key=lambda tag: (-counts[tag], tag))[:limit]
+
+
+def test_trigrams_are_padded_like_pg_trgm():
+    assert trigrams("pool") == {"  p", " po", "poo", "ool", "ol "}
+
+
+def test_prefix_matches_are_ranked_by_image_count(counts):
+    tag_suggester = suggester(counts)
+    for text in prefixes(counts):
+        found = [tag for tag, _ in tag_suggester.suggest(text, limit=5)]
+        expected = brute_force(counts, text, 5)
+        assert found[:len(expected)] == expected, text
+
+
+def test_incremental_updates_match_a_fresh_build(counts):
+    rng = np.random.default_rng(0)
+    tag_suggester = suggester(counts)
+    current = dict(counts)
+    for _ in range(5):
+        tags = sorted(current)
+        for tag in rng.choice(tags, 10, replace=False):
+            current[tag] = int(rng.integers(0, 80))  # 0 removes the tag
+        for i in range(3):
+            current[f"new tag {rng.integers(1000)} {i}"] = int(rng.integers(1, 80))
+        assert tag_suggester.update(current) > 0
+        current = {tag: count for tag, count in current.items() if count}
+
+        fresh = suggester(current)
+        for text in prefixes(current):
+            assert tag_suggester.suggest(text, limit=20) == fresh.suggest(text, limit=20), text
+    assert tag_suggester.update(current) == 0
+
+
+def test_typos_fall_back_to_similar_tags():
+    tag_suggester = suggester({"rooftop bar": 30, "rooftop terrace": 10, "roof garden": 5, "bar": 50})
+    assert tag_suggester.suggest("rooftp") == [("rooftop bar", 30)]
+    assert tag_suggester.suggest("rooftop terace")[0] == ("rooftop terrace", 10)
+    assert tag_suggester.suggest("ro", limit=10) == [("rooftop bar", 30), ("rooftop terrace", 10),
+                                                     ("roof garden", 5)]  # no fallback under 3 characters
+
+
+def test_input_is_normalized_and_limit_capped(counts):
+    tag_suggester = suggester(counts)
+    assert tag_suggester.suggest("   ") == []
+    assert tag_suggester.suggest("  PO ") == tag_suggester.suggest("po")
+    assert len(tag_suggester.suggest("a", limit=1000)) <= TagSuggester.MAX_RESULTS
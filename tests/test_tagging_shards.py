@@ -0,0 +1,103 @@
+import fcntl
+import os
+import subprocess
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+from hotel_ibs.embedding_store import EmbeddingStore
+from hotel_ibs.image_cache import PreprocessedImageCache, ShardedImageCache
+
+
+@pytest.fixture
+def tagging(load_script, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # clip_tagging.log
+    module = load_script("03_tag_images_(see_notebooks).py")
+    monkeypatch.setattr(module, "EMBEDDING_STORE_DIR", str(tmp_path / "embeddings"))
+    monkeypatch.setattr(module, "IMAGE_CACHE_DIR", str(tmp_path / "pixels"))
+    return module
+
+
+def finished_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_shards_are_named_by_host_and_process(tagging):
+    assert tagging.shard_suffix() == f"_{tagging.socket.gethostname()}_{os.getpid()}"
+
+
+def test_merge_shards_skips_running_processes(tagging):
+    host = tagging.socket.gethostname()
+    running = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    try:
+        pids = {"own": os.getpid(), "finished": finished_pid(), "running": running.pid}
+        for i, pid in enumerate(pids.values()):
+            shard = EmbeddingStore(f"{tagging.EMBEDDING_STORE_DIR}_{host}_{pid}", dim=512)
+            shard.append([str(i)], np.full((1, 512), i, dtype=np.float32))
+        other_pid = finished_pid()
+        EmbeddingStore(f"{tagging.EMBEDDING_STORE_DIR}_otherhost_{other_pid}", dim=512)
+
+        tagging.merge_shards()
+
+        main = EmbeddingStore(tagging.EMBEDDING_STORE_DIR)
+        assert sorted(main.image_ids) == ["0", "1"]
+        # The running process's shard and the other machine's are left alone
+        shards = sorted(name for name in os.listdir(os.path.dirname(tagging.EMBEDDING_STORE_DIR))
+                        if name.startswith("embeddings_"))
+        assert shards == sorted([f"embeddings_{host}_{pids['running']}", f"embeddings_otherhost_{other_pid}"])
+    finally:
+        running.kill()
+        running.wait()
+
+
+def write_shard(path, image_ids):
+    shard = EmbeddingStore(path, dim=512)
+    shard.append(image_ids, np.ones((len(image_ids), 512), dtype=np.float32))
+
+
+def test_merges_wait_for_the_lock_and_merge_each_shard_once(tagging):
+    host = tagging.socket.gethostname()
+    write_shard(f"{tagging.EMBEDDING_STORE_DIR}_{host}_{finished_pid()}", ["1", "2"])
+    write_shard(f"{tagging.EMBEDDING_STORE_DIR}_{host}_{os.getpid()}", ["3"])
+    os.makedirs(tagging.EMBEDDING_STORE_DIR)
+
+    with open(os.path.join(tagging.EMBEDDING_STORE_DIR, ".lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)  # another machine merging
+        mergers = [threading.Thread(target=tagging.merge_shards) for _ in range(3)]
+        for merger in mergers:
+            merger.start()
+        mergers[0].join(0.5)
+        assert mergers[0].is_alive()
+        assert EmbeddingStore(tagging.EMBEDDING_STORE_DIR, dim=512).image_ids == []
+    for merger in mergers:
+        merger.join()
+
+    assert sorted(EmbeddingStore(tagging.EMBEDDING_STORE_DIR).image_ids) == ["1", "2", "3"]
+    assert not [name for name in os.listdir(os.path.dirname(tagging.EMBEDDING_STORE_DIR))
+                if name.startswith("embeddings_")]
+
+
+def test_shard_left_by_a_dead_merge_is_merged(tagging):
+    host = tagging.socket.gethostname()
+    write_shard(f"{tagging.EMBEDDING_STORE_DIR}_{host}_{finished_pid()}.merging", ["7"])
+    write_shard(f"{tagging.EMBEDDING_STORE_DIR}_otherhost_{finished_pid()}.merging", ["8"])
+
+    tagging.merge_shards()
+
+    assert EmbeddingStore(tagging.EMBEDDING_STORE_DIR).image_ids == ["7"]
+
+
+def test_sharded_image_cache_reads_main_and_writes_shard(tmp_path):
+    main = PreprocessedImageCache(str(tmp_path / "pixels"), size=2)
+    main.append(["1"], np.ones((1, 2, 2, 3), dtype=np.uint8))
+
+    cache = ShardedImageCache(str(tmp_path / "pixels"), str(tmp_path / "pixels_shard"), size=2)
+    cache.append(["2"], np.full((1, 2, 2, 3), 2, dtype=np.uint8))
+
+    assert "1" in cache and "2" not in cache
+    assert PreprocessedImageCache(str(tmp_path / "pixels"), size=2).image_ids == ["1"]
+    assert PreprocessedImageCache(str(tmp_path / "pixels_shard"), size=2).image_ids == ["2"]